@@ -0,0 +1,20 @@
+::
+:: Win32 batch file to start the TortoiseGit status cache server
+::
+
+@echo off
+setlocal
+
+:: Look in the registry for TortoiseGit location
+for /f "skip=2 tokens=3*" %%A in (
+    '"reg query "HKEY_LOCAL_MACHINE\SOFTWARE\TortoiseGit" /ve 2> nul"' ) do set TortoisePath=%%B
+if "%TortoisePath%"=="" (goto :notfound) else (goto :cachesrv)
+
+:cachesrv
+python "%TortoisePath%\cachesrv.py" %*
+goto end
+
+:notfound
+echo cachesrv: cannot find TortoiseGit location in the registry.
+
+:end
@@ -0,0 +1,16 @@
+#
+# front-end for the TortoiseGit status cache server
+#
+
+import sys
+
+if not sys.stdin or not sys.stdin.isatty():
+    try:
+        import win32traceutil
+    except ImportError:
+        pass
+
+from tortoisegit import cachesrv
+
+if __name__=='__main__':
+    cachesrv.run(sys.argv[1:])
@@ -12,8 +12,6 @@
 import gconf
 import gtk
 import gobject
-from mercurial import hg, ui, util, repo
-from mercurial.node import short
 import nautilus
 import os
 import subprocess
@@ -25,14 +23,36 @@ import urllib
 TORTOISEHG_PATH = '~/tools/tortoisehg-dev'
 TERMINAL_KEY = '/desktop/gnome/applications/terminal/exec'
 
+# milliseconds between closing the repositories left idle
+REAP_INTERVAL = 60000
+
+# emblem and status for each state reported by the status cache server
+CACHE_STATES = {
+    'unchanged' : ('default', 'clean'),
+    'modified' : ('cvs-modified', 'modified'),
+    'added' : ('cvs-aded', 'added'),
+    'unknown' : ('new', 'unrevisioned'),
+    'ignored' : (None, 'ignored'),
+}
+
+# property page rows filled in once the file's metadata is loaded
+META_ROWS = (
+    ('status', '<b>Status</b>:'),
+    ('node', '<b>Last-Commit</b>:'),
+    ('summary', '<b>Last-Commit-Description</b>:'),
+    ('date', '<b>Last-Commit-Date</b>:'),
+    ('author', '<b>Last-Commit-User</b>:'),
+    ('tags', '<b>Tags</b>:'),
+    ('branch', '<b>Branch</b>:'),
+)
+
 class HgExtension(nautilus.MenuProvider,
                   nautilus.ColumnProvider,
                   nautilus.InfoProvider,
                   nautilus.PropertyPageProvider):
 
     def __init__(self):
-        self.cacherepo = None
-        self.cacheroot = None
+        self.repos = None
         self.client = gconf.client_get_default()
         thgpath = os.environ.get('TORTOISEHG_PATH',
                 os.path.expanduser(TORTOISEHG_PATH))
@@ -40,6 +60,39 @@ class HgExtension(nautilus.MenuProvider,
         os.environ['THG_ICON_PATH'] = os.path.join(thgpath, 'icons')
         self.hgproc = os.path.join(thgpath, 'hgproc.py')
         self.ipath = os.path.join(thgpath, 'icons', 'tortoise')
+        self.cacheclient = None
+        self.localcache = None
+        self.dircache = None
+        self.requests = None
+        self.updates = {}
+        self.meta = None
+        self.meta_files = {}
+        self.meta_pages = {}
+        self.dialoghost = None
+        self.find_root = self._find_root
+        self.write_list_file = self._write_list_file
+        try:
+            sys.path.insert(0, thgpath)
+            from tortoisegit import cachesrv, dialoghost, dircache, filemeta
+            from tortoisegit import menumodel, tgitutil
+            self.dircache = dircache.DirStatusCache(self._fetch_dir)
+            self.meta = filemeta.MetaCache(self.dircache.load,
+                    self._meta_ready)
+            self.repos = dircache.RepoCache(menumodel.RepoHandle,
+                    self._close_repo)
+            gobject.timeout_add(REAP_INTERVAL, self._reap_repos)
+            self.requests = dircache.StatusRequests(self.dircache,
+                    self._update_ready)
+            self.pending_state = dircache.PENDING
+            gobject.threads_init()
+            self.dialoghost = dialoghost
+            self.write_list_file = tgitutil.write_list_file
+            self.find_root = tgitutil.find_root
+            self.cacheclient = cachesrv.StatusClient()
+            if not self.cacheclient.ping():
+                cachesrv.start_server()
+        except ImportError:
+            pass
 
     def icon(self, iname):
         return os.path.join(self.ipath, iname)
@@ -49,33 +102,66 @@ class HgExtension(nautilus.MenuProvider,
             return None
         return urllib.unquote(vfs_file.get_uri()[7:])
 
-    def clear_cached_repo(self):
-        self.cacheroot = None
-        self.cacherepo = None
+    def clear_cached_repo(self, root=None):
+        if self.repos is not None:
+            self.repos.invalidate(root)
+        if self.meta is not None:
+            self.meta.invalidate(root)
+        if self.dircache is not None and root is None:
+            self.dircache.invalidate()
 
-    def get_repo_for_path(self, path):
+    def _close_repo(self, root, handle):
+        # states may have changed while the repository was open
+        self.dircache.invalidate_tree(root)
+
+    def _reap_repos(self):
+        self.repos.reap()
+        return True
+
+    def _fetch_dir(self, pdir):
+        '''
+        States of the entries of pdir, from the status cache server
+        or computed here if it isn't running
         '''
-        Find mercurial repository for vfs_file
-        Returns hg.repo
+        states = None
+        if self.cacheclient is not None:
+            states = self.cacheclient.dir_status(pdir)
+        if states is None:
+            from tortoisegit import statuscache
+            if self.localcache is None:
+                self.localcache = statuscache.StatusCache()
+            states = self.localcache.get_dir_states(pdir)
+        return states
+
+    def _find_root(self, path):
+        '''
+        Uncached root lookup, for when tortoisegit can't be imported
         '''
         p = os.path.isdir(path) and path or os.path.dirname(path)
-        while not os.path.isdir(os.path.join(p, ".hg")):
+        while not os.path.exists(os.path.join(p, ".git")):
             oldp = p
             p = os.path.dirname(p)
             if p == oldp:
                 return None
+        return p
 
-        if p == self.cacheroot:
-            return self.cacherepo
-        # Keep one repo cached
-        try:
-            self.cacheroot = p
-            self.cacherepo = hg.repository(ui.ui(), path=p)
-            return self.cacherepo
-        except repo.RepoError:
-            self.cacheroot = None
-            self.cacherepo = None
+    def _write_list_file(self, paths):
+        '''
+        NUL separated file list, for when tortoisegit can't be imported
+        '''
+        fd, tmpfile = tempfile.mkstemp(prefix="tortoisegit_filelist_")
+        os.write(fd, "".join([p + "\0" for p in paths]))
+        os.close(fd)
+        return tmpfile
+
+    def get_repo_for_path(self, path):
+        '''
+        Find git repository for path
+        Returns menumodel.RepoHandle, or None without tortoisegit
+        '''
+        if self.repos is None:
             return None
+        return self.repos.find(path)
 
     def _open_terminal_cb(self, window, vfs_file):
         path = self.get_path_for_vfs_file(vfs_file)
@@ -90,14 +176,12 @@ class HgExtension(nautilus.MenuProvider,
 
     def _add_cb(self, window, vfs_files):
         self._run_dialog('add', vfs_files)
-        self.clear_cached_repo()
 
     def _clone_cb(self, window, vfs_file):
         self._run_dialog('clone', [vfs_file])
 
     def _commit_cb(self, window, vfs_files):
         self._run_dialog('commit', vfs_files)
-        self.clear_cached_repo()
 
     def _datamine_cb(self, window, vfs_files):
         self._run_dialog('datamine', vfs_files)
@@ -109,29 +193,26 @@ class HgExtension(nautilus.MenuProvider,
         repo = self.get_repo_for_path(path)
         if repo is None:
             return
-        diffcmd = repo.ui.config('tortoisehg', 'vdiff', None)
+        diffcmd = repo.config('vdiff')
         if diffcmd is None:
             self._run_dialog('diff', vfs_files)
         else:
-            cmdline = ['hg', diffcmd]
+            cmdline = ['git', diffcmd]
             cwd = os.path.isdir(path) and path or os.path.dirname(path)
             paths = [self.get_path_for_vfs_file(f) for f in vfs_files]
             subprocess.Popen(cmdline + paths, shell=False, cwd=cwd)
 
     def _history_cb(self, window, vfs_files):
         self._run_dialog('history', vfs_files)
-        self.clear_cached_repo()
 
     def _init_cb(self, window, vfs_file):
         self._run_dialog('init', [vfs_file])
 
     def _recovery_cb(self, window, vfs_file):
         self._run_dialog('recovery', [vfs_file])
-        self.clear_cached_repo()
 
     def _revert_cb(self, window, vfs_files):
         self._run_dialog('revert', vfs_files)
-        self.clear_cached_repo()
 
     def _serve_cb(self, window, vfs_file):
         self._run_dialog('serve', [vfs_file], filelist=False)
@@ -141,7 +222,6 @@ class HgExtension(nautilus.MenuProvider,
 
     def _sync_cb(self, window, vfs_file):
         self._run_dialog('synch', [vfs_file], filelist=False)
-        self.clear_cached_repo()
 
     def _thgconfig_repo_cb(self, window, vfs_file):
         self._run_dialog('config', [vfs_file])
@@ -150,9 +230,7 @@ class HgExtension(nautilus.MenuProvider,
         self._run_dialog('config', [vfs_file], filelist=False)
 
     def _unmerge_cb(self, window, vfs_file):
-        self._run_dialog('checkout', [vfs_file], filelist=False,
-                extras=['--', '--clean', str(self.rev0)])
-        self.clear_cached_repo()
+        self._run_dialog('merge', [vfs_file], filelist=False)
 
     def _run_dialog(self, hgcmd, vfs_files, filelist=True, extras=[]):
         '''
@@ -181,17 +259,20 @@ class HgExtension(nautilus.MenuProvider,
         if filelist:
             # Use temporary file to store file list (avoid shell command
             # line limitations)
-            fd, tmpfile = tempfile.mkstemp(prefix="tortoisehg_filelist_")
-            os.write(fd, "\n".join(paths))
-            os.close(fd)
+            tmpfile = self.write_list_file(paths)
             cmdopts += ['--listfile', tmpfile, '--deletelistfile']
         cmdopts.extend(extras)
 
-        subprocess.Popen(cmdopts, cwd=cwd, shell=False)
+        # the dialog host has GTK loaded already
+        if self.dialoghost is None or \
+                not self.dialoghost.open_dialog(cmdopts[2:]):
+            subprocess.Popen(cmdopts, cwd=cwd, shell=False)
 
         # Remove cached repo object, dirstate may change
-        self.cacherepo = None
-        self.cacheroot = None
+        if repo is not None:
+            self.clear_cached_repo(root)
+        else:
+            self.clear_cached_repo()
 
     def get_background_items(self, window, vfs_file):
         '''Build context menu for current directory'''
@@ -226,8 +307,7 @@ class HgExtension(nautilus.MenuProvider,
             items.append(item)
             return items
 
-        if len(repo.workingctx().parents()) > 1:
-            self.rev0 = repo.workingctx().parents()[0].rev()
+        if repo.merging():
             item = nautilus.MenuItem('HgNautilus::undomerge',
                                  'Undo Merge',
                                  'Clean checkout of original parent revision',
@@ -359,17 +439,15 @@ class HgExtension(nautilus.MenuProvider,
             items.append(item)
             return items
 
-        localpaths = []
+        states = set()
         for vfs_file in vfs_files:
             path = self.get_path_for_vfs_file(vfs_file)
-            if path is None:
-                continue
-            localpath = path[len(repo.root)+1:]
-            localpaths.append(localpath)
-
-        changes = repo.dirstate.status(localpaths, util.always, True, True)
-        (lookup, modified, added, removed, deleted, unknown,
-                ignored, clean) = changes
+            if path is not None:
+                states.add(self._get_file_status(path)[1])
+        unknown = 'unrevisioned' in states
+        modified = 'modified' in states
+        added = 'added' in states
+        clean = 'clean' in states
 
         # Add menu items based on states list
         if unknown:
@@ -380,7 +458,7 @@ class HgExtension(nautilus.MenuProvider,
             item.connect('activate', self._add_cb, vfs_files)
             items.append(item)
 
-        if modified or added or removed or deleted or unknown:
+        if modified or added or unknown:
             item = nautilus.MenuItem('HgNautilus::commit',
                                  'Commit Files',
                                  'Commit changes',
@@ -420,41 +498,28 @@ class HgExtension(nautilus.MenuProvider,
         return items
 
     def get_columns(self):
-        return nautilus.Column("HgNautilus::hg_status",
-                               "hg_status",
-                               "HG Status",
-                               "Version control status"),
-
-    def _get_file_status(self, repo, localpath):
-        emblem = None
-        status = '?'
-
-        # This is not what the API is optimized for, but this appears
-        # to work efficiently enough
-        changes = repo.dirstate.status([localpath], util.always, True, True)
-        (lookup, modified, added, removed, deleted, unknown,
-                ignored, clean) = changes
-
-        if localpath in clean:
-            emblem = 'default'
-            status = 'clean'
-        elif localpath in modified:
-            emblem = 'cvs-modified'
-            status = 'modified'
-        elif localpath in added:
-            emblem = 'cvs-aded'
-            status = 'added'
-        elif localpath in unknown:
-            emblem = 'new'
-            status = 'unrevisioned'
-        elif localpath in ignored:
-            status = 'ignored'
-        elif localpath in deleted:
-            # Should be hard to reach this state
-            emblem = 'stockmail-priority-high'
-            status = 'deleted'
-        return emblem, status
-
+        return (nautilus.Column("HgNautilus::hg_status",
+                                "hg_status",
+                                "HG Status",
+                                "Version control status"),
+                nautilus.Column("HgNautilus::hg_author",
+                                "hg_author",
+                                "Last Author",
+                                "Author of the last commit of the file"),
+                nautilus.Column("HgNautilus::hg_last_commit",
+                                "hg_last_commit",
+                                "Last Commit",
+                                "Last commit touching the file"))
+
+    def _get_file_status(self, path):
+        # Status of the whole directory is fetched for its first file
+        state = self.dircache.get_state(path)
+        return CACHE_STATES.get(state, (None, '?'))
+
+    def _add_file_info(self, file, emblem, status):
+        if emblem is not None:
+            file.add_emblem(emblem)
+        file.add_string_attribute('hg_status', status)
 
     def update_file_info(self, file):
         '''Return emblem and hg status for this file'''
@@ -464,75 +529,163 @@ class HgExtension(nautilus.MenuProvider,
         repo = self.get_repo_for_path(path)
         if repo is None:
             return
-        localpath = path[len(repo.root)+1:]
-        emblem, status = self._get_file_status(repo, localpath)
-        if emblem is not None:
-            file.add_emblem(emblem)
-        file.add_string_attribute('hg_status', status)
+        emblem, status = self._get_file_status(path)
+        self._add_file_info(file, emblem, status)
+        self._add_meta_info(file, repo.root, path)
+
+    def _add_meta_info(self, file, root, path):
+        '''
+        Add the last commit columns, or have the metadata of the file's
+        directory loaded and the file updated again then
+        '''
+        if self.meta is None:
+            return
+        meta = self.meta.get(root, path)
+        if meta is None:
+            pdir = os.path.dirname(path)
+            self.meta_files.setdefault(pdir, []).append(file)
+            self.meta.load(root, pdir)
+        elif meta.node is not None:
+            file.add_string_attribute('hg_author', meta.author)
+            file.add_string_attribute('hg_last_commit',
+                    '%s %s' % (meta.node[:12], meta.summary))
+
+    def _meta_ready(self, pdir):
+        # worker thread: hand over to the main loop
+        gobject.idle_add(self._meta_done, pdir)
+
+    def _meta_done(self, pdir):
+        for file in self.meta_files.pop(pdir, []):
+            file.invalidate_extension_info()
+        for root, path, labels in self.meta_pages.pop(pdir, []):
+            self._fill_page(labels, self.meta.get(root, path))
+        return False
+
+    def update_file_info_full(self, provider, handle, closure, file):
+        '''
+        Asynchronous update_file_info: status not cached yet is computed
+        by the worker thread, and the request completed when it's known
+        '''
+        path = self.get_path_for_vfs_file(file)
+        if path is None or file.is_directory():
+            return nautilus.OPERATION_COMPLETE
+        if self.requests is None or \
+                self.dircache.is_loaded(os.path.dirname(path)):
+            self.update_file_info(file)
+            return nautilus.OPERATION_COMPLETE
+        if self.find_root(path) is None:
+            return nautilus.OPERATION_COMPLETE
+        self.updates[handle] = (provider, closure, file)
+        self.requests.request(handle, path)
+        self.requests.start()
+        return nautilus.OPERATION_IN_PROGRESS
+
+    def cancel_update(self, provider, handle):
+        '''Nautilus lost interest in the file, e.g. left its folder'''
+        if self.updates.pop(handle, None) is not None:
+            self.requests.cancel(handle)
+
+    def _update_ready(self, handle, state):
+        # worker thread: hand over to the main loop
+        gobject.idle_add(self._update_done, handle, state)
+
+    def _update_done(self, handle, state):
+        try:
+            provider, closure, file = self.updates.pop(handle)
+        except KeyError:
+            return False    # cancelled meanwhile
+        path = self.get_path_for_vfs_file(file)
+        if state == self.pending_state:
+            result = nautilus.OPERATION_FAILED
+        else:
+            result = nautilus.OPERATION_COMPLETE
+            if state in CACHE_STATES:
+                self._add_file_info(file, *CACHE_STATES[state])
+                self._add_meta_info(file, self.find_root(path), path)
+        nautilus.info_provider_update_complete_invoke(closure, provider,
+                handle, result)
+        if state is None and self.dircache.is_loaded(os.path.dirname(path)):
+            # not known to the cache, ask again for the slow path
+            file.invalidate_extension_info()
+        return False
 
     # property page borrowed from http://www.gnome.org/~gpoo/hg/nautilus-hg/
     def __add_row(self, table, row, label_item, label_value):
-        label = gtk.Label(label_item)
-        label.set_use_markup(True)
-        label.set_alignment(1, 0)
-        table.attach(label, 0, 1, row, row + 1, gtk.FILL, gtk.FILL, 0, 0)
-        label.show()
+        title = gtk.Label(label_item)
+        title.set_use_markup(True)
+        title.set_alignment(1, 0)
+        table.attach(title, 0, 1, row, row + 1, gtk.FILL, gtk.FILL, 0, 0)
+        title.show()
 
         label = gtk.Label(label_value)
         label.set_use_markup(True)
         label.set_alignment(0, 1)
         label.show()
         table.attach(label, 1, 2, row, row + 1, gtk.FILL, 0, 0, 0)
-
-    def get_property_pages(self, vfs_files):
-        if len(vfs_files) != 1:
+        return title, label
+
+    def _set_row(self, labels, key, value):
+        """fill in a row that is only shown when there is something"""
+        title, label = labels[key]
+        label.set_text(value)
+        if not value:
+            title.hide()
+            label.hide()
+
+    def _fill_page(self, labels, meta):
+        if meta is None:
             return
-        file = vfs_files[0]
-        path = self.get_path_for_vfs_file(file)
-        if path is None or file.is_directory():
+        status = CACHE_STATES.get(meta.state, (None, meta.state or '?'))[1]
+        labels['status'][1].set_text(status)
+        if meta.node is None:
+            for key in ('node', 'summary', 'date', 'author'):
+                labels[key][1].set_text('-')
+            self._set_row(labels, 'tags', '')
             return
-        repo = self.get_repo_for_path(path)
-        if repo is None:
+        labels['node'][1].set_text(meta.node[:12])
+        labels['summary'][1].set_text(meta.summary)
+        labels['date'][1].set_text(time.strftime("%Y-%m-%d %H:%M:%S",
+                time.gmtime(meta.date)))
+        labels['author'][1].set_text(meta.author)
+        self._set_row(labels, 'tags', ', '.join(meta.tags))
+
+    def _get_lazy_property_pages(self, path):
+        '''
+        Property page shown right away, filled in when the metadata of
+        the file's directory is loaded
+        '''
+        root = self.find_root(path)
+        if root is None:
             return
-
-        localpath = path[len(repo.root)+1:]
-        emblem, status = self._get_file_status(repo, localpath)
-
-        # Get the information from Mercurial
-        ctx = repo.workingctx().parents()[0]
-        try:
-            fctx = ctx.filectx(localpath)
-            rev = fctx.filelog().linkrev(fctx.filenode())
-        except:
-            rev = ctx.rev()
-        ctx = repo.changectx(rev)
-        node = short(ctx.node())
-        date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ctx.date()[0]))
-        parents = '\n'.join([short(p.node()) for p in ctx.parents()])
-        description = ctx.description()
-        user = ctx.user()
-        user = gobject.markup_escape_text(user)
-        tags = ', '.join(ctx.tags())
-        branch = ctx.branch()
-
-        self.property_label = gtk.Label('Mercurial')
-
-        table = gtk.Table(7, 2, False)
+        table = gtk.Table(len(META_ROWS), 2, False)
         table.set_border_width(5)
         table.set_row_spacings(5)
         table.set_col_spacings(5)
-
-        self.__add_row(table, 0, '<b>Status</b>:', status)
-        self.__add_row(table, 1, '<b>Last-Commit-Revision</b>:', str(rev))
-        self.__add_row(table, 2, '<b>Last-Commit-Description</b>:', description)
-        self.__add_row(table, 3, '<b>Last-Commit-Date</b>:', date)
-        self.__add_row(table, 4, '<b>Last-Commit-User</b>:', user)
-        if tags:
-            self.__add_row(table, 5, '<b>Tags</b>:', tags)
-        if branch != 'default':
-            self.__add_row(table, 6, '<b>Branch</b>:', branch)
-
+        labels = {}
+        for row, (key, title) in enumerate(META_ROWS):
+            labels[key] = self.__add_row(table, row, title, '...')
         table.show()
+        repo = self.get_repo_for_path(path)
+        self._set_row(labels, 'branch', repo and repo.branch() or '')
+
+        meta = self.meta.get(root, path)
+        if meta is None:
+            pdir = os.path.dirname(path)
+            self.meta_pages.setdefault(pdir, []).append((root, path, labels))
+            self.meta.load(root, pdir)
+        else:
+            self._fill_page(labels, meta)
 
+        self.property_label = gtk.Label('Git')
         return nautilus.PropertyPage("MercurialPropertyPage::status",
                                      self.property_label, table),
+
+    def get_property_pages(self, vfs_files):
+        if len(vfs_files) != 1:
+            return
+        file = vfs_files[0]
+        path = self.get_path_for_vfs_file(file)
+        if path is None or file.is_directory():
+            return
+        if self.meta is not None:
+            return self._get_lazy_property_pages(path)
@@ -186,7 +186,7 @@ class CloneDialog(gtk.Window):
         vbox.pack_end(lbl, False, False, 1)
 
     def _close_clicked(self, toolbutton, data=None):
-        gtk.main_quit()
+        self.destroy()
 
     def _toolbutton(self, stock, label, handler,
                     menu=None, userdata=None, tip=None):
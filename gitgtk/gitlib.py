@@ -9,6 +9,7 @@ from mercurial.repo import RepoError
 from mercurial.node import *
 from mercurial.i18n import _
 from dialog import entry_dialog
+from tortoisegit.tgitutil import find_root
 
 try:
     try:
@@ -61,16 +62,10 @@ def fromutf(s):
     return s.decode('utf-8').encode(util._fallbackencoding)
 
 def rootpath(path=None):
-    """ find Mercurial's repo root of path """
+    """ find the repo root of path, or '' """
     if not path:
         path = os.getcwd()
-    p = os.path.isdir(path) and path or os.path.dirname(path)
-    while not os.path.isdir(os.path.join(p, ".hg")):
-        oldp = p
-        p = os.path.dirname(p)
-        if p == oldp:
-            return ''
-    return p
+    return find_root(path) or ''
 
 
 class GtkUi(ui.ui):
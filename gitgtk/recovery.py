@@ -112,7 +112,7 @@ class RecoveryDialog(gtk.Window):
         if self._cmd_running():
             error_dialog(self, "Can't close now", "command is running")
         else:
-            gtk.main_quit()
+            self.destroy()
         
     def _toolbutton(self, stock, label, handler,
                     menu=None, userdata=None, tip=None):
@@ -226,6 +226,7 @@ class RecoveryDialog(gtk.Window):
 
 def run(cwd='', root='', **opts):
     dialog = RecoveryDialog(cwd, root)
+    dialog.connect('destroy', gtk.main_quit)
     dialog.show_all()
     gtk.gdk.threads_init()
     gtk.gdk.threads_enter()
@@ -144,11 +144,11 @@ class ServeDialog(gtk.Window):
             
     def _close_clicked(self, *args):
         if self._server_stopped() == True:
-            gtk.main_quit()
+            self.destroy()
         
     def _delete(self, widget, event):
         if self._server_stopped() == True:
-            gtk.main_quit()
+            return False
         else:
             return True
 
@@ -348,6 +348,7 @@ thg_serve_cmd =  {"^serve":
 
 def run(cwd='', root='', **opts):
     dialog = ServeDialog(cwd, root)
+    dialog.connect('destroy', gtk.main_quit)
     dialog.show_all()
     gtk.gdk.threads_init()
     gtk.gdk.threads_enter()
@@ -323,7 +323,7 @@ class SynchDialog(gtk.Window):
             error_dialog(self, "Can't close now", "command is running")
         else:
             self._save_settings()
-            gtk.main_quit()
+            self.destroy()
         
     def _save_settings(self):
         self._settings.set_value('_pull_update_state',
@@ -529,6 +529,7 @@ class SynchDialog(gtk.Window):
 
 def run(cwd='', root='', files=[], **opts):
     dialog = SynchDialog(cwd, root, files)
+    dialog.connect('destroy', gtk.main_quit)
     dialog.show_all()
     gtk.gdk.threads_init()
     gtk.gdk.threads_enter()
@@ -16,6 +16,9 @@ import iniparse
 
 _unspecstr = '<unspecified>'
 
+# settings read under an older name when not set under their own
+_renamed = { 'tortoisegit.overlayicons' : 'tortoisehg.overlayicons' }
+
 class ConfigDialog(gtk.Dialog):
     def __init__(self, root='',
             configrepo=False,
@@ -89,7 +92,7 @@ class ConfigDialog(gtk.Dialog):
                 ('Copy Hash', 'tortoisehg.copyhash', ['False', 'True'],
                     'Allow the changelog viewer to copy hash of currently'
                     ' selected changeset into the clipboard. Default: False'),
-                ('Overlay Icons', 'tortoisehg.overlayicons',
+                ('Overlay Icons', 'tortoisegit.overlayicons',
                     ['False', 'True', 'localdisks'],
                     'Display overlay icons in Explorer windows.'
                     ' Default: True'))
@@ -518,6 +521,8 @@ class ConfigDialog(gtk.Dialog):
             section, key = cpath.split('.', 1)
             return self.ini[section][key]
         except KeyError:
+            if cpath in _renamed:
+                return self.get_ini_config(_renamed[cpath])
             return None
         
     def load_config(self, rcpath):
@@ -533,6 +538,13 @@ class ConfigDialog(gtk.Dialog):
         return iniparse.INIConfig(file(fn))
 
     def record_new_value(self, cpath, newvalue, keephistory=True):
+        if cpath in _renamed:
+            # the value under the old name is superseded
+            oldsection, oldkey = _renamed[cpath].split('.', 1)
+            try:
+                del self.ini[oldsection][oldkey]
+            except KeyError:
+                pass
         section, key = cpath.split('.', 1)
         if newvalue == _unspecstr:
             try:
@@ -0,0 +1,344 @@
+"""Persistent revision graph layout.
+
+Laying out the whole history of a large repository takes long, and
+the history window did it again every time it opened.  CachedGrapher
+saves the rows it lays out in the repository (.hg/thggraph), along
+with the heads they were computed from, and reads them back the next
+time.  When commits were added since, only the rows of the new
+revisions are laid out: if they only leave the lane of the saved tip,
+on the first parent line of the newest head as it was, the saved rows
+follow unchanged but for their colors, which are renumbered on the fly.
+
+Rows are saved as flat integer arrays, compressed by blocks so that
+reopening only decompresses the rows shown.  Blocks are grouped in
+segments, each with its own color renumbering, so that splicing new
+rows in front never rewrites the old ones.  A layout the window
+didn't read to the end is saved with the state it stopped at, and
+carried on from there.
+
+The file is written with marshal, never pickle: it comes with the
+repository, and reading it must not run anything.  Anything but what
+write_graph_cache writes is ignored.
+"""
+
+import os
+import zlib
+import marshal
+from array import array
+from revgraph import LaneState, layout_rows
+
+GRAPH_CACHE_NAME = 'thggraph'
+GRAPH_CACHE_MAGIC = 'thggraph'
+GRAPH_CACHE_VERSION = 3
+
+# rows compressed together
+BLOCK_ROWS = 4096
+
+# segments kept before the layout is computed again from scratch
+MAX_SEGMENTS = 32
+
+def _parents(repo, rev):
+    return [x for x in repo.changelog.parentrevs(rev) if x >= 0]
+
+class _Block(object):
+    """
+    Rows as arrays: column and color of the node of each row, number
+    of edges of each row, and the (col, next_col, color) of each edge;
+    compressed into blob when saved or read, decompressed when needed.
+    """
+    __slots__ = ('n', 'blob', 'arrays')
+
+    def __init__(self, n=0, blob=None):
+        self.n = n
+        self.blob = blob
+        self.arrays = None
+        if blob is None:
+            self.arrays = (array('i'), array('i'), array('i'))
+
+    def append(self, row):
+        rev, (col, color), lines, parents = row
+        nodes, nlines, edges = self.decode()
+        nodes.extend((col, color))
+        nlines.append(len(lines))
+        for edge in lines:
+            edges.extend(edge)
+        self.n += 1
+        self.blob = None
+
+    def decode(self):
+        if self.arrays is None:
+            a = array('i')
+            a.fromstring(zlib.decompress(self.blob))
+            n = self.n
+            if len(a) < 3*n or len(a) != 3*n + 3*sum(a[2*n:3*n]):
+                raise ValueError('corrupt graph layout block')
+            self.arrays = (a[:2*n], a[2*n:3*n], a[3*n:])
+        return self.arrays
+
+    def release(self):
+        """drop the arrays if they can be had again from the blob"""
+        if self.blob is not None:
+            self.arrays = None
+
+    def encode(self):
+        if self.blob is None:
+            self.blob = zlib.compress(
+                    ''.join([a.tostring() for a in self.arrays]), 1)
+        return (self.n, self.blob)
+
+class _Segment(object):
+    """
+    Consecutive rows, in blocks.  Colors are renumbered by color(): 0
+    becomes zero, and the others are shifted by shift.
+    """
+
+    def __init__(self, zero=0, shift=0, blocks=None):
+        self.zero = zero
+        self.shift = shift
+        self.blocks = blocks or []
+
+    def __len__(self):
+        return sum([b.n for b in self.blocks])
+
+    def color(self, c):
+        if c == 0:
+            return self.zero
+        return c + self.shift
+
+    def renumber(self, zero, shift):
+        """have colors renumbered by (zero, shift) after our own"""
+        if self.zero == 0:
+            self.zero = zero
+        else:
+            self.zero += shift
+        self.shift += shift
+
+    def append(self, row):
+        if not self.blocks or self.blocks[-1].n >= BLOCK_ROWS:
+            self.blocks.append(_Block())
+        self.blocks[-1].append(row)
+
+    def rows(self, repo, rev):
+        """yield the rows, the first being that of rev"""
+        color = self.color
+        for block in self.blocks:
+            nodes, nlines, lines = block.decode()
+            pos = 0
+            for i, n in enumerate(nlines):
+                end = pos + 3 * n
+                edges = [(lines[j], lines[j+1], color(lines[j+2]))
+                         for j in xrange(pos, end, 3)]
+                pos = end
+                yield (rev - i, (nodes[2*i], color(nodes[2*i+1])), edges,
+                       _parents(repo, rev - i))
+            block.release()
+            rev -= block.n
+
+    def encode(self):
+        return (self.zero, self.shift, [b.encode() for b in self.blocks])
+
+    def decode(cls, data):
+        zero, shift, blocks = data
+        return cls(zero, shift, [_Block(n, blob) for n, blob in blocks])
+    decode = classmethod(decode)
+
+def graph_cache_path(repo):
+    return repo.join(GRAPH_CACHE_NAME)
+
+def _is_int(obj):
+    return isinstance(obj, (int, long))
+
+def _is_str(obj):
+    return isinstance(obj, str)
+
+def _is_list(obj, check):
+    """check that obj is a list of items passing check"""
+    if not isinstance(obj, list):
+        return False
+    for x in obj:
+        if not check(x):
+            return False
+    return True
+
+def _is_tuple(obj, *checks):
+    """check that obj is a tuple of items passing checks in turn"""
+    if not isinstance(obj, tuple) or len(obj) != len(checks):
+        return False
+    for x, check in zip(obj, checks):
+        if not check(x):
+            return False
+    return True
+
+def _is_pair(obj):
+    return _is_tuple(obj, _is_int, _is_int)
+
+def _is_segment(obj):
+    return _is_tuple(obj, _is_int, _is_int, lambda blocks: _is_list(blocks,
+            lambda b: _is_tuple(b, _is_int, _is_str) and b[0] >= 0))
+
+def _is_state(obj):
+    ints = lambda x: _is_list(x, _is_int)
+    pairs = lambda x: _is_list(x, _is_pair)
+    return obj is None or _is_tuple(obj, _is_int, ints, pairs, _is_int,
+            pairs, ints)
+
+def read_graph_cache(repo):
+    """
+    Return the (heads, tip, segments, state) saved by write_graph_cache,
+    or None if there is no usable cache.
+    """
+    try:
+        fd = open(graph_cache_path(repo), 'rb')
+        try:
+            data = fd.read()
+        finally:
+            fd.close()
+        if not data.startswith(GRAPH_CACHE_MAGIC):
+            return None
+        version, heads, tip, segments, state = marshal.loads(
+                data[len(GRAPH_CACHE_MAGIC):])
+    except Exception:
+        # missing, truncated, or written by another version
+        return None
+    if version != GRAPH_CACHE_VERSION or \
+            not _is_list(heads, lambda h: _is_tuple(h, _is_int, _is_str)) or \
+            not _is_int(tip) or not _is_list(segments, _is_segment) or \
+            not _is_state(state):
+        return None
+    segments = [_Segment.decode(s) for s in segments]
+    if state is not None:
+        rev, revs, colors, nextcolor, times, walking = state
+        state = LaneState(rev, revs, dict(colors), nextcolor, dict(times),
+                          set(walking))
+    return heads, tip, segments, state
+
+def write_graph_cache(repo, heads, tip, segments, state):
+    """
+    Save the layout of the history of repo from tip: the (rev, node)
+    heads of repo it was computed from, its segments of rows, and the
+    LaneState to carry it on from, or None if it is complete.
+    """
+    if state is not None:
+        state = (state.rev, state.revs, state.rev_color.items(),
+                 state.nextcolor, state.rev_time.items(),
+                 list(state.walking))
+    data = GRAPH_CACHE_MAGIC + marshal.dumps((GRAPH_CACHE_VERSION,
+            list(heads), tip, [s.encode() for s in segments], state), 2)
+    path = graph_cache_path(repo)
+    tmp = '%s.%d' % (path, os.getpid())
+    try:
+        fd = open(tmp, 'wb')
+        try:
+            fd.write(data)
+        finally:
+            fd.close()
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows doesn't replace existing files
+            os.unlink(path)
+            os.rename(tmp, path)
+    except (IOError, OSError), inst:
+        print "can't save graph layout of %s: %s" % (repo.root, inst)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+def _heads_valid(repo, heads, count):
+    """check that the saved heads are still there, as the same revs"""
+    for rev, node in heads:
+        if rev >= count or repo.changelog.node(rev) != node:
+            return False
+    return True
+
+class CachedGrapher(object):
+    """
+    revision_grapher over the whole history of repo, from its tip,
+    with the layout read from and saved to the repository.
+
+    Rows are taken with next(), as from revision_grapher.  save()
+    writes the layout computed so far; it is called by next() when
+    the history is exhausted.
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        count = repo.changelog.count()
+        self.tip = count - 1
+        self.heads = [(repo.changelog.rev(n), n) for n in repo.heads()]
+        self.segments = []
+        self.state = LaneState(self.tip)
+        self.dirty = True
+        self.spliced = False
+        cache = read_graph_cache(repo)
+        if cache is not None:
+            heads, tip, segments, state = cache
+            if tip <= self.tip and len(segments) < MAX_SEGMENTS and \
+                    _heads_valid(repo, heads, count):
+                self._splice(tip, segments, state)
+        self._rows = self._iter_rows()
+
+    def _splice(self, tip, segments, state):
+        if tip == self.tip:
+            self.segments = segments
+            self.state = state
+            self.dirty = False
+            return
+        # lay out the new revisions, down to the saved tip
+        new = _Segment()
+        for row in layout_rows(self.repo, self.state, tip + 1):
+            new.append(row)
+        self.segments = [new]
+        lanes = self.state.revs
+        if lanes != [tip] or self.state.rev_color[tip] != 0:
+            # lanes cross the saved tip, or it isn't on the line of the
+            # first head any more, which colors its merges differently:
+            # carry on from the new rows
+            return
+        zero = 0
+        shift = self.state.nextcolor - 1
+        for s in segments:
+            s.renumber(zero, shift)
+        if state is not None:
+            for rev, color in state.rev_color.items():
+                state.rev_color[rev] = color and color + shift or zero
+            state.nextcolor += shift
+        self.segments.extend(segments)
+        self.state = state
+        self.spliced = True
+
+    def _iter_rows(self):
+        rev = self.tip
+        for s in self.segments[:]:
+            for row in s.rows(self.repo, rev):
+                yield row
+            rev -= len(s)
+        if self.state is None:
+            return
+        tail = _Segment()
+        self.segments.append(tail)
+        for row in layout_rows(self.repo, self.state, 0):
+            tail.append(row)
+            self.dirty = True
+            yield row
+        self.state = None
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            return self._rows.next()
+        except StopIteration:
+            self.save()
+            raise
+
+    def save(self):
+        """save the layout computed so far, if anything new"""
+        if not self.dirty:
+            return
+        segments = [s for s in self.segments if len(s)]
+        write_graph_cache(self.repo, self.heads, self.tip, segments,
+                self.state)
+        self.dirty = False
@@ -14,75 +14,155 @@ from mercurial import cmdutil, util, ui
 def __get_parents(repo, rev):
     return [x for x in repo.changelog.parentrevs(rev) if x != nullrev]
 
-def revision_grapher(repo, start_rev, stop_rev, branch=None):
-    """incremental revision grapher
+def __move_lanes(revs, cols, col, parents_to_add):
+    """replace the lane at col by parents_to_add, keeping cols current"""
+    del cols[revs[col]]
+    revs[col:col + 1] = parents_to_add
+    if len(parents_to_add) == 1:
+        cols[parents_to_add[0]] = col
+    else:
+        for i in xrange(col, len(revs)):
+            cols[revs[i]] = i
 
-    This generator function walks through the revision history from
-    revision start_rev to revision stop_rev (which must be less than
-    or equal to start_rev) and for each revision emits tuples with the
-    following elements:
+def __edges(revs, cols, rev_color, col, parents, parents_to_add):
+    """
+    edges from the lanes of this row (revs, with col the current node)
+    to those of the next, which has parents_to_add instead of col
+    """
+    shift = len(parents_to_add) - 1
+    lines = [(i, i, rev_color[revs[i]]) for i in xrange(col)]
+    for parent in parents:
+        if parent in parents_to_add:
+            next_col = col + parents_to_add.index(parent)
+        else:
+            next_col = cols[parent]
+            if next_col > col:
+                next_col += shift
+        lines.append( (col, next_col, rev_color[parent]) )
+    for i in xrange(col + 1, len(revs)):
+        lines.append( (i, i + shift, rev_color[revs[i]]) )
+    return lines
 
-      - Current revision.
-      - lines; a list of (col, next_col, color) indicating the edges between
-        the current row and the next row
-      - Column of the current node in the set of ongoing edges.
-      - parent revisions of current revision
+class LaneState(object):
+    """
+    Where a layout stands: the next revision to lay out (rev), the
+    ongoing edges (revs, a list of lanes, and cols, the column of each
+    rev in revs), the colors of the open lanes and the next new color.
+    rev_time is the row each open lane was given its color at, or for
+    the lanes on the first parent line of a head (walking), the row
+    of that head.
     """
 
-    assert start_rev >= stop_rev
-    curr_rev = start_rev
-    revs = []
-    rev_color = {}
-    nextcolor = 0
-    while curr_rev >= stop_rev:
+    def __init__(self, rev, revs=None, rev_color=None, nextcolor=0,
+                 rev_time=None, walking=None):
+        self.rev = rev
+        self.revs = revs or []
+        self.cols = dict([(r, i) for i, r in enumerate(self.revs)])
+        self.rev_color = rev_color or {}
+        self.nextcolor = nextcolor
+        self.rev_time = rev_time or {}
+        self.walking = walking or set()
+
+def layout_rows(repo, state, stop_rev, branch=None):
+    """
+    Carry the layout in state on down to revision stop_rev, yielding
+    the rows of revision_grapher.  state is up to date whenever a row
+    is yielded, so that the layout can be saved and resumed.
+    """
+    revs = state.revs
+    cols = state.cols
+    rev_color = state.rev_color
+    rev_time = state.rev_time
+    walking = state.walking
+    while state.rev >= stop_rev:
+        curr_rev = state.rev
+        state.rev -= 1
         # Compute revs and next_revs.
-        if curr_rev not in revs:
+        if curr_rev not in cols:
             if branch:
                 ctx = repo.changectx(curr_rev)
                 if ctx.branch() != branch:
-                    curr_rev -= 1
                     continue
             # New head.
+            cols[curr_rev] = len(revs)
             revs.append(curr_rev)
-            rev_color[curr_rev] = curcolor = nextcolor ; nextcolor += 1
-            r = __get_parents(repo, curr_rev)
-            while r:
-                r0 = r[0]
-                if r0 < stop_rev: break
-                if r0 in rev_color: break
-                rev_color[r0] = curcolor
-                r = __get_parents(repo, r0)
+            rev_color[curr_rev] = state.nextcolor ; state.nextcolor += 1
+            rev_time[curr_rev] = curr_rev
+            walking.add(curr_rev)
         curcolor = rev_color[curr_rev]
-        rev_index = revs.index(curr_rev)
-        next_revs = revs[:]
+        curtime = rev_time[curr_rev]
+        walk = curr_rev in walking
+        rev_index = cols[curr_rev]
 
         # Add parents to next_revs.
         parents = __get_parents(repo, curr_rev)
         parents_to_add = []
         preferred_color = curcolor
         for parent in parents:
-            if parent not in next_revs:
-                parents_to_add.append(parent)
-                if parent not in rev_color:
-                    if preferred_color:
-                        rev_color[parent] = preferred_color; preferred_color = None
-                    else:
-                        rev_color[parent] = nextcolor ; nextcolor += 1
-        next_revs[rev_index:rev_index + 1] = parents_to_add
-
-        lines = []
-        for i, rev in enumerate(revs):
-            if rev in next_revs:
-                color = rev_color[rev]
-                lines.append( (i, next_revs.index(rev), color) )
-            elif rev == curr_rev:
-                for parent in parents:
-                    color = rev_color[parent]
-                    lines.append( (i, next_revs.index(parent), color) )
+            first = walk and parent == parents[0]
+            if parent in cols or parent in parents_to_add:
+                if first and (rev_time[parent] < curtime or
+                        rev_time[parent] == curtime and
+                        parent not in walking):
+                    # the line of the head came first: it takes the
+                    # lane over, as it would have been colored ahead
+                    rev_color[parent] = curcolor
+                    rev_time[parent] = curtime
+                    walking.add(parent)
+                continue
+            parents_to_add.append(parent)
+            if first:
+                rev_color[parent] = curcolor
+                rev_time[parent] = curtime
+                walking.add(parent)
+                continue
+            if preferred_color:
+                rev_color[parent] = preferred_color; preferred_color = None
+            else:
+                rev_color[parent] = state.nextcolor ; state.nextcolor += 1
+            rev_time[parent] = curr_rev
 
+        lines = __edges(revs, cols, rev_color, rev_index, parents,
+                parents_to_add)
+        __move_lanes(revs, cols, rev_index, parents_to_add)
+        del rev_color[curr_rev]
+        del rev_time[curr_rev]
+        walking.discard(curr_rev)
         yield (curr_rev, (rev_index, curcolor), lines, parents)
-        revs = next_revs
-        curr_rev -= 1
+
+def revision_grapher(repo, start_rev, stop_rev, branch=None):
+    """incremental revision grapher
+
+    This generator function walks through the revision history from
+    revision start_rev to revision stop_rev (which must be less than
+    or equal to start_rev) and for each revision emits tuples with the
+    following elements:
+
+      - Current revision.
+      - lines; a list of (col, next_col, color) indicating the edges between
+        the current row and the next row
+      - Column of the current node in the set of ongoing edges.
+      - parent revisions of current revision
+
+    Ongoing edges are kept in a LaneState, whose lanes are indexed by
+    rev, so that looking up a lane costs the same however many
+    branches are open.
+
+    Colors are those the grapher gave when it colored the whole first
+    parent line of every new head up front, but given as the rows are
+    laid out, so that the first row doesn't wait for a walk down the
+    history.  The first parent line of a head takes the color of the
+    head; the first other parent opening a lane takes the color of its
+    child, unless that is 0, and the next ones a new color.  A lane
+    colored before the line of a head reached it, when the head came
+    first, is taken over by the line.  Only there can colors differ
+    from the walk: the color the lane was given may have been left by
+    the walk to another parent, which got a new one instead.
+    Only the colors of open lanes are kept.
+    """
+
+    assert start_rev >= stop_rev
+    return layout_rows(repo, LaneState(start_rev), stop_rev, branch)
 
 
 def filelog_grapher(repo, path):
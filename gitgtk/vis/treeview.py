@@ -14,6 +14,7 @@ import treemodel
 import re
 from graphcell import CellRendererGraph
 from revgraph import *
+from graphcache import CachedGrapher
 from mercurial.node import hex
 
 
@@ -81,8 +82,10 @@ class TreeView(gtk.ScrolledWindow):
         self.repo = repo
         self.currev = None
         self.marked_rev = None
+        self.grapher = None
         self.construct_treeview()
         self.pbar = pbar
+        self.connect('destroy', self._on_destroy)
 
     def search_in_tree(self, model, column, key, iter, data):
         """Searches all fields shown in the tree when the user hits crtr+f,
@@ -101,9 +104,21 @@ class TreeView(gtk.ScrolledWindow):
                 return False
         return True
 
+    def save_layout(self):
+        """save the layout of the whole history, as far as it was read"""
+        if isinstance(self.grapher, CachedGrapher):
+            self.grapher.save()
+
+    def _on_destroy(self, widget):
+        self.save_layout()
+
     def create_log_generator(self, graphcol, pats, opts):
+        self.save_layout()
         if 'filehist' in opts:
             self.grapher = filelog_grapher(self.repo, opts['filehist'])
+        elif graphcol and pats is None and not opts['revrange']:
+            # whole history, laid out once and saved in the repository
+            self.grapher = CachedGrapher(self.repo)
         elif graphcol:
             end = 0
             if pats is not None:  # branch name
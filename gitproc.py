@@ -6,7 +6,7 @@
 
 import os
 import sys
-from tortoisegit.tgitutil import get_prog_root
+from tortoisegit.tgitutil import get_prog_root, read_list_file
 
 # always use git exe installed with TortoiseHg
 tgitdir = get_prog_root()
@@ -23,6 +23,10 @@ if not sys.stdin.isatty():
     except pywintypes.error:
         pass
 
+import threading
+import gobject
+import gtk
+
 # Map gitproc commands to dialog modules in gitgtk/
 from gitgtk import commit, status, addremove, tagadd, tags, history, merge
 from gitgtk import diff, revisions, update, serve, clone, synch, gitcmd, about
@@ -37,12 +41,10 @@ _dialogs = { 'commit' : commit,    'status' : status,    'revert' : status,
              'datamine': datamine }
 
 def get_list_from_file(filename):
-    fd = open(filename, "r")
-    lines = [ x.replace("\n", "") for x in fd.readlines() ]
-    fd.close()
-    return lines
+    # the dialogs show the files selected, they get them as a list
+    return list(read_list_file(filename))
 
-def get_option(args):
+def get_option(args, delete=True):
     import getopt
     long_opt_list = ('command=', 'exepath=', 'listfile=', 'root=', 'cwd=',
             'deletelistfile', 'nogui')
@@ -72,13 +74,17 @@ def get_option(args):
 
     if listfile:
         options['files'] = get_list_from_file(listfile)
-        if delfile:
+        if delfile and delete:
             os.unlink(listfile)
 
     return (options, args)
 
-def parse(args):
-    option, args = get_option(args)
+def get_dialog(args, delete=True):
+    """
+    return the dialog module and its options for gitproc arguments;
+    the list file is deleted as asked only if delete
+    """
+    option, args = get_option(args, delete)
     
     cmdline = ['git', option['gitcmd']] 
     if 'root' in option:
@@ -90,8 +96,114 @@ def parse(args):
 
     global _dialogs
     dialog = _dialogs.get(option['gitcmd'], gitcmd)
+    return dialog, option
+
+def parse(args):
+    dialog, option = get_dialog(args)
     dialog.run(**option)
 
+class DialogHost(object):
+    """
+    Open dialogs in this process, for gitproc --host.
+
+    Dialogs are created from the GTK main loop by their run() function,
+    whose own main loop is quit as soon as it starts: their windows are
+    then run by the host's loop, which goes on when a dialog quits it.
+    A dialog is closed when its windows are destroyed; gtk.Dialog
+    windows, which end gitproc with any response they don't stop, are
+    destroyed on such a response.  The windows of each (command, root,
+    files) are remembered until closed, and brought to front when the
+    same dialog is asked for again.
+    """
+
+    def __init__(self):
+        self.windows = {}
+        self.running = False
+
+    def request(self, args):
+        # in the server thread: bad options are reported to the client.
+        # Any process of the session can ask, it mustn't have the host
+        # delete files: the client deletes its list file once read
+        dialog, option = get_dialog(args, delete=False)
+        gobject.idle_add(self._open, dialog, option)
+
+    def run(self):
+        """run the main loop until quit()"""
+        self.running = True
+        while self.running:
+            gtk.main()
+
+    def quit(self):
+        self.running = False
+        gtk.main_quit()
+        return False
+
+    def _open(self, dialog, option):
+        key = (option['gitcmd'], option.get('root'), tuple(option['files']))
+        windows = self.windows.get(key)
+        if windows:
+            windows[0].present()
+            return False
+        before = set(gtk.window_list_toplevels())
+        gobject.idle_add(self._started, gtk.main_level())
+        try:
+            dialog.run(**option)
+        except:
+            import traceback
+            from gitgtk.dialog import error_dialog
+            tr = traceback.format_exc()
+            print tr
+            error_dialog(None, "Error executing gitproc", tr)
+        windows = [w for w in gtk.window_list_toplevels()
+                   if w not in before and w.get_property('visible')
+                   and w.get_property('type') == gtk.WINDOW_TOPLEVEL]
+        for w in windows:
+            w.connect('destroy', self._closed, key)
+            if isinstance(w, gtk.Dialog):
+                w.connect_after('response', self._response)
+        if windows:
+            self.windows[key] = windows
+        return False
+
+    def _started(self, level):
+        # the dialog's main loop, unless run() ended without one
+        if gtk.main_level() > level:
+            gtk.main_quit()
+        return False
+
+    def _response(self, window, response_id):
+        window.destroy()
+
+    def _closed(self, window, key):
+        windows = self.windows.get(key, [])
+        if window in windows:
+            windows.remove(window)
+        if not windows:
+            self.windows.pop(key, None)
+
+def host():
+    from tortoisegit import dialoghost
+    if dialoghost.DialogClient().ping():
+        print "gitproc: dialog host already running"
+        return
+    dialogs = DialogHost()
+    server = dialoghost.DialogServer(dialogs.request,
+            lambda: gobject.idle_add(dialogs.quit))
+    print "gitproc: dialog host listening on", server.server_address
+
+    gobject.threads_init()
+    gtk.gdk.threads_init()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    try:
+        gtk.gdk.threads_enter()
+        dialogs.run()
+        gtk.gdk.threads_leave()
+    finally:
+        server.shutdown()
+        server.server_close()
+
 
 def run_trapped(args):
     try:
@@ -110,4 +222,7 @@ if __name__=='__main__':
     #dlg = parse(['-c', 'add', '--root', 'c:\hg\h1', '--listfile', 'c:\\hg\\h1\\f1', '--notify'])
     #dlg = parse(['-c', 'rollback', '--root', 'c:\\hg\\h1'])
     print "gitproc sys.argv =", sys.argv
-    dlg = run_trapped(sys.argv[1:])
+    if sys.argv[1:] == ['--host']:
+        host()
+    else:
+        dlg = run_trapped(sys.argv[1:])
@@ -43,6 +43,8 @@ if 'py2exe' in sys.argv:
     extra['windows'] = [
             {"script":"gitproc.py",
                         "icon_resources": [(1, "icons/tortoise/git.ico")]},
+            {"script":"cachesrv.py",
+                        "icon_resources": [(1, "icons/tortoise/git.ico")]},
             {"script":"tracelog.py",
                         "icon_resources": [(1, "icons/tortoise/python.ico")]}
             ]
@@ -0,0 +1,415 @@
+"""
+cachesrv.py - TortoiseGit status cache server
+
+A single long-lived process per user session owns the working
+directory status (see statuscache.py).  The overlay handlers hosted in
+Explorer and the Nautilus extension query it through a local socket,
+so that no shell process ever has to scan a repository itself.
+
+The protocol is a sequence of NUL terminated requests, each answered
+by a NUL terminated response on the same connection:
+
+    ping                -> pong
+    status <path>       -> one of the statuscache states
+    dirstatus <dir>     -> "<state>\t<name>" lines, one per entry of
+                           <dir> (names with a newline are left out)
+    invalidate [<root>] -> ok (drop cached status and overlay policy,
+                           of all repositories or of the one at <root>)
+    stats               -> space separated name=value cache counters
+    quit                -> ok (server exits)
+
+On Windows the server listens on a loopback TCP port, which is
+published in the session's run directory along with a random token:
+every connection must start with
+
+    auth <token>        -> ok (anything else closes the connection)
+
+Elsewhere it listens on a unix domain socket in that directory, which
+only the user can enter: a run directory owned by someone else, or
+that others can write to, is refused.  The socket handling is done by
+LocalServer and LocalClient, which the dialog host (dialoghost.py)
+uses as well.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import sys
+import stat
+import errno
+import socket
+import getpass
+import tempfile
+import threading
+import subprocess
+import SocketServer
+import statuscache
+import fswatch
+import tgitutil
+
+TERMINATOR = '\0'
+
+# name of the status cache server's socket in the run directory
+SERVER_NAME = 'cachesrv'
+
+# seconds a client waits for the server before giving up
+CLIENT_TIMEOUT = 2.0
+
+# answer to a request the server is too busy to answer in time
+BUSY = 'busy'
+
+class RundirError(Exception):
+    """Raised when the run directory can't be trusted."""
+
+def get_rundir():
+    """per-user directory for the server socket/port file"""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'default'
+    return os.path.join(tempfile.gettempdir(), 'tortoisegit-%s' % user)
+
+def check_rundir(rundir):
+    """
+    raise RundirError unless rundir is a directory of the user's that
+    nobody else can write to
+    """
+    if os.name == 'nt':
+        # %TEMP% is the user's own; connections are checked by token
+        return
+    st = os.lstat(rundir)
+    if not stat.S_ISDIR(st.st_mode):
+        raise RundirError('%s is not a directory' % rundir)
+    if st.st_uid != os.getuid():
+        raise RundirError('%s is owned by someone else' % rundir)
+    if st.st_mode & 022:
+        raise RundirError('%s is writable by others' % rundir)
+
+def make_rundir(rundir):
+    """create rundir for the user only, unless it exists; check it"""
+    try:
+        os.makedirs(rundir, 0700)
+    except OSError, inst:
+        if inst.errno != errno.EEXIST:
+            raise
+    check_rundir(rundir)
+
+if hasattr(socket, 'AF_UNIX'):
+    _family = socket.AF_UNIX
+    _ServerBase = SocketServer.UnixStreamServer
+
+    def server_address(rundir=None, name=SERVER_NAME):
+        return os.path.join(rundir or get_rundir(), '%s.sock' % name)
+
+    def client_address(rundir=None, name=SERVER_NAME):
+        return server_address(rundir, name)
+
+    def _publish_address(server, rundir, name):
+        pass
+
+    def _unpublish_address(server, rundir, name):
+        try:
+            os.unlink(server.server_address)
+        except OSError:
+            pass
+
+    def _new_token():
+        return None
+
+    def client_token(rundir=None, name=SERVER_NAME):
+        return None
+
+else:
+    _family = socket.AF_INET
+    _ServerBase = SocketServer.TCPServer
+
+    def _port_file(rundir, name):
+        return os.path.join(rundir or get_rundir(), '%s.port' % name)
+
+    def server_address(rundir=None, name=SERVER_NAME):
+        return ('127.0.0.1', 0)
+
+    def _read_port_file(rundir, name):
+        """return the (port, token) published by the server, or None"""
+        try:
+            fd = open(_port_file(rundir, name))
+            try:
+                port, token = fd.read().split()
+                return int(port), token
+            finally:
+                fd.close()
+        except (IOError, ValueError):
+            return None
+
+    def client_address(rundir=None, name=SERVER_NAME):
+        published = _read_port_file(rundir, name)
+        return published and ('127.0.0.1', published[0])
+
+    def client_token(rundir=None, name=SERVER_NAME):
+        published = _read_port_file(rundir, name)
+        return published and published[1]
+
+    def _publish_address(server, rundir, name):
+        fd = open(_port_file(rundir, name), 'w')
+        fd.write('%d %s\n' % (server.server_address[1], server.token))
+        fd.close()
+
+    def _new_token():
+        return os.urandom(16).encode('hex')
+
+    def _unpublish_address(server, rundir, name):
+        try:
+            os.unlink(_port_file(rundir, name))
+        except OSError:
+            pass
+
+class _RequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        buf = ''
+        authed = self.server.token is None
+        while True:
+            data = self.request.recv(4096)
+            if not data:
+                break
+            buf += data
+            while TERMINATOR in buf:
+                req, buf = buf.split(TERMINATOR, 1)
+                if authed:
+                    resp = self.server.dispatch(req)
+                elif req == 'auth ' + self.server.token:
+                    authed = True
+                    resp = 'ok'
+                else:
+                    return
+                self.request.sendall(resp + TERMINATOR)
+
+class LocalServer(SocketServer.ThreadingMixIn, _ServerBase):
+    """
+    Server on the session's local socket called name.  A request
+    "<cmd> <arg>" is answered by the do_<cmd>(arg) method.
+    """
+
+    daemon_threads = True
+    name = SERVER_NAME
+
+    def __init__(self, rundir=None):
+        self.rundir = rundir or get_rundir()
+        make_rundir(self.rundir)
+        self.token = _new_token()
+        address = server_address(self.rundir, self.name)
+        if _family == socket.AF_UNIX and os.path.exists(address):
+            # stale socket left behind by a server that died
+            os.unlink(address)
+        _ServerBase.__init__(self, address, _RequestHandler)
+        _publish_address(self, self.rundir, self.name)
+
+    def dispatch(self, request):
+        cmd, _, arg = request.partition(' ')
+        handler = getattr(self, 'do_' + cmd, None)
+        if handler is None:
+            return 'error unknown command %s' % cmd
+        try:
+            return handler(arg)
+        except Exception, inst:
+            return 'error %s' % inst
+
+    def do_ping(self, arg):
+        return 'pong'
+
+    def do_quit(self, arg):
+        # shutdown() blocks until serve_forever() returns, which can't
+        # happen while this request is being handled
+        threading.Thread(target=self.shutdown).start()
+        return 'ok'
+
+    def server_close(self):
+        _ServerBase.server_close(self)
+        _unpublish_address(self, self.rundir, self.name)
+
+class StatusServer(LocalServer):
+    """
+    Status cache server.  Requests from all clients are answered from
+    one shared statuscache.StatusCache.
+    """
+
+    def __init__(self, cache=None, rundir=None):
+        self.cache = cache or statuscache.StatusCache()
+        LocalServer.__init__(self, rundir)
+
+    def do_status(self, path):
+        return self.cache.get_state(path)
+
+    def do_dirstatus(self, pdir):
+        states = self.cache.get_dir_states(pdir)
+        return '\n'.join(['%s\t%s' % (states[name], name)
+                          for name in sorted(states) if '\n' not in name])
+
+    def do_invalidate(self, root):
+        self.cache.clear(root or None)
+        statuscache.overlay_policy.invalidate(root or None)
+        return 'ok'
+
+    def do_stats(self, arg):
+        stats = self.cache.stats()
+        return ' '.join(['%s=%s' % (k, stats[k]) for k in sorted(stats)])
+
+class LocalClient(object):
+    """
+    Client of a LocalServer.  The connection is kept open between
+    requests and re-established on demand; every request returns None
+    if the server can't be reached, and BUSY if it didn't answer
+    within the timeout.
+    """
+
+    name = SERVER_NAME
+
+    def __init__(self, rundir=None, timeout=CLIENT_TIMEOUT):
+        self._rundir = rundir
+        self._timeout = timeout
+        self._sock = None
+        self._lock = threading.Lock()
+
+    def _token(self):
+        return client_token(self._rundir, self.name)
+
+    def _connect(self):
+        try:
+            check_rundir(self._rundir or get_rundir())
+        except (OSError, RundirError):
+            # not there, or not to be trusted
+            return None
+        address = client_address(self._rundir, self.name)
+        if address is None:
+            return None
+        sock = socket.socket(_family, socket.SOCK_STREAM)
+        sock.settimeout(self._timeout)
+        try:
+            sock.connect(address)
+        except socket.error:
+            sock.close()
+            return None
+        return sock
+
+    def _auth(self):
+        """authenticate the new connection, if the server wants a token"""
+        token = self._token()
+        if token is not None and self._roundtrip('auth ' + token) != 'ok':
+            raise socket.error(errno.EACCES, 'not authenticated')
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def request(self, cmd, arg=''):
+        self._lock.acquire()
+        try:
+            for retry in (True, False):
+                try:
+                    if self._sock is None:
+                        self._sock = self._connect()
+                        if self._sock is None:
+                            return None
+                        self._auth()
+                    return self._roundtrip('%s %s' % (cmd, arg))
+                except socket.timeout:
+                    # the answer would be read by the next request
+                    self.close()
+                    return BUSY
+                except socket.error:
+                    # server restarted since we last talked to it
+                    self.close()
+                    if not retry:
+                        return None
+        finally:
+            self._lock.release()
+
+    def _roundtrip(self, req):
+        self._sock.sendall(req + TERMINATOR)
+        buf = ''
+        while TERMINATOR not in buf:
+            data = self._sock.recv(4096)
+            if not data:
+                raise socket.error(errno.ECONNRESET, 'connection closed')
+            buf += data
+        return buf.split(TERMINATOR, 1)[0]
+
+    def ping(self):
+        return self.request('ping') == 'pong'
+
+class StatusClient(LocalClient):
+    """client side of the status cache server protocol"""
+
+    def status(self, path):
+        resp = self.request('status', path)
+        if resp is None or resp.startswith('error'):
+            return None
+        return resp
+
+    def dir_status(self, pdir):
+        """return the states of the entries of pdir by name, or None"""
+        resp = self.request('dirstatus', pdir)
+        if resp in (None, BUSY) or resp.startswith('error'):
+            return None
+        states = {}
+        for line in resp.split('\n'):
+            if line:
+                state, name = line.split('\t', 1)
+                states[name] = state
+        return states
+
+def start_server():
+    """spawn a status cache server in the background"""
+    if os.name == 'nt':
+        import win32con
+        app_path = tgitutil.find_path("cachesrv", tgitutil.get_prog_root(),
+                '.EXE;.BAT')
+        if app_path is None:
+            return False
+        cmdline = [app_path]
+        flags = win32con.CREATE_NO_WINDOW
+    else:
+        cmdline = [sys.executable,
+                os.path.join(tgitutil.get_prog_root(), 'cachesrv.py')]
+        flags = 0
+    print "start_server: %s" % cmdline
+    try:
+        subprocess.Popen(cmdline, shell=False, creationflags=flags,
+                close_fds=(os.name != 'nt'))
+    except OSError, inst:
+        print "start_server: %s" % inst
+        return False
+    return True
+
+def get_option(args):
+    import getopt
+    long_opt_list = ('maxdirs=', 'maxpaths=', 'rundir=')
+    opts, args = getopt.getopt(args, "", long_opt_list)
+    options = {}
+    for o, a in opts:
+        if o in ('--maxdirs', '--maxpaths'):
+            options[o[2:]] = int(a)
+        elif o == '--rundir':
+            options['rundir'] = a
+    return options
+
+def run(args=[]):
+    options = get_option(args)
+    rundir = options.pop('rundir', None)
+    if StatusClient(rundir).ping():
+        print "cachesrv: server already running"
+        return
+    cache = statuscache.StatusCache(watcher=fswatch.get_watcher(),
+            snapshots=True, **options)
+    server = StatusServer(cache=cache, rundir=rundir)
+    print "cachesrv: listening on", server.server_address
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        cache.close()
+
+if __name__ == '__main__':
+    run(sys.argv[1:])
@@ -4,7 +4,6 @@
 # Copyright (C) 2007 TK Soh <teekaysoh@gmail.com>
 
 import os
-import tempfile
 import pythoncom
 from win32com.shell import shell, shellcon
 import win32con
@@ -16,6 +15,11 @@ import win32gui_struct
 import win32api
 import _winreg
 from tgitutil import *
+from gettext import gettext as _
+import cachesrv
+import dialoghost
+import menumodel
+from menumodel import TortoiseMenu, TortoiseSubmenu, TortoiseMenuSep
 
 # FIXME: quick workaround traceback caused by missing "closed" 
 # attribute in win32trace.
@@ -27,64 +31,44 @@ def write_err(self, *args):
 S_OK = 0
 S_FALSE = 1
 
-class TortoiseMenu(object):
-    def __init__(self, menutext, helptext, handler, icon=None, state=True):
-        self.menutext = menutext
-        self.helptext = helptext
-        self.handler = handler
-        self.state = state
-        self.icon = icon
-
-class TortoiseSubmenu(object):
-    def __init__(self, menutext, menus=[], icon=None):
-        self.menutext = menutext
-        self.menus = menus[:]
-        self.icon = icon
-        
-    def add_menu(self, menutext, helptext, handler, icon=None, state=True):
-        self.menus.append(TortoiseMenu(menutext, helptext, handler, icon, state))
+# seconds the menu waits for the status cache server; the menus are
+# built without the status summary when it doesn't answer in time
+MENU_STATUS_TIMEOUT = 0.005
+
+menu_client = cachesrv.StatusClient(timeout=MENU_STATUS_TIMEOUT)
+
+# context menus built so far, shared by all menu handlers
+menu_model = menumodel.MenuModel(state_func=menu_client.status)
 
-    def add_sep(self):
-        self.menus.append(TortoiseMenuSep())
-        
-    def get_menus(self):
-        return self.menus
-        
-class TortoiseMenuSep(object):
-    def __init__(self):
-        pass
-    
 def open_repo(path):
-    root = find_root(path)
-    if root:
-        try:
-            repo = git.repository(root)
-            return repo
-        except _repo.RepoError:
-            pass
+    return menu_model.open_repo(path)
 
-    return None
+# menu icons are drawn in the background, before the first menu shows
+icon_cache.prerender()
 
 def open_dialog(cmd, cmdopts='', cwd=None, root=None, filelist=[], gui=True):
     app_path = find_path("gitproc", get_prog_root(), '.EXE;.BAT')
 
     if filelist:
-        fd, tmpfile = tempfile.mkstemp(prefix="tortoisegit_filelist_")
-        os.write(fd, "\n".join(filelist))
-        os.close(fd)
+        tmpfile = write_list_file(filelist)
 
     # start gpopen
-    gpopts = "--command %s" % cmd
+    gpopts = ["--command", cmd]
     if root:
-        gpopts += " --root %s" % shellquote(root)
+        gpopts += ["--root", root]
     if filelist:
-        gpopts += " --listfile %s --deletelistfile" % (shellquote(tmpfile))
+        gpopts += ["--listfile", tmpfile, "--deletelistfile"]
     if cwd:
-        gpopts += " --cwd %s" % shellquote(cwd)
+        gpopts += ["--cwd", cwd]
     if not gui:
-        gpopts += " --nogui"
+        gpopts += ["--nogui"]
+    gpopts += ["--"] + cmdopts.split()
+
+    # the dialog host has GTK loaded already
+    if dialoghost.open_dialog(gpopts):
+        return
 
-    cmdline = '%s %s -- %s' % (shellquote(app_path), gpopts, cmdopts)
+    cmdline = ' '.join([shellquote(a) for a in [app_path] + gpopts])
 
     try:
         run_program(cmdline)
@@ -177,10 +161,9 @@ class ContextMenuExtension:
                     'hSubMenu' : submenu, 
                 }
 
-                if menu_info.icon:
-                    icon_path = get_icon_path("tortoise", menu_info.icon)
-                    opt['hbmpChecked'] = opt['hbmpUnchecked'] = \
-                            icon_to_bitmap(icon_path)
+                bitmap = menu_info.icon and icon_cache.get(menu_info.icon)
+                if bitmap:
+                    opt['hbmpChecked'] = opt['hbmpUnchecked'] = bitmap
                 
                 item, _ = win32gui_struct.PackMENUITEMINFO(**opt)
                 win32gui.InsertMenuItem(parent, pos, True, item)
@@ -196,14 +179,16 @@ class ContextMenuExtension:
                     'wID' : idCmdFirst + idCmd,
                 }
 
-                if menu_info.icon:
-                    icon_path = get_icon_path("tortoise", menu_info.icon)
-                    opt['hbmpChecked'] = opt['hbmpUnchecked'] = \
-                            icon_to_bitmap(icon_path)
+                bitmap = menu_info.icon and icon_cache.get(menu_info.icon)
+                if bitmap:
+                    opt['hbmpChecked'] = opt['hbmpUnchecked'] = bitmap
                 
                 item, _ = win32gui_struct.PackMENUITEMINFO(**opt)
                 win32gui.InsertMenuItem(parent, pos, True, item)
-                self._handlers[idCmd] = (menu_info.helptext, menu_info.handler)
+                handler = menu_info.handler
+                if isinstance(handler, str):
+                    handler = getattr(self, handler)
+                self._handlers[idCmd] = (menu_info.helptext, handler)
             idCmd += 1
             pos += 1
         return idCmd
@@ -212,6 +197,7 @@ class ContextMenuExtension:
         if uFlags & shellcon.CMF_DEFAULTONLY:
             return 0
 
+        start = win32api.GetTickCount()
         tgitmenu = []    # git menus
 
         # a brutal hack to detect if we are the first menu to go on to the 
@@ -226,28 +212,24 @@ class ContextMenuExtension:
         if self._folder and self._filenames:
             # get menus with drag-n-drop support
             commands = self._get_commands_dragdrop()
+            commands.append(TortoiseMenuSep())
+            commands.append(TortoiseMenu(_("About"),
+                           _("About TortoiseGit"),
+                           self._about, icon="menuabout.ico"))
         else:
-            # add regularly used commit menu to main context menu
+            # regularly used commit menu goes to main context menu,
+            # other menus to the git submenu
             rpath = self._folder or self._filenames[0]
-            if open_repo(rpath):
-                tgitmenu.append(TortoiseMenu(_("HG Commit..."), 
-                               _("Commit changes in repository"),
-                               self._commit, icon="menucommit.ico"))
-                               
-            # get other menus for git submenu
-            commands = self._get_commands()
-
-        # add common menu items
-        commands.append(TortoiseMenuSep())
-        commands.append(TortoiseMenu(_("About"),
-                       _("About TortoiseGit"),
-                       self._about, icon="menuabout.ico"))
-       
+            top, commands = menu_model.get_menus(rpath,
+                    self._filenames or [self._folder])
+            tgitmenu.extend(top)
+
         # create submenus with Git commands
         tgitmenu.append(TortoiseSubmenu("TortoiseHG", commands, icon="git.ico"))
         tgitmenu.append(TortoiseMenuSep())
         
         idCmd = self._create_menu(hMenu, tgitmenu, indexMenu, 0, idCmdFirst)
+        print "QueryContextMenu: %d ms" % (win32api.GetTickCount() - start)
 
         # Return total number of menus & submenus we've added
         return idCmd
@@ -292,117 +274,6 @@ class ContextMenuExtension:
                            self._synch_here, icon="menusynch.ico"))
         return result
         
-    def _get_commands(self):
-        """
-        Get a list of commands valid for the current selection.
-
-        Each command is a tuple containing (display text, handler).
-        """
-        
-        print "_get_commands() on %s" % ", ".join(self._filenames)        
-
-        # open repo
-        result = []
-        rpath = self._folder or self._filenames[0]
-        repo = open_repo(rpath)
-        if repo is None:
-            result.append(TortoiseMenu(_("Clone a Repository"),
-                           _("clone a repository"),
-                           self._clone, icon="menuclone.ico"))
-            result.append(TortoiseMenu(_("Create Repository Here"),
-                           _("create a new repository in this directory"),
-                           self._init, icon="menucreaterepos.ico"))
-        else:
-            result.append(TortoiseMenu(_("View File Status"),
-                           _("Repository status"),
-                           self._status, icon="menushowchanged.ico"))
-
-            # Visual Diff (any extdiff command)
-            has_vdiff = repo.ui.config('tortoisegit', 'vdiff', '') != ''
-            result.append(TortoiseMenu(_("Visual Diff"),
-                           _("View changes using GUI diff tool"),
-                           self._vdiff, icon="TortoiseMerge.ico",
-                           state=has_vdiff))
-                           
-            result.append(TortoiseMenu(_("Add Files"),
-                           _("Add files to Git repository"),
-                           self._add, icon="menuadd.ico"))
-            result.append(TortoiseMenu(_("Remove Files"),
-                           _("Remove selected files on the next commit"),
-                           self._remove, icon="menudelete.ico"))
-            result.append(TortoiseMenu(_("Undo Changes"),
-                           _("Revert selected files"),
-                           self._revert, icon="menurevert.ico"))
-            result.append(TortoiseMenu(_("Annotate Files"),
-                           _("show changeset information per file line"),
-                           self._annotate, icon="menublame.ico"))
-
-            result.append(TortoiseMenuSep())
-            result.append(TortoiseMenu(_("Update To Revision"),
-                           _("update working directory"),
-                           self._update, icon="menucheckout.ico"))
-
-            can_merge = len(repo.heads()) > 1 and \
-                        len(repo.workingctx().parents()) < 2
-            result.append(TortoiseMenu(_("Merge Revisions"),
-                           _("merge working directory with another revision"),
-                           self._merge, icon="menumerge.ico",
-                           state=can_merge))
-
-            # show un-merge menu per merge status of working directory
-            if len(repo.workingctx().parents()) > 1:
-                result.append(TortoiseMenu(_("Undo Merge"),
-                               _("Undo merge by updating to revision"),
-                               self._merge, icon="menuunmerge.ico"))
-
-            result.append(TortoiseMenuSep())
-
-            result.append(TortoiseMenu(_("View Changelog"),
-                           _("View revision history"),
-                           self._history, icon="menulog.ico"))
-
-            result.append(TortoiseMenu(_("Search Repository"),
-                           _("Search revisions of files for a text pattern"),
-                           self._grep, icon="menurepobrowse.ico"))
-                           
-            if repo.ui.config('tortoisegit', 'view'):
-                result.append(TortoiseMenu(_("Revision Graph"),
-                               _("View history with DAG graph"),
-                               self._view, icon="menurevisiongraph.ico"))
-
-            result.append(TortoiseMenuSep())
-
-            result.append(TortoiseMenu(_("Synchronize..."),
-                           _("Synchronize with remote repository"),
-                           self._synch, icon="menusynch.ico"))
-            result.append(TortoiseMenu(_("Recovery..."),
-                           _("General repair and recovery of repository"),
-                           self._recovery, icon="general.ico"))
-            result.append(TortoiseMenu(_("Web Server"),
-                           _("start web server for this repository"),
-                           self._serve, icon="proxy.ico"))
-            result.append(TortoiseMenu(_("Create Clone"),
-                           _("Clone a repository here"),
-                           self._clone, icon="menuclone.ico"))
-            if repo.root != rpath:
-                result.append(TortoiseMenu(_("Create Repository Here"),
-                               _("create a new repository in this directory"),
-                               self._init, icon="menucreaterepos.ico"))
-
-        # config setttings menu
-        result.append(TortoiseMenuSep())
-        optmenu = TortoiseSubmenu(_("Settings"),icon="menusettings.ico")
-        optmenu.add_menu(_("Global"),
-                         _("Configure user wide settings"),
-                         self._config_user, icon="settings_user.ico")
-        if repo:
-            optmenu.add_menu(_("Repository"),
-                             _("Configure settings local to this repository"),
-                             self._config_repo, icon="settings_repo.ico")
-        result.append(optmenu)
-
-        return result
-
     def InvokeCommand(self, ci):
         mask, hwnd, verb, params, dir, nShow, hotkey, hicon = ci
         if verb >> 16:
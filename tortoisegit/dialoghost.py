@@ -0,0 +1,131 @@
+"""
+dialoghost.py - TortoiseGit dialog host
+
+Every gitproc process loads Python, GTK and all the dialog modules
+before its window shows, which takes seconds.  The dialog host is a
+gitproc process that keeps running (gitproc --host): the shell
+extensions pass it their gitproc arguments over a local socket, and
+it opens the dialog in-process.  Asking for a dialog already open for
+the same repository and files brings its window to front instead.
+
+The protocol is the status cache server's (see cachesrv.py), with
+one more request:
+
+    open <args>         -> ok, or error <message> if the arguments
+                           are not valid gitproc options
+
+where <args> are the gitproc arguments separated by newlines.  The
+host reads the list file before answering, but doesn't delete it as
+--deletelistfile asks: open_dialog() does it once the host answered.
+
+When the host isn't running, open_dialog() starts it and leaves it to
+the caller to spawn gitproc as before.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import sys
+import time
+import subprocess
+import cachesrv
+import tgitutil
+
+# name of the dialog host's socket in the run directory
+HOST_NAME = 'gitproc'
+
+# seconds to wait before trying to start the host again
+HOST_RETRY = 30
+
+class DialogServer(cachesrv.LocalServer):
+    """
+    Socket side of the dialog host.  open_func(args) is called with
+    the gitproc arguments of each open request, in the thread handling
+    the request; it must hand the dialog over to the GTK main loop.
+    quit_func() is called when the host is asked to quit.
+    """
+
+    name = HOST_NAME
+
+    def __init__(self, open_func, quit_func=None, rundir=None):
+        self.open_func = open_func
+        self.quit_func = quit_func
+        cachesrv.LocalServer.__init__(self, rundir)
+
+    def do_open(self, arg):
+        self.open_func(arg.split('\n'))
+        return 'ok'
+
+    def do_quit(self, arg):
+        if self.quit_func is not None:
+            self.quit_func()
+        return cachesrv.LocalServer.do_quit(self, arg)
+
+class DialogClient(cachesrv.LocalClient):
+    """client side of the dialog host protocol"""
+
+    name = HOST_NAME
+
+    def open(self, args):
+        """have the host open a dialog; return False if it can't"""
+        resp = self.request('open', '\n'.join(args))
+        if resp is not None and resp != 'ok':
+            print "dialog host: %s" % resp
+        return resp == 'ok'
+
+def host_cmdline():
+    """command line starting a dialog host"""
+    if os.name == 'nt':
+        app_path = tgitutil.find_path("gitproc", tgitutil.get_prog_root(),
+                '.EXE;.BAT')
+        if app_path is None:
+            return None
+        return [app_path, '--host']
+    return [sys.executable,
+            os.path.join(tgitutil.get_prog_root(), 'gitproc.py'), '--host']
+
+_client = None
+_host_started = None
+
+def start_host():
+    """spawn a dialog host in the background, at most every HOST_RETRY"""
+    global _host_started
+    now = time.time()
+    if _host_started is not None and now - _host_started < HOST_RETRY:
+        return False
+    _host_started = now
+    cmdline = host_cmdline()
+    if cmdline is None:
+        return False
+    flags = 0
+    if os.name == 'nt':
+        import win32con
+        flags = win32con.CREATE_NO_WINDOW
+    print "start_host: %s" % cmdline
+    try:
+        subprocess.Popen(cmdline, shell=False, creationflags=flags,
+                close_fds=(os.name != 'nt'))
+    except OSError, inst:
+        print "start_host: %s" % inst
+        return False
+    return True
+
+def open_dialog(args):
+    """
+    open a dialog in the host, given the gitproc arguments; return
+    False if the host isn't running, after starting it for next time
+    """
+    global _client
+    if _client is None:
+        _client = DialogClient()
+    if _client.open(args):
+        if '--deletelistfile' in args and '--listfile' in args:
+            try:
+                os.unlink(args[args.index('--listfile') + 1])
+            except (OSError, IndexError):
+                pass
+        return True
+    start_host()
+    return False
@@ -0,0 +1,329 @@
+"""
+dircache.py - TortoiseGit per-directory status for file managers
+
+File managers ask for the status of every file they display, one at
+a time.  DirStatusCache answers them from the states of the whole
+directory, fetched in one go (see StatusCache.get_dir_states and the
+status cache server's dirstatus request) and kept for a few seconds:
+opening a folder costs one status walk, and every file of it a
+dictionary lookup.
+
+StatusRequests computes those states on a worker thread, so that the
+file manager never waits for them: each request is answered through
+a callback, and requests can be cancelled while queued.
+
+RepoCache keeps the repositories the file manager shows open, the
+most recently used first, and closes those left idle.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import time
+import threading
+import tgitutil
+from collections import OrderedDict
+from overlaysched import DirQueue, PENDING
+
+# ticks the states of a directory are kept, and number of directories
+DIR_TIMEOUT = 2000
+MAX_DIRS = 64
+
+# number of repositories kept open, and ticks an unused one stays open
+MAX_REPOS = 8
+REPO_IDLE = 300000
+
+def get_tick_count():
+    return int(time.time() * 1000)
+
+class DirStatusCache(object):
+    """
+    States of the entries of recently shown directories.
+
+    fetch(pdir) returns the states of the entries of pdir as a dict by
+    name, or None if they can't be had.  Directories are fetched again
+    after timeout ticks, or once invalidated.
+    """
+
+    def __init__(self, fetch, timeout=DIR_TIMEOUT, maxdirs=MAX_DIRS,
+            tick_count=get_tick_count):
+        self._fetch = fetch
+        self._timeout = timeout
+        self._maxdirs = maxdirs
+        self._tick_count = tick_count
+        self._lock = threading.Lock()
+        self._dirs = {}     # pdir -> (states, tick)
+        self.hits = 0
+        self.fetches = 0
+
+    def _cached(self, pdir):
+        try:
+            states, tick = self._dirs[pdir]
+        except KeyError:
+            return None
+        if self._tick_count() - tick >= self._timeout:
+            del self._dirs[pdir]
+            return None
+        return states
+
+    def is_loaded(self, pdir):
+        """tell if the states of pdir are at hand"""
+        self._lock.acquire()
+        try:
+            return self._cached(pdir) is not None
+        finally:
+            self._lock.release()
+
+    def get_state(self, path):
+        """return the state of path, or None if it isn't known"""
+        pdir, name = os.path.split(path)
+        self._lock.acquire()
+        try:
+            states = self._cached(pdir)
+            if states is not None:
+                self.hits += 1
+                return states.get(name)
+        finally:
+            self._lock.release()
+        states = self.load(pdir)
+        return states and states.get(name)
+
+    def load(self, pdir):
+        """fetch the states of pdir, return them (or None)"""
+        states = self._fetch(pdir)
+        self._lock.acquire()
+        try:
+            self.fetches += 1
+            if states is not None:
+                if len(self._dirs) >= self._maxdirs:
+                    self._dirs.clear()
+                self._dirs[pdir] = (states, self._tick_count())
+        finally:
+            self._lock.release()
+        return states
+
+    def invalidate(self, pdir=None):
+        """forget the states of all directories, or of pdir"""
+        self._lock.acquire()
+        try:
+            if pdir is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(pdir, None)
+        finally:
+            self._lock.release()
+
+    def invalidate_tree(self, root):
+        """forget the states of root and the directories below it"""
+        prefix = os.path.join(root, '')
+        self._lock.acquire()
+        try:
+            for pdir in self._dirs.keys():
+                if pdir == root or pdir.startswith(prefix):
+                    del self._dirs[pdir]
+        finally:
+            self._lock.release()
+
+class _Request(object):
+    """handles waiting for the state of one path"""
+    def __init__(self, path):
+        self.path = path
+        self.queued = None
+        self.handles = []
+
+class StatusRequests(object):
+    """
+    Background state requests, answered from a DirStatusCache.
+
+    request(handle, path) queues path; done(handle, state) is called
+    from the worker thread once the state is known.  Requests are
+    served by directory, like the overlay scheduler's (see DirQueue):
+    the directory asked about most is loaded first, and requests for
+    directories no longer asked about get PENDING instead.  Cancelled
+    requests get no callback.
+    """
+
+    def __init__(self, cache, done, tick_count=get_tick_count):
+        self._cache = cache
+        self._done = done
+        self._lock = threading.Lock()
+        self._paths = {}        # path -> _Request
+        self._handles = {}      # handle -> _Request
+        self._queue = DirQueue(self._dropped, tick_count=tick_count)
+        self._worker = None
+        self.cancelled = 0
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run)
+        self._worker.setDaemon(True)
+        self._worker.start()
+
+    def request(self, handle, path):
+        """queue the state of path for handle"""
+        self._lock.acquire()
+        try:
+            req = self._paths.get(path)
+            if req is None:
+                req = self._paths[path] = _Request(path)
+                self._queue.put(req)
+            else:
+                self._queue.touch(path)
+            req.handles.append(handle)
+            self._handles[handle] = req
+        finally:
+            self._lock.release()
+
+    def cancel(self, handle):
+        """forget the request of handle, if it isn't answered yet"""
+        self._lock.acquire()
+        try:
+            req = self._handles.pop(handle, None)
+            if req is not None:
+                req.handles.remove(handle)
+                self.cancelled += 1
+        finally:
+            self._lock.release()
+
+    def _finish(self, req):
+        self._lock.acquire()
+        try:
+            if self._paths.get(req.path) is req:
+                del self._paths[req.path]
+            handles = req.handles
+            req.handles = []
+            for handle in handles:
+                del self._handles[handle]
+            return handles
+        finally:
+            self._lock.release()
+
+    def _dropped(self, req):
+        for handle in self._finish(req):
+            self._done(handle, PENDING)
+
+    def _process(self, req):
+        if not req.handles:
+            self._finish(req)
+            return
+        try:
+            state = self._cache.get_state(req.path)
+        except Exception, inst:
+            print "status of %s failed: %s" % (req.path, inst)
+            state = None
+        for handle in self._finish(req):
+            self._done(handle, state)
+
+    def run_pending(self):
+        """answer the queued requests in this thread"""
+        while True:
+            req = self._queue.get(block=False)
+            if req is None:
+                return
+            self._process(req)
+
+    def _run(self):
+        while True:
+            self._process(self._queue.get())
+
+class RepoCache(object):
+    """
+    Open repositories by root, least recently used first.
+
+    open_func(root) returns the handle of the repository at root, or
+    None if it can't be opened (which isn't cached).  At most maxrepos
+    handles are kept; reap() closes those not asked for in idle ticks.
+    Closed handles are passed to close_func(root, handle).  find()
+    looks the root of a path up with find_root, which must agree with
+    open_func on what a repository is.
+    """
+
+    def __init__(self, open_func, close_func=None, maxrepos=MAX_REPOS,
+            idle=REPO_IDLE, tick_count=get_tick_count,
+            find_root=tgitutil.find_root):
+        self._open = open_func
+        self._close = close_func
+        self._find_root = find_root
+        self._maxrepos = maxrepos
+        self._idle = idle
+        self._tick_count = tick_count
+        self._lock = threading.Lock()
+        self._repos = OrderedDict()     # root -> (handle, tick)
+        self.hits = 0
+        self.opens = 0
+
+    def __len__(self):
+        return len(self._repos)
+
+    def _closed(self, closed):
+        if self._close is not None:
+            for root, handle in closed:
+                self._close(root, handle)
+
+    def get(self, root):
+        """return the handle of the repository at root, opening it"""
+        self._lock.acquire()
+        try:
+            entry = self._repos.pop(root, None)
+            if entry is not None:
+                self.hits += 1
+                self._repos[root] = (entry[0], self._tick_count())
+                return entry[0]
+        finally:
+            self._lock.release()
+        handle = self._open(root)
+        if handle is None:
+            return None
+        closed = []
+        self._lock.acquire()
+        try:
+            self.opens += 1
+            self._repos[root] = (handle, self._tick_count())
+            while len(self._repos) > self._maxrepos:
+                oldroot, (oldhandle, tick) = self._repos.popitem(last=False)
+                closed.append((oldroot, oldhandle))
+        finally:
+            self._lock.release()
+        self._closed(closed)
+        return handle
+
+    def find(self, path):
+        """return the handle of the repository containing path, or None"""
+        root = self._find_root(path)
+        if root is None:
+            return None
+        return self.get(root)
+
+    def invalidate(self, root=None):
+        """close all repositories, or the one at root"""
+        self._lock.acquire()
+        try:
+            if root is None:
+                closed = [(r, h) for r, (h, tick) in self._repos.iteritems()]
+                self._repos.clear()
+            elif root in self._repos:
+                closed = [(root, self._repos.pop(root)[0])]
+            else:
+                closed = []
+        finally:
+            self._lock.release()
+        self._closed(closed)
+
+    def reap(self):
+        """close the repositories left idle; return how many"""
+        closed = []
+        self._lock.acquire()
+        try:
+            tc = self._tick_count()
+            for root, (handle, tick) in self._repos.items():
+                if tc - tick < self._idle:
+                    break       # the rest were used later
+                del self._repos[root]
+                closed.append((root, handle))
+        finally:
+            self._lock.release()
+        self._closed(closed)
+        return len(closed)
@@ -0,0 +1,281 @@
+"""
+filemeta.py - TortoiseGit file metadata for file managers
+
+Property pages and list view columns show the last commit touching
+each file, its author, its tags and the file's status.  MetaCache
+computes them for a whole directory at once, on a worker thread: one
+git log walk finds the last commit of every entry, the states come
+with the status of the directory, and the tags are listed along.  The metadata is kept per repository until
+its HEAD or index moves.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import time
+import threading
+import subprocess
+from overlaysched import DirQueue
+from statuscache import repo_signature
+
+# number of directories whose metadata is kept per repository
+MAX_DIRS = 64
+
+# git log format: start marker, then NUL separated fields
+LOG_FORMAT = '%x01%H%x00%an%x00%at%x00%s'
+
+# git for-each-ref format of tags: object, commit if annotated, name
+TAG_FORMAT = '%(objectname) %(*objectname) %(refname:short)'
+
+def get_tick_count():
+    return int(time.time() * 1000)
+
+class FileMeta(object):
+    """what is shown about one directory entry"""
+    __slots__ = ('state', 'node', 'author', 'date', 'summary', 'tags')
+
+    def __init__(self, state=None, node=None, author=None, date=None,
+            summary=None, tags=()):
+        self.state = state
+        self.node = node
+        self.author = author
+        self.date = date
+        self.summary = summary
+        self.tags = tags
+
+def _log_entries(stream, bufsize=65536):
+    """yield the NUL separated entries of a git log -z output stream"""
+    rest = ''
+    while True:
+        data = stream.read(bufsize)
+        if not data:
+            break
+        entries = (rest + data).split('\0')
+        rest = entries.pop()
+        for entry in entries:
+            yield entry
+    if rest:
+        yield rest
+
+def dir_last_commits(root, reldir, names):
+    """
+    Find the last commit touching each of names, entries of directory
+    reldir (relative to root, '' for root itself).  Return a dict by
+    name of (node, author, date, summary); names never committed are
+    left out.  The walk stops as soon as all names are found.
+    """
+    prefix = reldir and reldir.replace(os.sep, '/') + '/' or ''
+    wanted = set(names)
+    commits = {}
+    cmdline = ['git', '--literal-pathspecs', 'log', '-z', '--name-only',
+               '--no-renames', '--format=' + LOG_FORMAT, '--',
+               reldir or '.']
+    flags = 0
+    if os.name == 'nt':
+        import win32con
+        flags = win32con.CREATE_NO_WINDOW
+    try:
+        proc = subprocess.Popen(cmdline, cwd=root, shell=False,
+                creationflags=flags, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+    except OSError, inst:
+        print "git log: %s" % inst
+        return commits
+    try:
+        entries = _log_entries(proc.stdout)
+        commit = None
+        for entry in entries:
+            if entry.startswith('\x01'):
+                fields = [entry[1:]]
+                for i in range(3):
+                    fields.append(entries.next())
+                node, author, date, summary = fields
+                commit = (node, author, int(date), summary)
+                continue
+            path = entry.lstrip('\n')
+            if commit is None or not path.startswith(prefix):
+                continue
+            name = path[len(prefix):].split('/', 1)[0]
+            if name in wanted and name not in commits:
+                commits[name] = commit
+                if len(commits) == len(wanted):
+                    break
+    finally:
+        if proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                pass
+        proc.stdout.close()
+        proc.stderr.close()
+        proc.wait()
+    return commits
+
+def _git_output(root, args):
+    """output of git args in root, None if it can't be run"""
+    flags = 0
+    if os.name == 'nt':
+        import win32con
+        flags = win32con.CREATE_NO_WINDOW
+    try:
+        proc = subprocess.Popen(['git'] + args, cwd=root, shell=False,
+                creationflags=flags, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+    except OSError, inst:
+        print "git %s: %s" % (args[0], inst)
+        return None
+    out, err = proc.communicate()
+    if proc.returncode:
+        return None
+    return out
+
+def repo_tags(root):
+    """return the tag names of the repository at root by commit node"""
+    tags = {}
+    out = _git_output(root, ['for-each-ref', '--format=' + TAG_FORMAT,
+            'refs/tags'])
+    for line in (out or '').splitlines():
+        fields = line.split(' ', 2)
+        if len(fields) != 3:
+            continue
+        node, commit, name = fields
+        tags.setdefault(commit or node, []).append(name)
+    return tags
+
+class _Load(object):
+    """a directory to load, with its repository"""
+    def __init__(self, root, path):
+        self.root = root
+        self.path = path
+        self.queued = None
+
+class MetaCache(object):
+    """
+    Metadata of the entries of recently shown directories, per
+    repository.
+
+    get(root, path) never blocks: it returns the FileMeta of path if
+    its directory was loaded, or None.  load(root, pdir) queues the
+    directory for the worker thread, which calls done(pdir) once it's
+    loaded.  states_func(pdir) returns the states of the entries of
+    pdir as a dict by name, commits_func is dir_last_commits and
+    tags_func repo_tags.
+
+    The metadata of a repository is dropped when its repo_signature
+    changes, or when invalidated.
+    """
+
+    def __init__(self, states_func, done=None, commits_func=dir_last_commits,
+            tags_func=repo_tags, maxdirs=MAX_DIRS, signature=repo_signature,
+            tick_count=get_tick_count):
+        self._states_func = states_func
+        self._done = done
+        self._commits_func = commits_func
+        self._tags_func = tags_func
+        self._maxdirs = maxdirs
+        self._signature = signature
+        self._lock = threading.Lock()
+        self._repos = {}        # root -> (signature, {pdir : metas})
+        self._queued = set()
+        self._queue = DirQueue(self._dropped, tick_count=tick_count)
+        self._worker = None
+        self.loads = 0
+
+    def _dirs(self, root):
+        sig = self._signature(root)
+        entry = self._repos.get(root)
+        if entry is None or entry[0] != sig:
+            entry = self._repos[root] = (sig, {})
+        return entry[1]
+
+    def get(self, root, path):
+        """return the FileMeta of path if at hand, else None"""
+        pdir, name = os.path.split(path)
+        self._lock.acquire()
+        try:
+            metas = self._dirs(root).get(pdir)
+        finally:
+            self._lock.release()
+        if metas is None:
+            return None
+        return metas.get(name, FileMeta())
+
+    def is_loaded(self, root, pdir):
+        self._lock.acquire()
+        try:
+            return pdir in self._dirs(root)
+        finally:
+            self._lock.release()
+
+    def load(self, root, pdir):
+        """have the worker thread load the metadata of pdir"""
+        self._lock.acquire()
+        try:
+            if pdir in self._queued:
+                self._queue.touch(pdir)
+                return
+            self._queued.add(pdir)
+        finally:
+            self._lock.release()
+        self._queue.put(_Load(root, pdir))
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run)
+            self._worker.setDaemon(True)
+            self._worker.start()
+
+    def invalidate(self, root=None):
+        """forget the metadata of all repositories, or of root"""
+        self._lock.acquire()
+        try:
+            if root is None:
+                self._repos.clear()
+            else:
+                self._repos.pop(root, None)
+        finally:
+            self._lock.release()
+
+    def _dropped(self, job):
+        self._lock.acquire()
+        try:
+            self._queued.discard(job.path)
+        finally:
+            self._lock.release()
+
+    def load_now(self, root, pdir):
+        """load the metadata of pdir in this thread"""
+        try:
+            names = os.listdir(pdir)
+        except OSError:
+            names = []
+        try:
+            states = self._states_func(pdir) or {}
+            reldir = pdir != root and pdir[len(root)+1:] or ''
+            commits = self._commits_func(root, reldir, names)
+            tags = commits and self._tags_func(root) or {}
+        except Exception, inst:
+            print "metadata of %s failed: %s" % (pdir, inst)
+            states, commits, tags = {}, {}, {}
+        metas = {}
+        for name in names:
+            commit = commits.get(name, (None, None, None, None))
+            metas[name] = FileMeta(states.get(name), *commit,
+                    tags=tags.get(commit[0], ()))
+        self._lock.acquire()
+        try:
+            self.loads += 1
+            self._queued.discard(pdir)
+            dirs = self._dirs(root)
+            if len(dirs) >= self._maxdirs:
+                dirs.clear()
+            dirs[pdir] = metas
+        finally:
+            self._lock.release()
+        if self._done is not None:
+            self._done(pdir)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            self.load_now(job.root, job.path)
@@ -0,0 +1,416 @@
+"""
+fswatch.py - TortoiseGit working directory change watchers
+
+A watcher records which paths of a working directory changed since
+they were last asked for, so that cached status can be patched for
+just those paths instead of being rebuilt (see statuscache.py).
+
+InotifyWatcher is used on Linux; PollingWatcher, which compares stat
+signatures of the whole tree from a thread of its own, is the
+fallback everywhere else.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import errno
+import struct
+import time
+import threading
+
+# minimum ticks between two scans of a tree by PollingWatcher
+POLL_INTERVAL = 2000
+
+def get_tick_count():
+    return int(time.time() * 1000)
+
+def _walk_dirs(root):
+    """
+    yield the directories of the working directory at root, but not
+    of the working directories nested in it (submodules)
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        dirnames[:] = [d for d in dirnames
+                if not os.path.lexists(os.path.join(dirpath, d, '.git'))]
+        yield dirpath, dirnames, filenames
+
+class Watcher(object):
+    """
+    Watcher interface.  changes() returns the set of paths changed in
+    a watched tree since the previous call, or None if changes were
+    lost and everything must be considered changed.
+    """
+
+    def watch(self, root):
+        """start watching tree at root, return False if it can't be"""
+        return False
+
+    def unwatch(self, root):
+        pass
+
+    def is_watching(self, root):
+        return False
+
+    def changes(self, root):
+        return None
+
+    def close(self):
+        pass
+
+class _WatchedTree(object):
+    def __init__(self):
+        self.changes = set()
+        self.overflow = False
+        self.failed = False
+
+    def drain(self):
+        if self.overflow:
+            changes = None
+        else:
+            changes = self.changes
+        self.changes = set()
+        self.overflow = False
+        return changes
+
+class _PolledTree(_WatchedTree):
+    def __init__(self):
+        _WatchedTree.__init__(self)
+        self.sigs = None        # until the first scan is done
+        self.due = 0
+        self.wanted = False
+
+class PollingWatcher(Watcher):
+    """
+    Watcher comparing stat signatures of every entry of a tree.
+
+    Trees are scanned by a thread of the watcher, never by its caller:
+    watch() returns right away, and is_watching() is False until the
+    first scan of the tree is done.  A tree is scanned again once its
+    changes were asked for, at most once every POLL_INTERVAL ticks, or
+    four times the duration of the last scan on trees which are slow
+    to scan; changes() returns what the scans found since the last
+    call.  Without background, the scans are left to scan_pending().
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, tick_count=get_tick_count,
+            background=True):
+        self._interval = interval
+        self._tick_count = tick_count
+        self._background = background
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._trees = {}
+        self._worker = None
+        self._closed = False
+
+    def _scan(self, root):
+        sigs = {}
+        for dirpath, dirnames, filenames in _walk_dirs(root):
+            for name in dirnames + filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                sigs[path] = (st.st_mtime, st.st_size, st.st_mode)
+        return sigs
+
+    def _start(self):
+        if self._worker is not None:
+            return
+        self._worker = threading.Thread(target=self._run)
+        self._worker.setDaemon(True)
+        self._worker.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.clear()
+            wait = self.scan_pending()
+            if wait is None:
+                self._wakeup.wait()
+            else:
+                self._wakeup.wait(wait / 1000.0)
+
+    def scan_pending(self):
+        """
+        scan the trees due for a scan; return the ticks until the next
+        one is due, or None if none is
+        """
+        tc = self._tick_count()
+        self._lock.acquire()
+        try:
+            due = [(root, tree) for root, tree in self._trees.items()
+                   if (tree.sigs is None or tree.wanted) and tree.due <= tc]
+        finally:
+            self._lock.release()
+        for root, tree in due:
+            start = self._tick_count()
+            sigs = self._scan(root)
+            end = self._tick_count()
+            self._lock.acquire()
+            try:
+                if self._trees.get(root) is not tree:
+                    continue        # unwatched meanwhile
+                if tree.sigs is not None:
+                    oldsigs = tree.sigs
+                    for path, sig in sigs.iteritems():
+                        if oldsigs.get(path) != sig:
+                            tree.changes.add(path)
+                    for path in oldsigs:
+                        if path not in sigs:
+                            tree.changes.add(path)
+                tree.sigs = sigs
+                tree.wanted = False
+                tree.due = end + max(self._interval, 4 * (end - start))
+            finally:
+                self._lock.release()
+        self._lock.acquire()
+        try:
+            tc = self._tick_count()
+            waits = [max(tree.due - tc, 0) for tree in self._trees.values()
+                     if tree.sigs is None or tree.wanted]
+        finally:
+            self._lock.release()
+        if not waits:
+            return None
+        return min(waits)
+
+    def watch(self, root):
+        self._lock.acquire()
+        try:
+            if root not in self._trees:
+                self._trees[root] = _PolledTree()
+        finally:
+            self._lock.release()
+        if self._background:
+            self._start()
+            self._wakeup.set()
+        return True
+
+    def unwatch(self, root):
+        self._lock.acquire()
+        try:
+            self._trees.pop(root, None)
+        finally:
+            self._lock.release()
+
+    def is_watching(self, root):
+        self._lock.acquire()
+        try:
+            tree = self._trees.get(root)
+            return tree is not None and tree.sigs is not None
+        finally:
+            self._lock.release()
+
+    def changes(self, root):
+        self._lock.acquire()
+        try:
+            tree = self._trees.get(root)
+            if tree is None or tree.sigs is None:
+                return None
+            tree.wanted = True
+            changes = tree.drain()
+        finally:
+            self._lock.release()
+        if self._background:
+            self._wakeup.set()
+        return changes
+
+    def close(self):
+        self._closed = True
+        self._lock.acquire()
+        try:
+            self._trees.clear()
+        finally:
+            self._lock.release()
+        self._wakeup.set()
+
+if os.name == 'posix':
+    import ctypes
+    import ctypes.util
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 00004000
+    IN_CLOEXEC = 02000000
+
+    _WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+            IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+            IN_MOVE_SELF | IN_ONLYDIR)
+    _EVENT_HEADER = struct.Struct('iIII')
+
+    _libc = None
+    def _get_libc():
+        global _libc
+        if _libc is None:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                    use_errno=True)
+        return _libc
+
+    class InotifyWatcher(Watcher):
+        """
+        Watcher based on Linux inotify.  Every directory of a watched
+        tree gets a watch; events are read without blocking whenever
+        changes are asked for, so no thread is needed.
+
+        Trees which can't be watched, out of watches (ENOSPC) or for
+        lack of access, are left to the fallback watcher, a
+        PollingWatcher by default, for as long as the watcher lives.
+        """
+
+        def __init__(self, fallback=None):
+            libc = _get_libc()
+            self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self._fd < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            self._libc = libc
+            self._wds = {}      # watch descriptor -> (root, directory)
+            self._trees = {}    # root -> _WatchedTree
+            self._fallback = fallback
+            self._polled = set()    # roots left to the fallback
+
+        def _poll(self, root):
+            """leave root to the fallback watcher from now on"""
+            self.unwatch(root)
+            self._polled.add(root)
+            if self._fallback is None:
+                self._fallback = PollingWatcher()
+            return self._fallback.watch(root)
+
+        def _add_watch(self, root, path):
+            wd = self._libc.inotify_add_watch(self._fd, path, _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    return True     # removed while we were walking
+                return False        # out of watches (ENOSPC) or no access
+            self._wds[wd] = (root, path)
+            return True
+
+        def _add_tree(self, root, path):
+            for dirpath, dirnames, filenames in _walk_dirs(path):
+                if not self._add_watch(root, dirpath):
+                    return False
+            return True
+
+        def watch(self, root):
+            if root in self._polled:
+                return self._fallback.watch(root)
+            if root in self._trees:
+                return True
+            self._trees[root] = _WatchedTree()
+            if not self._add_tree(root, root):
+                print "inotify: can't watch %s, polling it" % root
+                return self._poll(root)
+            return True
+
+        def unwatch(self, root):
+            if root in self._polled:
+                self._fallback.unwatch(root)
+            self._trees.pop(root, None)
+            for wd, (wroot, path) in self._wds.items():
+                if wroot == root:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    del self._wds[wd]
+
+        def is_watching(self, root):
+            if root in self._polled:
+                return self._fallback.is_watching(root)
+            return root in self._trees
+
+        def changes(self, root):
+            if root in self._polled:
+                return self._fallback.changes(root)
+            self._read_events()
+            tree = self._trees.get(root)
+            if tree is None:
+                return None
+            if tree.failed:
+                # a new directory couldn't be watched
+                print "inotify: can't watch %s, polling it" % root
+                self._poll(root)
+                return None
+            return tree.drain()
+
+        def _read_events(self):
+            while True:
+                try:
+                    buf = os.read(self._fd, 65536)
+                except OSError, inst:
+                    if inst.errno == errno.EINTR:
+                        continue
+                    if inst.errno != errno.EAGAIN:
+                        raise
+                    return
+                pos = 0
+                while pos < len(buf):
+                    wd, mask, cookie, namelen = \
+                            _EVENT_HEADER.unpack_from(buf, pos)
+                    pos += _EVENT_HEADER.size
+                    name = buf[pos:pos + namelen].rstrip('\0')
+                    pos += namelen
+                    self._event(wd, mask, name)
+
+        def _event(self, wd, mask, name):
+            if mask & IN_Q_OVERFLOW:
+                for tree in self._trees.values():
+                    tree.overflow = True
+                return
+            if mask & IN_IGNORED:
+                self._wds.pop(wd, None)
+                return
+            try:
+                root, dirpath = self._wds[wd]
+            except KeyError:
+                return
+            tree = self._trees[root]
+            if not name:
+                # the watched directory itself was removed or moved
+                tree.changes.add(dirpath)
+                return
+            if name == '.git' and dirpath == root:
+                return
+            path = os.path.join(dirpath, name)
+            tree.changes.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                if not self._add_tree(root, path):
+                    tree.failed = True
+                # entries created before the watch was set up
+                for dpath, dirnames, filenames in _walk_dirs(path):
+                    for f in dirnames + filenames:
+                        tree.changes.add(os.path.join(dpath, f))
+
+        def close(self):
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+            self._wds.clear()
+            self._trees.clear()
+            if self._fallback is not None:
+                self._fallback.close()
+
+def get_watcher():
+    """return the best watcher available on this platform"""
+    if os.name == 'posix':
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            # not Linux, or inotify disabled
+            pass
+    return PollingWatcher()
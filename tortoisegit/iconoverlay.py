@@ -7,8 +7,11 @@ import win32api
 import win32con
 from win32com.shell import shell, shellcon
 import _winreg
-import thgutil
 import sys
+import statuscache
+import cachesrv
+import overlaysched
+from statuscache import UNCHANGED, ADDED, MODIFIED, UNKNOWN, NOT_IN_REPO
 
 # FIXME: quick workaround traceback caused by missing "closed" 
 # attribute in win32trace.
@@ -16,34 +19,53 @@ def write_err(self, *args):
     for a in args:
         sys.stderr.write(str(a))
 
-# file/directory status
-UNCHANGED = "unchanged"
-ADDED = "added"
-MODIFIED = "modified"
-UNKNOWN = "unknown"
-NOT_IN_REPO = "n/a"
+# file status cache, used when the status cache server can't be reached
+overlay_cache = statuscache.StatusCache(tick_count=win32api.GetTickCount,
+        snapshots=True)
 
-# file status cache
-CACHE_TIMEOUT = 5000
-overlay_cache = {}
-cache_tick_count = 0
-cache_root = None
-cache_pdir = None
+# connection to the status cache server, shared by all overlay handlers
+cache_client = cachesrv.StatusClient()
+
+# ticks to wait before trying to start the cache server again
+SERVER_RETRY = 30000
+server_tick_count = None
+
+def compute_state(path):
+    """
+    Get the state of a given path in source control.
+
+    The status cache server is asked first; if it isn't running,
+    it is started and the state is computed in-process meanwhile.
+    If it is too busy to answer, the state is left pending rather
+    than computed a second time here.
+    """
+    status = cache_client.status(path)
+    if status == cachesrv.BUSY:
+        return overlaysched.PENDING
+    if status is None:
+        start_cache_server()
+        status = overlay_cache.get_state(path)
+    return status
+
+# answers IsMemberOf within overlaysched.TIME_BUDGET ticks, and has the
+# shell refresh items whose status took longer
+overlay_sched = overlaysched.StatusScheduler(compute_state,
+        overlaysched.NotifyCoalescer(overlaysched.ShellNotifier(),
+                tick_count=win32api.GetTickCount),
+        tick_count=win32api.GetTickCount, lookup=overlay_cache.peek_state)
 
 # some misc constants
 S_OK = 0
 S_FALSE = 1
 
-def add_dirs(list):
-    dirs = set()
-    for f in list:
-        dir = os.path.dirname(f)
-        if dir in dirs:
-            continue
-        while dir:
-            dirs.add(dir)
-            dir = os.path.dirname(dir)
-    list.extend(dirs)
+def start_cache_server():
+    global server_tick_count
+
+    tc = win32api.GetTickCount()
+    if server_tick_count is not None and tc - server_tick_count < SERVER_RETRY:
+        return
+    server_tick_count = tc
+    cachesrv.start_server()
 
 class IconOverlayExtension(object):
     """
@@ -74,120 +96,17 @@ class IconOverlayExtension(object):
         
     def _get_state(self, upath):
         """
-        Get the state of a given path in source control.
+        Get the state of a given path in source control, or
+        overlaysched.PENDING if it isn't known within the time budget.
         """
-        global overlay_cache, cache_tick_count
-        global cache_root, cache_pdir
-        
-        #print "called: _get_state(%s)" % path
-        tc = win32api.GetTickCount()
-        
         try:
             # handle some Asian charsets
             path = upath.encode('mbcs')
         except:
             path = upath
 
-        # check if path is cached
-        pdir = os.path.dirname(path)
-        if cache_pdir == pdir and overlay_cache:
-            if tc - cache_tick_count < CACHE_TIMEOUT:
-                try:
-                    status = overlay_cache[path]
-                except:
-                    status = UNKNOWN
-                print "%s: %s (cached)" % (path, status)
-                return status
-            else:
-                print "Timed out!!"
-                overlay_cache.clear()
-
-        # path is a drive
-        if path.endswith(":\\"):
-            overlay_cache[path] = UNKNOWN
-            return NOT_IN_REPO
-
-        # open repo
-        if cache_pdir == pdir:
-            root = cache_root
-        else:
-            print "find new root"
-            cache_pdir = pdir
-            cache_root = root = thgutil.find_root(pdir)
-        print "_get_state: root = ", root
-        if root is None:
-            print "_get_state: not in repo"
-            overlay_cache = {None : None}
-            cache_tick_count = win32api.GetTickCount()
-            return NOT_IN_REPO
-
-        try:
-            tc1 = win32api.GetTickCount()
-            repo = hg.repository(ui.ui(), path=root)
-            print "hg.repository() took %d ticks" % (win32api.GetTickCount() - tc1)
-
-            # check if to display overlay icons in this repo
-            global_opts = ui.ui().configlist('tortoisehg', 'overlayicons', [])
-            repo_opts = repo.ui.configlist('tortoisehg', 'overlayicons', [])
-            
-            print "%s: global overlayicons = " % path, global_opts
-            print "%s: repo overlayicons = " % path, repo_opts
-            is_netdrive =  thgutil.netdrive_status(path) is not None
-            if (is_netdrive and 'localdisks' in global_opts) \
-                    or 'False' in repo_opts:
-                print "%s: overlayicons disabled" % path
-                overlay_cache = {None : None}
-                cache_tick_count = win32api.GetTickCount()
-                return NOT_IN_REPO
-        except _repo.RepoError:
-            # We aren't in a working tree
-            print "%s: not in repo" % dir
-            overlay_cache[path] = UNKNOWN
-            return NOT_IN_REPO
-
-        # get file status
-        tc1 = win32api.GetTickCount()
-
-        modified, added, removed, deleted = [], [], [], []
-        unknown, ignored, clean = [], [], []
-        files = []
-        try:
-            files, matchfn, anypats = cmdutil.matchpats(repo, [pdir])
-            modified, added, removed, deleted, unknown, ignored, clean = \
-                    repo.status(files=files, list_ignored=True, 
-                            list_clean=True, list_unknown=True)
-
-            # add directory status to list
-            for grp in (clean,modified,added,removed,deleted,ignored,unknown):
-                add_dirs(grp)
-        except util.Abort, inst:
-            print "abort: %s" % inst
-            print "treat as unknown : %s" % path
-            return UNKNOWN
-        
-        print "status() took %d ticks" % (win32api.GetTickCount() - tc1)
-                
-        # cached file info
-        tc = win32api.GetTickCount()
-        overlay_cache = {}
-        for grp, st in (
-                (ignored, UNKNOWN),
-                (unknown, UNKNOWN),                
-                (clean, UNCHANGED),
-                (added, ADDED),
-                (removed, MODIFIED),
-                (deleted, MODIFIED),
-                (modified, MODIFIED)):
-            for f in grp:
-                fpath = os.path.join(repo.root, os.path.normpath(f))
-                overlay_cache[fpath] = st
-
-        if path in overlay_cache:
-            status = overlay_cache[path]
-        else:
-            status = overlay_cache[path] = UNKNOWN
+        status = overlay_sched.get_state(path)
         print "%s: %s" % (path, status)
-        cache_tick_count = win32api.GetTickCount()
         return status
 
     def IsMemberOf(self, path, attrib):                  
@@ -0,0 +1,385 @@
+"""
+menumodel.py - TortoiseGit context menu model
+
+A right-click must not wait for git.  RepoHandle answers what the
+menus depend on (root, tortoisegit.* configuration, merge state and
+number of branches) from the files of the git directory.  It runs git
+config again only when a configuration file changed, and counts the
+branches again only when HEAD, packed-refs or refs/heads changed.  MenuModel keeps
+the menus built for each (repository, selection kind, status summary)
+and records how long every query took.
+
+Menus name their handlers instead of holding bound methods, so that
+one model serves every selection; the context menu extension looks
+the handlers up on itself.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import time
+import threading
+import subprocess
+import tgitutil
+from gettext import gettext as _
+from overlaypolicy import config_files
+from overlaysched import PENDING
+from statuscache import UNCHANGED, IGNORED, NOT_IN_REPO
+
+# number of menus and of repository handles kept
+MAX_MENUS = 64
+MAX_HANDLES = 64
+
+# selection kinds
+NO_REPO = "none"
+ROOT = "root"
+DIR = "dir"
+FILE = "file"
+
+# status summaries of the selection
+CLEAN = "clean"
+CHANGED = "changed"
+
+class TortoiseMenu(object):
+    def __init__(self, menutext, helptext, handler, icon=None, state=True):
+        self.menutext = menutext
+        self.helptext = helptext
+        self.handler = handler
+        self.state = state
+        self.icon = icon
+
+class TortoiseSubmenu(object):
+    def __init__(self, menutext, menus=[], icon=None):
+        self.menutext = menutext
+        self.menus = menus[:]
+        self.icon = icon
+
+    def add_menu(self, menutext, helptext, handler, icon=None, state=True):
+        self.menus.append(TortoiseMenu(menutext, helptext, handler, icon, state))
+
+    def add_sep(self):
+        self.menus.append(TortoiseMenuSep())
+
+    def get_menus(self):
+        return self.menus
+
+class TortoiseMenuSep(object):
+    def __init__(self):
+        pass
+
+def get_tick_count():
+    return time.time() * 1000
+
+def _stat_sig(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def tortoisegit_config(root):
+    """return the tortoisegit.* configuration of root as a dict"""
+    flags = 0
+    if os.name == 'nt':
+        import win32con
+        flags = win32con.CREATE_NO_WINDOW
+    try:
+        proc = subprocess.Popen(['git', 'config', '-z', '--get-regexp',
+                r'^tortoisegit\.'], cwd=root, shell=False,
+                creationflags=flags, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        out = proc.communicate()[0]
+    except OSError, inst:
+        print "git config: %s" % inst
+        return {}
+    config = {}
+    for entry in out.split('\0'):
+        if entry:
+            name, value = (entry.split('\n', 1) + [''])[:2]
+            config[name] = value
+    return config
+
+class RepoHandle(object):
+    """
+    What the menus need to know about the repository at root, read
+    without running git whenever possible.
+    """
+
+    def __init__(self, root, config_func=tortoisegit_config):
+        self.root = root
+        self.git_dir = tgitutil.git_dir(root)
+        self._config_func = config_func
+        self._config = None
+        self._branches = None
+
+    def config(self, name, default=None):
+        """return a tortoisegit.* value, cached until a config file changes"""
+        sig = [_stat_sig(f) for f in config_files(self.root)]
+        if self._config is None or self._config[0] != sig:
+            self._config = (sig, self._config_func(self.root))
+        return self._config[1].get('tortoisegit.' + name, default)
+
+    def merging(self):
+        """check if a merge is in progress"""
+        return os.path.exists(os.path.join(self.git_dir, 'MERGE_HEAD'))
+
+    def branch(self):
+        """return the branch checked out, None if HEAD is detached"""
+        try:
+            fd = open(os.path.join(self.git_dir, 'HEAD'))
+            try:
+                head = fd.read().strip()
+            finally:
+                fd.close()
+        except IOError:
+            return None
+        if head.startswith('ref: refs/heads/'):
+            return head[16:]
+        return None
+
+    def branches(self):
+        """return the number of local branches, cached until refs change"""
+        sig = [_stat_sig(os.path.join(self.git_dir, *f)) for f in
+               (('HEAD',), ('packed-refs',), ('refs', 'heads'))]
+        if self._branches is None or self._branches[0] != sig:
+            self._branches = (sig, self._count_branches())
+        return self._branches[1]
+
+    def _count_branches(self):
+        heads = set()
+        refs = os.path.join(self.git_dir, 'refs', 'heads')
+        for dirpath, dirnames, filenames in os.walk(refs):
+            for f in filenames:
+                heads.add(os.path.join(dirpath, f)[len(refs)+1:]
+                        .replace(os.sep, '/'))
+        try:
+            fd = open(os.path.join(self.git_dir, 'packed-refs'))
+            try:
+                for line in fd:
+                    fields = line.split()
+                    if len(fields) == 2 and \
+                            fields[1].startswith('refs/heads/'):
+                        heads.add(fields[1][11:])
+            finally:
+                fd.close()
+        except IOError:
+            pass
+        return len(heads)
+
+class MenuModel(object):
+    """
+    Cached context menus.
+
+    state_func(path) returns the overlay state of a path, or None if
+    it isn't known right away; it must not block.  The menus for a
+    selection are taken from the cache when the repository, the kind
+    of selection and its status summary are the same as before.
+    """
+
+    def __init__(self, state_func=None, maxmenus=MAX_MENUS,
+            tick_count=get_tick_count):
+        self._state_func = state_func
+        self._maxmenus = maxmenus
+        self._tick_count = tick_count
+        self._lock = threading.Lock()
+        self._handles = {}
+        self._menus = {}
+        self.queries = 0
+        self.hits = 0
+        self.time_total = 0
+        self.time_max = 0
+        self.time_last = 0
+
+    def open_repo(self, path):
+        """return a RepoHandle for the repository containing path"""
+        root = tgitutil.find_root(path)
+        if root is None:
+            return None
+        self._lock.acquire()
+        try:
+            try:
+                return self._handles[root]
+            except KeyError:
+                pass
+            if len(self._handles) >= MAX_HANDLES:
+                self._handles.clear()
+            handle = self._handles[root] = RepoHandle(root)
+            return handle
+        finally:
+            self._lock.release()
+
+    def _summary(self, paths):
+        if self._state_func is None or len(paths) != 1:
+            return None
+        try:
+            state = self._state_func(paths[0])
+        except Exception, inst:
+            print "menu status of %s failed: %s" % (paths[0], inst)
+            return None
+        if state in (None, PENDING, NOT_IN_REPO):
+            return None
+        if state in (UNCHANGED, IGNORED):
+            return CLEAN
+        return CHANGED
+
+    def _key(self, rpath, paths):
+        repo = self.open_repo(rpath)
+        if repo is None:
+            return (None, NO_REPO)
+        if rpath == repo.root:
+            kind = ROOT
+        elif os.path.isdir(rpath):
+            kind = DIR
+        else:
+            kind = FILE
+        return (repo.root, kind, self._summary(paths), repo.merging(),
+                repo.branches() > 1, bool(repo.config('vdiff')),
+                bool(repo.config('view')))
+
+    def get_menus(self, rpath, paths):
+        """
+        return the top level menus and the commands of the TortoiseGit
+        submenu for the selection paths (rpath is the folder or the
+        first path); both lists are shared, callers must copy them
+        """
+        start = self._tick_count()
+        key = self._key(rpath, paths)
+        self._lock.acquire()
+        try:
+            menus = self._menus.get(key)
+            hit = menus is not None
+            if not hit:
+                if len(self._menus) >= self._maxmenus:
+                    self._menus.clear()
+                menus = self._menus[key] = self._build(*key)
+            elapsed = self._tick_count() - start
+            self.queries += 1
+            self.hits += hit
+            self.time_total += elapsed
+            self.time_max = max(self.time_max, elapsed)
+            self.time_last = elapsed
+        finally:
+            self._lock.release()
+        return menus
+
+    def stats(self):
+        """return query counters and timings (ms) as a dict"""
+        self._lock.acquire()
+        try:
+            return {'queries' : self.queries, 'hits' : self.hits,
+                    'time_avg' : self.queries and
+                            self.time_total / float(self.queries),
+                    'time_max' : self.time_max, 'time_last' : self.time_last}
+        finally:
+            self._lock.release()
+
+    def _build(self, root, kind, summary=None, merging=False,
+            can_merge=False, has_vdiff=False, has_view=False):
+        top = []
+        result = []
+        if root is None:
+            result.append(TortoiseMenu(_("Clone a Repository"),
+                           _("clone a repository"),
+                           '_clone', icon="menuclone.ico"))
+            result.append(TortoiseMenu(_("Create Repository Here"),
+                           _("create a new repository in this directory"),
+                           '_init', icon="menucreaterepos.ico"))
+        else:
+            changed = summary != CLEAN
+            top.append(TortoiseMenu(_("HG Commit..."),
+                           _("Commit changes in repository"),
+                           '_commit', icon="menucommit.ico", state=changed))
+
+            result.append(TortoiseMenu(_("View File Status"),
+                           _("Repository status"),
+                           '_status', icon="menushowchanged.ico"))
+
+            # Visual Diff (any extdiff command)
+            result.append(TortoiseMenu(_("Visual Diff"),
+                           _("View changes using GUI diff tool"),
+                           '_vdiff', icon="TortoiseMerge.ico",
+                           state=has_vdiff))
+
+            result.append(TortoiseMenu(_("Add Files"),
+                           _("Add files to Git repository"),
+                           '_add', icon="menuadd.ico"))
+            result.append(TortoiseMenu(_("Remove Files"),
+                           _("Remove selected files on the next commit"),
+                           '_remove', icon="menudelete.ico"))
+            result.append(TortoiseMenu(_("Undo Changes"),
+                           _("Revert selected files"),
+                           '_revert', icon="menurevert.ico", state=changed))
+            result.append(TortoiseMenu(_("Annotate Files"),
+                           _("show changeset information per file line"),
+                           '_annotate', icon="menublame.ico"))
+
+            result.append(TortoiseMenuSep())
+            result.append(TortoiseMenu(_("Update To Revision"),
+                           _("update working directory"),
+                           '_update', icon="menucheckout.ico"))
+
+            result.append(TortoiseMenu(_("Merge Revisions"),
+                           _("merge working directory with another revision"),
+                           '_merge', icon="menumerge.ico",
+                           state=can_merge and not merging))
+
+            # show un-merge menu per merge status of working directory
+            if merging:
+                result.append(TortoiseMenu(_("Undo Merge"),
+                               _("Undo merge by updating to revision"),
+                               '_merge', icon="menuunmerge.ico"))
+
+            result.append(TortoiseMenuSep())
+
+            result.append(TortoiseMenu(_("View Changelog"),
+                           _("View revision history"),
+                           '_history', icon="menulog.ico"))
+
+            result.append(TortoiseMenu(_("Search Repository"),
+                           _("Search revisions of files for a text pattern"),
+                           '_grep', icon="menurepobrowse.ico"))
+
+            if has_view:
+                result.append(TortoiseMenu(_("Revision Graph"),
+                               _("View history with DAG graph"),
+                               '_view', icon="menurevisiongraph.ico"))
+
+            result.append(TortoiseMenuSep())
+
+            result.append(TortoiseMenu(_("Synchronize..."),
+                           _("Synchronize with remote repository"),
+                           '_synch', icon="menusynch.ico"))
+            result.append(TortoiseMenu(_("Recovery..."),
+                           _("General repair and recovery of repository"),
+                           '_recovery', icon="general.ico"))
+            result.append(TortoiseMenu(_("Web Server"),
+                           _("start web server for this repository"),
+                           '_serve', icon="proxy.ico"))
+            result.append(TortoiseMenu(_("Create Clone"),
+                           _("Clone a repository here"),
+                           '_clone', icon="menuclone.ico"))
+            if kind != ROOT:
+                result.append(TortoiseMenu(_("Create Repository Here"),
+                               _("create a new repository in this directory"),
+                               '_init', icon="menucreaterepos.ico"))
+
+        # config setttings menu
+        result.append(TortoiseMenuSep())
+        optmenu = TortoiseSubmenu(_("Settings"),icon="menusettings.ico")
+        optmenu.add_menu(_("Global"),
+                         _("Configure user wide settings"),
+                         '_config_user', icon="settings_user.ico")
+        if root is not None:
+            optmenu.add_menu(_("Repository"),
+                             _("Configure settings local to this repository"),
+                             '_config_repo', icon="settings_repo.ico")
+        result.append(optmenu)
+
+        # add common menu items
+        result.append(TortoiseMenuSep())
+        result.append(TortoiseMenu(_("About"),
+                       _("About TortoiseGit"),
+                       '_about', icon="menuabout.ico"))
+        return top, result
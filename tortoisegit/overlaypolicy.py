@@ -0,0 +1,213 @@
+"""
+overlaypolicy.py - TortoiseGit overlay icon policy
+
+Whether overlays are shown for a repository depends on its
+tortoisegit.overlayicons configuration and on the kind of volume it
+is on ('localdisks' in the global configuration turns them off on
+network volumes).  OverlayPolicy caches both per repository, so that
+neither git config nor the volume lookup runs on every status query.
+
+Cached policies are dropped when a configuration file changes, or
+explicitly with invalidate() (e.g. after drives were mapped).
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import threading
+import tgitutil
+
+# volume kinds
+LOCAL = "local"
+NETWORK = "network"
+REMOVABLE = "removable"
+
+class Volumes(object):
+    """
+    Volume classification interface.  volume() names the volume
+    holding a path, kind() classifies a volume; both may be slow and
+    are cached by OverlayPolicy.
+    """
+
+    def volume(self, path):
+        return None
+
+    def kind(self, volume):
+        return LOCAL
+
+    def invalidate(self):
+        """forget anything cached about mounted volumes"""
+        pass
+
+if os.name == 'nt':
+    class _NtVolumes(Volumes):
+        def volume(self, path):
+            drive = os.path.splitdrive(os.path.abspath(path))[0]
+            return drive.upper()
+
+        def kind(self, volume):
+            if volume.startswith('\\\\'):
+                return NETWORK      # UNC path
+            import win32file
+            dtype = win32file.GetDriveType(volume + '\\')
+            if dtype == win32file.DRIVE_REMOTE:
+                return NETWORK
+            if dtype in (win32file.DRIVE_REMOVABLE, win32file.DRIVE_CDROM):
+                return REMOVABLE
+            return LOCAL
+
+else:
+    NETWORK_FSTYPES = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'afs',
+            'ncpfs', 'coda', '9p', 'fuse.sshfs', 'fuse.gvfsd-fuse')
+    REMOVABLE_DIRS = ('/media/', '/run/media/')
+
+    def _unescape(field):
+        # /proc/mounts escapes space, tab, newline and backslash
+        return field.replace('\\040', ' ').replace('\\011', '\t') \
+                .replace('\\012', '\n').replace('\\134', '\\')
+
+    class _PosixVolumes(Volumes):
+        """volumes are the mount points listed in /proc/mounts"""
+
+        def __init__(self, mounts='/proc/mounts'):
+            self._mounts_file = mounts
+            self._mounts = None
+
+        def _read_mounts(self):
+            mounts = {}
+            try:
+                fd = open(self._mounts_file)
+                try:
+                    for line in fd:
+                        fields = line.split()
+                        if len(fields) >= 3:
+                            mounts[_unescape(fields[1])] = fields[2]
+                finally:
+                    fd.close()
+            except IOError:
+                pass
+            return mounts
+
+        def volume(self, path):
+            if self._mounts is None:
+                self._mounts = self._read_mounts()
+            path = os.path.realpath(path)
+            while path not in self._mounts:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return None
+                path = parent
+            return path
+
+        def kind(self, volume):
+            fstype = (self._mounts or {}).get(volume, '')
+            if fstype in NETWORK_FSTYPES:
+                return NETWORK
+            for d in REMOVABLE_DIRS:
+                if volume.startswith(d):
+                    return REMOVABLE
+            return LOCAL
+
+        def invalidate(self):
+            self._mounts = None
+
+def get_volumes():
+    """return the volume classification of this platform"""
+    if os.name == 'nt':
+        return _NtVolumes()
+    return _PosixVolumes()
+
+def _stat_sig(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def config_files(root):
+    """the git configuration files read for the repository at root"""
+    files = [os.path.join(tgitutil.git_dir(root), 'config'),
+             os.path.expanduser(os.path.join('~', '.gitconfig'))]
+    xdg = os.environ.get('XDG_CONFIG_HOME') or \
+            os.path.expanduser(os.path.join('~', '.config'))
+    files.append(os.path.join(xdg, 'git', 'config'))
+    return files
+
+class OverlayPolicy(object):
+    """
+    Per repository overlay policy.
+
+    config_func(root) returns the (global, repository) lists of
+    tortoisegit.overlayicons values; volumes is a Volumes instance.
+    """
+
+    def __init__(self, config_func, volumes=None):
+        self._config_func = config_func
+        self._volumes = volumes or get_volumes()
+        self._lock = threading.Lock()
+        self._roots = {}
+        self._kinds = {}
+
+    def invalidate(self, root=None):
+        """drop cached policies, of all repositories or of one"""
+        self._lock.acquire()
+        try:
+            if root is None:
+                self._roots.clear()
+                self._kinds.clear()
+                self._volumes.invalidate()
+            else:
+                self._roots.pop(root, None)
+        finally:
+            self._lock.release()
+
+    def volume_kind(self, path):
+        """return the kind of volume path is on"""
+        self._lock.acquire()
+        try:
+            return self._volume_kind(path)
+        finally:
+            self._lock.release()
+
+    def _volume_kind(self, path):
+        volume = self._volumes.volume(path)
+        try:
+            return self._kinds[volume]
+        except KeyError:
+            pass
+        kind = self._kinds[volume] = self._volumes.kind(volume)
+        return kind
+
+    def enabled(self, root):
+        """check if overlay icons are to be displayed in this repo"""
+        sig = [_stat_sig(f) for f in config_files(root)]
+        self._lock.acquire()
+        try:
+            try:
+                csig, enabled = self._roots[root]
+                if csig == sig:
+                    return enabled
+            except KeyError:
+                pass
+            kind = self._volume_kind(root)
+        finally:
+            self._lock.release()
+
+        # git config runs without the lock held
+        global_opts, repo_opts = self._config_func(root)
+        print "%s: global overlayicons = " % root, global_opts
+        print "%s: repo overlayicons = " % root, repo_opts
+        enabled = True
+        if (kind == NETWORK and 'localdisks' in global_opts) or \
+                'False' in repo_opts:
+            print "%s: overlayicons disabled" % root
+            enabled = False
+
+        self._lock.acquire()
+        try:
+            self._roots[root] = (sig, enabled)
+        finally:
+            self._lock.release()
+        return enabled
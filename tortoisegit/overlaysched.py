@@ -0,0 +1,422 @@
+"""
+overlaysched.py - TortoiseGit overlay request scheduling
+
+The shell asks for overlay icons on its UI thread.  StatusScheduler
+answers within a time budget: status that takes longer is computed in
+the background, a neutral state is returned meanwhile, and the shell
+is told to refresh the items once their status is known.  Refresh
+notifications are batched by NotifyCoalescer.
+
+Background work is queued by directory (see DirQueue): the directory
+the shell is asking about most is served first, and the work for
+directories it stopped asking about is dropped.
+
+Nothing in here depends on the Windows shell but ShellNotifier, so
+the scheduling can be tested anywhere with a fake notifier.
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import time
+import threading
+import tgitutil
+from collections import OrderedDict
+
+# state returned while status is computed in the background; it
+# matches no overlay, so no icon is shown until the shell refreshes
+PENDING = "pending"
+
+# ticks IsMemberOf may wait for status
+TIME_BUDGET = 20
+
+# ticks late results are kept for the refresh following them, and
+# results on time for the other overlay handlers asking
+RESULT_TIMEOUT = 5000
+RECENT_TIMEOUT = 500
+MAX_RESULTS = 4096
+
+# ticks to wait for more late results before notifying the shell, and
+# number of items of one directory above which the whole directory is
+# refreshed instead of each item
+NOTIFY_DELAY = 100
+NOTIFY_DIR_THRESHOLD = 32
+
+# ticks after which the queries of a directory count half as much for
+# its priority
+PRIORITY_HALF_LIFE = 1000
+
+# ticks without queries after which the work queued for a directory
+# is dropped, if other directories have been queried since
+STALE_TIMEOUT = 3000
+
+def get_tick_count():
+    return int(time.time() * 1000)
+
+class ShellNotifier(object):
+    """tell the Windows shell to refresh items"""
+
+    def update_item(self, path):
+        tgitutil.shell_notify(path)
+
+    def update_dir(self, path):
+        tgitutil.shell_notify_dir(path)
+
+class NotifyCoalescer(object):
+    """
+    Collect items whose overlay changed, and pass them to a notifier
+    in batches: after NOTIFY_DELAY ticks without a flush, each
+    directory gets either its items or itself refreshed.
+    """
+
+    def __init__(self, notifier, delay=NOTIFY_DELAY,
+            dir_threshold=NOTIFY_DIR_THRESHOLD, tick_count=get_tick_count):
+        self._notifier = notifier
+        self._delay = delay
+        self._dir_threshold = dir_threshold
+        self._tick_count = tick_count
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._since = None
+        self._thread = None
+
+    def add(self, path):
+        self._cond.acquire()
+        try:
+            pdir = os.path.dirname(path)
+            self._pending.setdefault(pdir, set()).add(path)
+            if self._since is None:
+                self._since = self._tick_count()
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def _take(self):
+        pending = self._pending
+        self._pending = {}
+        self._since = None
+        return pending
+
+    def _send(self, pending):
+        for pdir, paths in sorted(pending.iteritems()):
+            if len(paths) > self._dir_threshold:
+                self._notifier.update_dir(pdir)
+            else:
+                for path in sorted(paths):
+                    self._notifier.update_item(path)
+
+    def flush(self):
+        """notify everything pending now"""
+        self._cond.acquire()
+        try:
+            pending = self._take()
+        finally:
+            self._cond.release()
+        self._send(pending)
+
+    def flush_due(self):
+        """
+        notify if the oldest pending item waited long enough; return
+        the ticks until the next flush is due, or None if idle
+        """
+        self._cond.acquire()
+        try:
+            if self._since is None:
+                return None
+            wait = self._since + self._delay - self._tick_count()
+            if wait > 0:
+                return wait
+            pending = self._take()
+        finally:
+            self._cond.release()
+        self._send(pending)
+        return None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            wait = self.flush_due()
+            self._cond.acquire()
+            try:
+                if wait is None and self._since is None:
+                    self._cond.wait()
+                elif wait is not None:
+                    self._cond.wait(wait / 1000.0)
+            finally:
+                self._cond.release()
+
+class _Job(object):
+    def __init__(self, path):
+        self.path = path
+        self.state = None
+        self.late = False
+        self.queued = None
+        self.done = threading.Event()
+
+class _Group(object):
+    """jobs queued for one directory, and how often it is queried"""
+    __slots__ = ('jobs', 'score', 'last')
+
+    def __init__(self, tick):
+        self.jobs = OrderedDict()
+        self.score = 0.0
+        self.last = tick
+
+    def rank(self, tick):
+        return self.score * 0.5 ** (float(tick - self.last) / PRIORITY_HALF_LIFE)
+
+    def hit(self, tick):
+        self.score = self.rank(tick) + 1
+        self.last = tick
+
+class DirQueue(object):
+    """
+    Job queue grouped by directory.
+
+    Every query (put or touch) raises the priority of its directory;
+    priorities decay by half every PRIORITY_HALF_LIFE ticks, and the
+    next job is taken from the directory with the highest one, in
+    arrival order.  Directories not queried for STALE_TIMEOUT ticks
+    while others were have their jobs passed to drop() instead.
+    """
+
+    def __init__(self, drop=None, stale=STALE_TIMEOUT,
+            tick_count=get_tick_count):
+        self._drop = drop
+        self._stale = stale
+        self._tick_count = tick_count
+        self._cond = threading.Condition()
+        self._groups = {}
+        self._latest = None
+        self._depth = 0
+        self.max_depth = 0
+        self.served = 0
+        self.dropped = 0
+        self.wait_total = 0
+        self.wait_max = 0
+
+    def __len__(self):
+        return self._depth
+
+    def put(self, job):
+        self._cond.acquire()
+        try:
+            tc = self._tick_count()
+            pdir = os.path.dirname(job.path)
+            group = self._groups.get(pdir)
+            if group is None:
+                group = self._groups[pdir] = _Group(tc)
+            group.jobs[job.path] = job
+            group.hit(tc)
+            self._latest = tc
+            job.queued = tc
+            self._depth += 1
+            self.max_depth = max(self.max_depth, self._depth)
+            self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def touch(self, path):
+        """count a query for a job already queued"""
+        self._cond.acquire()
+        try:
+            group = self._groups.get(os.path.dirname(path))
+            if group is not None and path in group.jobs:
+                group.hit(self._tick_count())
+                self._latest = group.last
+        finally:
+            self._cond.release()
+
+    def _expire(self, tc):
+        dropped = []
+        for pdir, group in self._groups.items():
+            if tc - group.last >= self._stale and group.last < self._latest:
+                dropped.extend(group.jobs.values())
+                del self._groups[pdir]
+        self._depth -= len(dropped)
+        self.dropped += len(dropped)
+        return dropped
+
+    def _take(self, tc):
+        best = None
+        for pdir, group in self._groups.iteritems():
+            rank = group.rank(tc)
+            if best is None or rank > best[0]:
+                best = (rank, pdir, group)
+        rank, pdir, group = best
+        path, job = group.jobs.popitem(last=False)
+        if not group.jobs:
+            del self._groups[pdir]
+        self._depth -= 1
+        wait = tc - job.queued
+        self.served += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        return job
+
+    def get(self, block=True):
+        """return the next job, or None if there is none and not block"""
+        while True:
+            job = None
+            self._cond.acquire()
+            try:
+                tc = self._tick_count()
+                dropped = self._expire(tc)
+                if self._groups:
+                    job = self._take(tc)
+                elif not dropped:
+                    if not block:
+                        return None
+                    self._cond.wait()
+            finally:
+                self._cond.release()
+            if self._drop is not None:
+                for d in dropped:
+                    self._drop(d)
+            if job is not None:
+                return job
+
+    def stats(self):
+        """return queue counters as a dict"""
+        self._cond.acquire()
+        try:
+            return {'queued' : self._depth, 'max_queued' : self.max_depth,
+                    'served' : self.served, 'dropped' : self.dropped,
+                    'wait_avg' : self.served and self.wait_total // self.served,
+                    'wait_max' : self.wait_max}
+        finally:
+            self._cond.release()
+
+class StatusScheduler(object):
+    """
+    Answer status queries within a time budget.
+
+    Queries are answered on the calling thread when they can be: from
+    the results of recent jobs, which every overlay handler asks for
+    in turn, or from lookup(path), which must not block and returns
+    None if the state isn't known.  Otherwise get_state(path) is run
+    by a worker thread; queries wait for it at most budget ticks, then
+    return PENDING.  The result of a late job is kept for a while and
+    its item is passed to the coalescer, so that the refresh it causes
+    is answered right away.  Jobs dropped
+    by the queue are forgotten: their items are computed again when
+    the shell asks for them next, as are those get_state itself left
+    PENDING.
+    """
+
+    def __init__(self, get_state, coalescer, budget=TIME_BUDGET,
+            tick_count=get_tick_count, lookup=None):
+        self._get_state = get_state
+        self._lookup = lookup
+        self._coalescer = coalescer
+        self._budget = budget
+        self._tick_count = tick_count
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._results = {}
+        self._queue = DirQueue(self._dropped, tick_count=tick_count)
+        self._worker = None
+        self.late = 0
+
+    def start(self):
+        if self._worker is not None:
+            return
+        self._coalescer.start()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.setDaemon(True)
+        self._worker.start()
+
+    def get_state(self, path):
+        self.start()
+        self._lock.acquire()
+        try:
+            # asked for by every overlay handler in turn
+            result = self._results.get(path)
+            if result is not None:
+                state, expires = result
+                if self._tick_count() < expires:
+                    return state
+                del self._results[path]
+        finally:
+            self._lock.release()
+
+        if self._lookup is not None:
+            state = self._lookup(path)
+            if state is not None:
+                return state
+
+        self._lock.acquire()
+        try:
+            job = self._jobs.get(path)
+            if job is None:
+                job = self._jobs[path] = _Job(path)
+                self._queue.put(job)
+            else:
+                self._queue.touch(path)
+                if job.late:
+                    return PENDING
+        finally:
+            self._lock.release()
+
+        job.done.wait(self._budget / 1000.0)
+        self._lock.acquire()
+        try:
+            if job.done.isSet():
+                return job.state
+            if not job.late:
+                job.late = True
+                self.late += 1
+            return PENDING
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """return scheduling counters as a dict"""
+        stats = self._queue.stats()
+        stats['late'] = self.late
+        return stats
+
+    def _dropped(self, job):
+        self._lock.acquire()
+        try:
+            if self._jobs.get(job.path) is job:
+                del self._jobs[job.path]
+            job.state = PENDING
+            job.done.set()
+        finally:
+            self._lock.release()
+
+    def _run(self):
+        while True:
+            self._process(self._queue.get())
+
+    def _process(self, job):
+        try:
+            state = self._get_state(job.path)
+        except Exception, inst:
+            print "status of %s failed: %s" % (job.path, inst)
+            state = None
+        self._lock.acquire()
+        try:
+            job.state = state
+            job.done.set()
+            del self._jobs[job.path]
+            if state == PENDING:
+                return
+            if len(self._results) >= MAX_RESULTS:
+                self._results.clear()
+            timeout = job.late and RESULT_TIMEOUT or RECENT_TIMEOUT
+            self._results[job.path] = (state, self._tick_count() + timeout)
+            if not job.late:
+                return
+        finally:
+            self._lock.release()
+        self._coalescer.add(job.path)
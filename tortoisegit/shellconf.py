@@ -9,6 +9,8 @@ show_overlay_icons = False
 
 def read():
     global show_overlay_icons
-    overlayicons = ui.ui().config('tortoisehg', 'overlayicons', '')
-    print "tortoisehg.overlayicons = ", overlayicons
+    u = ui.ui()
+    overlayicons = u.config('tortoisegit', 'overlayicons',
+            u.config('tortoisehg', 'overlayicons', ''))
+    print "tortoisegit.overlayicons = ", overlayicons
     show_overlay_icons = overlayicons != 'disabled'
@@ -0,0 +1,1053 @@
+"""
+statuscache.py - TortoiseGit working directory status cache
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+import time
+import zlib
+import marshal
+import threading
+import subprocess
+import tgitutil
+from collections import OrderedDict
+from statustrie import StatusTrie
+from overlaypolicy import OverlayPolicy
+
+# file/directory status
+UNCHANGED = "unchanged"
+ADDED = "added"
+MODIFIED = "modified"
+UNKNOWN = "unknown"
+IGNORED = "ignored"
+NOT_IN_REPO = "n/a"
+
+# state of a directory is the first of these states found below it
+DIR_PRIORITY = (MODIFIED, ADDED, UNCHANGED, UNKNOWN, IGNORED)
+
+# ticks during which cached status is trusted without checking the
+# repository and directory signatures again
+CHECK_INTERVAL = 500
+
+# ticks to cache directories with no signature (outside of any
+# repository, or overlay icons disabled), and directories of
+# repositories no watcher reports changes for: their signature
+# doesn't show changes made deeper down
+CACHE_TIMEOUT = 5000
+
+# file status cache limits: number of directories, and number of files
+# loaded for them (about 100 bytes each)
+CACHE_MAXDIRS = 256
+CACHE_MAXPATHS = 200000
+
+# ticks between two snapshots of the status of a repository
+SNAPSHOT_INTERVAL = 30000
+SNAPSHOT_MAGIC = 'tgitstatus'
+SNAPSHOT_VERSION = 2
+
+# maximum number of submodules whose status is computed at once
+MAX_PARALLEL = 4
+
+# maximum number of pathspecs passed on one git command line
+MAX_PATHSPECS = 500
+
+class StatusError(Exception):
+    """Raised by status functions when the status can't be computed."""
+
+def get_tick_count():
+    """milliseconds clock, comparable to win32api.GetTickCount()"""
+    return int(time.time() * 1000)
+
+def _stat_sig(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+def repo_signature(root):
+    """
+    Cheap signature of the repository state at root, changing whenever
+    the index is written or HEAD (or the branch it points to) moves.
+    """
+    gitdir = tgitutil.git_dir(root)
+    try:
+        fd = open(os.path.join(gitdir, 'HEAD'))
+        try:
+            head = fd.read().strip()
+        finally:
+            fd.close()
+    except IOError:
+        head = None
+    sig = [_stat_sig(os.path.join(gitdir, 'index')), head]
+    if head and head.startswith('ref: '):
+        ref = head[5:].split('/')
+        sig.append(_stat_sig(os.path.join(gitdir, *ref)))
+        sig.append(_stat_sig(os.path.join(gitdir, 'packed-refs')))
+    return tuple(sig)
+
+def dir_signature(pdir):
+    """
+    Cheap signature of a directory, changing whenever one of its
+    entries is created, removed, renamed or written to.  The .git
+    entry is left out: git itself writes to it, if only to refresh
+    the index, and the repository signature covers what matters.
+    """
+    try:
+        names = os.listdir(pdir)
+    except OSError:
+        return None
+    names.sort()
+    sig = [_stat_sig(pdir)]
+    for name in names:
+        if name == '.git':
+            continue
+        sig.append((name, _stat_sig(os.path.join(pdir, name))))
+    return hash(tuple(sig))
+
+def _relpath(root, path):
+    if path == root:
+        return ''
+    return path[len(root)+1:]
+
+def _git(root, args, input=None):
+    """run git in root, return its output"""
+    cmdline = ['git'] + args
+    flags = 0
+    if os.name == 'nt':
+        import win32con
+        flags = win32con.CREATE_NO_WINDOW
+    try:
+        proc = subprocess.Popen(cmdline, cwd=root, shell=False,
+                creationflags=flags, stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError, inst:
+        raise StatusError('%s: %s' % (' '.join(cmdline[:3]), inst))
+    out, err = proc.communicate(input)
+    if proc.returncode and proc.returncode != 1:
+        raise StatusError(err.strip() or '%s failed' % ' '.join(cmdline[:3]))
+    return out
+
+def _git_paths(root, args, specs):
+    """run git for each chunk of pathspecs, return NUL separated output"""
+    out = []
+    for i in xrange(0, len(specs), MAX_PATHSPECS):
+        chunk = specs[i:i + MAX_PATHSPECS]
+        out.extend(_git(root, ['--literal-pathspecs'] + args + ['--'] + chunk)
+                .split('\0'))
+    return [f for f in out if f]
+
+def _to_git(path):
+    return path.replace(os.sep, '/')
+
+# overlay icons setting, and the name it had before
+OVERLAY_KEY = 'tortoisegit.overlayicons'
+OLD_OVERLAY_KEY = 'tortoisehg.overlayicons'
+
+def _overlay_opts(root, scope):
+    opts = _git(root, ['config', scope, '--get-all', OVERLAY_KEY]).split()
+    if not opts:
+        opts = _git(root, ['config', scope, '--get-all',
+                OLD_OVERLAY_KEY]).split()
+    return opts
+
+def overlay_config(root):
+    """
+    return the global and repository tortoisegit.overlayicons values,
+    or the tortoisehg.overlayicons ones where they are not set
+    """
+    return _overlay_opts(root, '--global'), _overlay_opts(root, '--local')
+
+# overlay policy of the repositories, shared by all status caches
+overlay_policy = OverlayPolicy(overlay_config)
+
+def overlays_enabled(root):
+    """check if overlay icons are to be displayed in this repo"""
+    return overlay_policy.enabled(root)
+
+def dir_ignored(root, pdir):
+    """
+    check if the directory pdir is ignored in the repository at root,
+    by itself or by one of its parents
+    """
+    return bool(_git(root, ['check-ignore', '-z', '--stdin'],
+            _to_git(_relpath(root, pdir))).strip('\0'))
+
+def submodule_dirty(root):
+    """check if tracked files of the working directory at root changed"""
+    return bool(_git(root, ['status', '--porcelain', '-z',
+            '--untracked-files=no', '--ignore-submodules=dirty']).strip('\0'))
+
+def repo_status(root, pdir, files=None):
+    """
+    Get status of the entries of pdir in the repository at root, or of
+    just the given files (full paths).
+
+    The scan is scoped to pdir: tracked files are looked up in the
+    index by path prefix, and only the entries of pdir itself (not of
+    its subdirectories) are checked for untracked and ignored files.
+    An untracked or ignored directory is reported as one entry.
+
+    Returns the (modified, added, removed, deleted, unknown, ignored,
+    clean) lists of paths relative to root, or None if overlay icons
+    are disabled for the repository.
+    """
+    if not overlays_enabled(root):
+        return None
+
+    tc1 = get_tick_count()
+    if files is None:
+        rel = _relpath(root, pdir)
+        specs = [rel and _to_git(rel) + '/' or '.']
+        try:
+            candidates = [os.path.join(pdir, f) for f in os.listdir(pdir)
+                    if f != '.git']
+        except OSError, inst:
+            raise StatusError(str(inst))
+    else:
+        specs = [_to_git(_relpath(root, f)) for f in files]
+        candidates = [f for f in files if os.path.lexists(f)]
+
+    modified, added, removed, deleted = [], [], [], []
+    changed = set()
+    # submodule work trees are left to their own status (see
+    # submodule_dirty), only new submodule commits are reported here
+    entries = iter(_git_paths(root,
+            ['status', '--porcelain', '-z', '--untracked-files=no',
+             '--ignore-submodules=dirty'], specs))
+    for entry in entries:
+        x, y, f = entry[0], entry[1], entry[3:]
+        changed.add(f)
+        if x in 'RC':
+            # rename/copy source follows
+            source = entries.next()
+            if x == 'R':
+                removed.append(source)
+                changed.add(source)
+            added.append(f)
+        elif x == 'A':
+            added.append(f)
+        elif x == 'D':
+            removed.append(f)
+        elif y == 'D':
+            deleted.append(f)
+        else:
+            modified.append(f)
+
+    indexed = _git_paths(root, ['ls-files', '-z'], specs)
+    clean = [f for f in indexed if f not in changed]
+
+    # anything in pdir with nothing below it in the index is untracked
+    tracked = set(indexed)
+    for f in indexed:
+        d = f.rpartition('/')[0]
+        while d and d not in tracked:
+            tracked.add(d)
+            d = d.rpartition('/')[0]
+    untracked = [_to_git(_relpath(root, f)) for f in candidates]
+    untracked = [f for f in untracked if f not in tracked]
+    ignored = []
+    if untracked:
+        ignored = _git(root, ['check-ignore', '-z', '--stdin'],
+                '\0'.join(untracked)).split('\0')
+        ignored = [f for f in ignored if f]
+    ignored_set = set(ignored)
+    unknown = [f for f in untracked if f not in ignored_set]
+    print "status() took %d ticks" % (get_tick_count() - tc1)
+    return modified, added, removed, deleted, unknown, ignored, clean
+
+class LRUCache(object):
+    """
+    Mapping bounded by number of entries and by total cost of the
+    entries.  The least recently used entries are evicted first.
+    """
+
+    def __init__(self, maxentries, maxcost=None, evict=None):
+        self.maxentries = maxentries
+        self.maxcost = maxcost
+        self.evict = evict
+        self.cost = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return self._data.keys()
+
+    def peek(self, key, default=None):
+        """like get(), without marking the entry as recently used"""
+        try:
+            return self._data[key][0]
+        except KeyError:
+            return default
+
+    def get(self, key, default=None):
+        try:
+            value, cost = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = (value, cost)
+        return value
+
+    def put(self, key, value, cost=1):
+        self.pop(key)
+        self._data[key] = (value, cost)
+        self.cost += cost
+        while len(self._data) > 1 and (len(self._data) > self.maxentries
+                or (self.maxcost is not None and self.cost > self.maxcost)):
+            okey, (ovalue, ocost) = self._data.popitem(last=False)
+            self.cost -= ocost
+            self.evictions += 1
+            if self.evict:
+                self.evict(okey, ovalue)
+
+    def pop(self, key, default=None):
+        try:
+            value, cost = self._data.pop(key)
+        except KeyError:
+            return default
+        self.cost -= cost
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self.cost = 0
+
+def file_states(status):
+    """map status lists to (path, state) pairs"""
+    modified, added, removed, deleted, unknown, ignored, clean = status
+    for grp, st in (
+            (ignored, IGNORED),
+            (unknown, UNKNOWN),
+            (clean, UNCHANGED),
+            (added, ADDED),
+            (removed, MODIFIED),
+            (deleted, MODIFIED),
+            (modified, MODIFIED)):
+        for f in grp:
+            yield os.path.normpath(f), st
+
+def snapshot_path(root):
+    return os.path.join(tgitutil.git_dir(root), 'tgitstatus')
+
+def write_snapshot(root, sig, dirs, states):
+    """
+    Save the status of the repository at root: its signature, the
+    (directory, signature) pairs of the directories whose status is
+    included, and the (path, state) pairs of their files.  Paths are
+    relative to root.
+    """
+    groups = {}
+    for path, st in states:
+        groups.setdefault(st, []).append(path)
+    # marshal, not pickle: the file comes with the working copy, and
+    # must not be able to run anything when read
+    data = SNAPSHOT_MAGIC + zlib.compress(marshal.dumps(
+            (SNAPSHOT_VERSION, sig, dirs, groups), 2), 1)
+    path = snapshot_path(root)
+    tmp = '%s.%d' % (path, os.getpid())
+    try:
+        fd = open(tmp, 'wb')
+        try:
+            fd.write(data)
+        finally:
+            fd.close()
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows doesn't replace existing files
+            os.unlink(path)
+            os.rename(tmp, path)
+    except (IOError, OSError), inst:
+        print "can't save status snapshot of %s: %s" % (root, inst)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+_PLAIN_TYPES = (type(None), bool, int, long, float, str, unicode)
+
+def _is_plain(obj):
+    """check that obj is made of tuples of numbers and strings"""
+    if isinstance(obj, tuple):
+        for x in obj:
+            if not _is_plain(x):
+                return False
+        return True
+    return isinstance(obj, _PLAIN_TYPES)
+
+def _is_path(path):
+    return isinstance(path, str) and not os.path.isabs(path) and \
+            '..' not in path.split(os.sep)
+
+def read_snapshot(root):
+    """
+    Return the (sig, dirs, states) saved by write_snapshot, or None if
+    there is no usable snapshot.  Anything but what write_snapshot
+    writes is rejected.
+    """
+    try:
+        fd = open(snapshot_path(root), 'rb')
+        try:
+            data = fd.read()
+        finally:
+            fd.close()
+        if not data.startswith(SNAPSHOT_MAGIC):
+            return None
+        version, sig, dirs, groups = marshal.loads(
+                zlib.decompress(data[len(SNAPSHOT_MAGIC):]))
+    except Exception:
+        # missing, truncated, or written by another version
+        return None
+    if version != SNAPSHOT_VERSION or not _is_plain(sig) or \
+            not isinstance(dirs, list) or not isinstance(groups, dict):
+        return None
+    for d in dirs:
+        if not isinstance(d, tuple) or len(d) != 2 or \
+                not (d[0] == '' or _is_path(d[0])) or not _is_plain(d[1]):
+            return None
+    states = []
+    for st, paths in groups.iteritems():
+        if st not in DIR_PRIORITY or not isinstance(paths, list):
+            return None
+        for path in paths:
+            if not _is_path(path):
+                return None
+        states.extend([(path, st) for path in paths])
+    return sig, dirs, states
+
+class _DirStatus(object):
+    """
+    Cached status of one directory.  Unless sig is None, the status of
+    everything below the directory is loaded in the repository trie.
+    """
+
+    def __init__(self, root, default, tick, sig=None):
+        self.root = root
+        self.default = default
+        self.tick = tick
+        self.checked = tick
+        self.sig = sig
+        # submodules in the directory, and their repository signatures
+        self.submodules = ()
+        self.subsigs = None
+
+class StatusCache(object):
+    """
+    Cache of working directory status.
+
+    The status of the files of each repository is kept in a StatusTrie
+    (see statustrie.py), which gives directory states and keeps them
+    up to date as files change.  The directories queried are tracked
+    in an LRU cache; when one is evicted, the part of the trie that
+    was loaded for it (and no other directory) is dropped.
+
+    Untracked and ignored directories are stored in the trie as one
+    entry.  Everything below an ignored directory is answered from
+    that entry, or from the ignore rules (ignored_func) if nothing
+    above it is loaded, without running status.
+
+    Cached directories are rescanned when their signature (the
+    repository signature and the directory signature) changes.  The
+    signatures are checked at most once every check_interval ticks.
+    As a directory signature only covers the entries of the directory
+    itself, directories are also rescanned after timeout ticks, unless
+    they were loaded while a watcher reported the changes of their
+    repository.
+
+    Submodules are repositories of their own, with their own tries.
+    In the repository containing them, the entry of a submodule is
+    shown modified when the submodule has a new commit or when its
+    tracked files changed (see summary_func).  That summary is kept
+    for timeout ticks, and computed for several submodules in
+    parallel.
+
+    With a watcher (see fswatch.py), directory signatures are not
+    needed: the paths reported changed by the watcher get their status
+    refreshed and patched into the trie.  A watcher may take a while
+    to start watching a tree; until then, the repository is treated as
+    unwatched.
+
+    With snapshots, the status of each repository is also saved to
+    disk now and then (see write_snapshot), so that a new process can
+    answer from it right away.  A snapshot is used only if the
+    repository signature still matches; the directories restored
+    from it are trusted for check_interval ticks, then checked
+    against their saved signature like any other.
+
+    One instance is shared by all overlay handlers of a process, or
+    owned by the status cache server (see cachesrv.py) on behalf of
+    all the shell processes of a session.  Status and submodule
+    summaries are computed with the lock released, one computation
+    per repository at a time: other misses of the same repository
+    wait for it, then look at the cache again.
+    """
+
+    def __init__(self, status_func=repo_status, timeout=CACHE_TIMEOUT,
+            tick_count=get_tick_count, maxdirs=CACHE_MAXDIRS,
+            maxpaths=CACHE_MAXPATHS, check_interval=CHECK_INTERVAL,
+            watcher=None, snapshots=False, ignored_func=dir_ignored,
+            summary_func=submodule_dirty):
+        self._status_func = status_func
+        self._summary_func = summary_func
+        self._ignored_func = ignored_func
+        self._watcher = watcher
+        self._timeout = timeout
+        self._check_interval = check_interval
+        self._tick_count = tick_count
+        self._lock = threading.RLock()
+        self._done = threading.Condition(self._lock)
+        self._running = set()
+        self._dirs = LRUCache(maxdirs, maxpaths, self._evicted)
+        self._tries = {}
+        self._repo_sigs = {}
+        self._summaries = {}
+        self._rolled = {}
+        self._snapshots = snapshots
+        self._restore_tried = set()
+        self._dirty = set()
+        self._saved = {}
+        self.hits = 0
+        self.misses = 0
+        self.patches = 0
+        self.restored = 0
+
+    def clear(self, root=None):
+        """drop cached status of all directories, or of one repository"""
+        self._lock.acquire()
+        try:
+            if root is None:
+                self._dirs.clear()
+                self._tries.clear()
+                self._repo_sigs.clear()
+                self._summaries.clear()
+                self._rolled.clear()
+                self._dirty.clear()
+                return
+            self._tries.pop(root, None)
+            self._repo_sigs.pop(root, None)
+            self._summaries.pop(root, None)
+            self._rolled.pop(root, None)
+            self._dirty.discard(root)
+            for pdir in self._dirs.keys():
+                if self._dirs.peek(pdir).root == root:
+                    self._dirs.pop(pdir)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        if self._snapshots:
+            self.save_snapshots()
+        if self._watcher is not None:
+            self._watcher.close()
+
+    def stats(self):
+        """return cache counters as a dict"""
+        self._lock.acquire()
+        try:
+            files = sum([len(t) for t in self._tries.itervalues()])
+            return {'hits' : self.hits, 'misses' : self.misses,
+                    'patches' : self.patches, 'restored' : self.restored,
+                    'files' : files,
+                    'dirs' : len(self._dirs), 'paths' : self._dirs.cost,
+                    'evictions' : self._dirs.evictions}
+        finally:
+            self._lock.release()
+
+    def get_state(self, path):
+        """
+        Get the state of a given path in source control.
+        """
+        self._lock.acquire()
+        try:
+            return self._get_state(path)
+        finally:
+            self._lock.release()
+
+    def peek_state(self, path):
+        """
+        Get the state of a given path if its status is cached and
+        trusted without checking, else None.  Never waits for the lock.
+        """
+        if not self._lock.acquire(False):
+            return None
+        try:
+            entry = self._dirs.peek(os.path.dirname(path))
+            if entry is None or \
+                    self._tick_count() - entry.checked >= self._check_interval:
+                return None
+            if entry.sig is None:
+                return entry.default
+            trie = self._tries.get(entry.root)
+            if trie is None:
+                return None
+            return trie.get(_relpath(entry.root, path), entry.default)
+        finally:
+            self._lock.release()
+
+    def get_dir_states(self, pdir):
+        """
+        Get the states of the entries of directory pdir, as a dict by
+        name.  The directory's status is loaded once for all of them.
+        """
+        try:
+            names = os.listdir(pdir)
+        except OSError:
+            return {}
+        self._lock.acquire()
+        try:
+            return dict([(name, self._get_state(os.path.join(pdir, name)))
+                         for name in names])
+        finally:
+            self._lock.release()
+
+    def _loaded_entry(self, root, pdir):
+        """
+        return the (directory, entry) for which the status of pdir is
+        loaded, pdir or one of its parents, or None
+        """
+        while True:
+            entry = self._dirs.peek(pdir)
+            if entry is not None and entry.root == root and entry.sig:
+                return pdir, entry
+            if pdir == root:
+                return None
+            parent = os.path.dirname(pdir)
+            if parent == pdir:
+                return None
+            pdir = parent
+
+    def _is_loaded(self, root, pdir):
+        """is the status of pdir loaded for pdir or one of its parents"""
+        return self._loaded_entry(root, pdir) is not None
+
+    def _ignored_parent(self, pdir, tc):
+        """
+        check if pdir is, or is below, a directory the trie has as
+        ignored, and the status it was loaded with is still valid
+        """
+        for root in self._tries.keys():
+            if not pdir.startswith(root + os.sep):
+                continue
+            covering = self._tries[root].covering(_relpath(root, pdir))
+            if covering is None or covering[1] != IGNORED:
+                continue
+            ignored = os.path.join(root, covering[0])
+            loaded = self._loaded_entry(root, os.path.dirname(ignored))
+            if loaded is None or not self._is_valid(loaded[1], loaded[0], tc):
+                continue
+            # validation may have patched or dropped the trie
+            trie = self._tries.get(root)
+            if trie is not None and trie.covering(covering[0]) == covering:
+                return True
+        return False
+
+    def _loaded_below(self, root, pdir):
+        """directories below pdir with status loaded for themselves"""
+        prefix = pdir + os.sep
+        return [_relpath(root, d) for d in self._dirs.keys()
+                if d.startswith(prefix) and self._dirs.peek(d).root == root
+                and self._dirs.peek(d).sig]
+
+    def _evicted(self, pdir, entry):
+        trie = self._tries.get(entry.root)
+        if entry.sig is None or trie is None:
+            return
+        root = entry.root
+        if pdir != root and self._is_loaded(root, os.path.dirname(pdir)):
+            return
+        trie.prune(_relpath(root, pdir), self._loaded_below(root, pdir))
+        if not len(trie):
+            del self._tries[root]
+            self._rolled.pop(root, None)
+            self._dirty.discard(root)
+
+    def _store(self, pdir, root, default, sig=None, cost=0):
+        entry = _DirStatus(root, default, self._tick_count(), sig)
+        self._dirs.put(pdir, entry, cost + 1)
+        return entry
+
+    def _find_submodules(self, root, pdir, entry, tc):
+        """record the submodules in pdir on its entry"""
+        if not os.path.exists(os.path.join(root, '.gitmodules')):
+            return
+        trie = self._tries[root]
+        entry.submodules = [os.path.join(pdir, name) for name, st
+                in trie.files(_relpath(root, pdir))
+                if st in (UNCHANGED, MODIFIED) and
+                os.path.lexists(os.path.join(pdir, name, '.git'))]
+        entry.subsigs = [self._repo_signature(sub, tc)
+                for sub in entry.submodules]
+
+    def _wait_running(self, key):
+        """
+        wait for the computation running for key, if any; return True
+        if there was one, and the cache is to be looked at again
+        """
+        if key not in self._running:
+            return False
+        while key in self._running:
+            self._done.wait()
+        return True
+
+    def _run_unlocked(self, key, func, *args):
+        """return func(*args), run for key with the lock released"""
+        self._running.add(key)
+        self._lock.release()
+        try:
+            return func(*args)
+        finally:
+            self._lock.acquire()
+            self._running.discard(key)
+            self._done.notifyAll()
+
+    def _summarize(self, subroots):
+        """
+        compute the summaries of subroots, several at once; return
+        them as a dict
+        """
+        results = {}
+        def summarize(sub):
+            try:
+                results[sub] = self._summary_func(sub)
+            except StatusError, inst:
+                print "abort: %s" % inst
+                results[sub] = False
+        for i in xrange(0, len(subroots), MAX_PARALLEL):
+            threads = []
+            for sub in subroots[i + 1:i + MAX_PARALLEL]:
+                t = threading.Thread(target=summarize, args=(sub,))
+                t.start()
+                threads.append(t)
+            summarize(subroots[i])
+            for t in threads:
+                t.join()
+        return results
+
+    def _stale_summaries(self, entry, tc):
+        stale = []
+        for sub in entry.submodules:
+            summary = self._summaries.get(sub)
+            if summary is None or tc - summary[0] >= self._timeout or \
+                    self._repo_signature(sub, tc) != summary[1]:
+                stale.append(sub)
+        return stale
+
+    def _roll_up(self, entry, tc):
+        """show the submodules of entry modified if they are dirty"""
+        root = entry.root
+        key = ('summaries', root)
+        stale = self._stale_summaries(entry, tc)
+        if stale and self._wait_running(key):
+            stale = self._stale_summaries(entry, tc)
+        if stale:
+            sigs = dict([(sub, self._repo_signature(sub, tc))
+                         for sub in stale])
+            results = self._run_unlocked(key, self._summarize, stale)
+            for sub in stale:
+                self._summaries[sub] = (tc, sigs[sub], results[sub])
+        trie = self._tries.get(root)
+        if trie is None:
+            return      # dropped meanwhile
+        rolled = self._rolled.setdefault(root, set())
+        for sub in entry.submodules:
+            rel = _relpath(root, sub)
+            st = trie.get(rel)
+            if st is None:
+                rolled.discard(rel)
+                continue
+            if rel in rolled:
+                st = UNCHANGED
+            summary = self._summaries.get(sub)
+            if st == UNCHANGED and summary is not None and summary[2]:
+                trie.set(rel, MODIFIED)
+                rolled.add(rel)
+            else:
+                trie.set(rel, st)
+                rolled.discard(rel)
+
+    def _repo_signature(self, root, tc):
+        try:
+            checked, sig = self._repo_sigs[root]
+            if tc - checked < self._check_interval:
+                return sig
+        except KeyError:
+            pass
+        sig = repo_signature(root)
+        self._repo_sigs[root] = (tc, sig)
+        return sig
+
+    def _is_watched(self, root):
+        return self._watcher is not None and self._watcher.is_watching(root)
+
+    def _signature(self, root, pdir, tc, watched=None):
+        if watched is None:
+            watched = self._is_watched(root)
+        if watched:
+            return (self._repo_signature(root, tc), None)
+        return (self._repo_signature(root, tc), dir_signature(pdir))
+
+    def _is_valid(self, entry, pdir, tc):
+        if tc - entry.checked < self._check_interval:
+            return True
+        if entry.sig is None:
+            return tc - entry.tick < self._timeout
+        watched = self._is_watched(entry.root)
+        # directories loaded before the watcher reported changes (or
+        # restored from a snapshot) have a directory signature, which
+        # doesn't show files changed deeper down: they expire
+        if entry.sig[1] is None:
+            if not watched:
+                return False    # the watcher stopped reporting changes
+        elif tc - entry.tick >= self._timeout:
+            return False
+        if watched:
+            self._apply_changes(entry.root)
+            self._maybe_save(entry.root, tc)
+            if self._dirs.peek(pdir) is not entry:
+                return False
+        sig = self._signature(entry.root, pdir, tc, entry.sig[1] is None)
+        if sig != entry.sig:
+            return False
+        # a new commit in a submodule changes its entry
+        if entry.submodules and entry.subsigs != [self._repo_signature(sub, tc)
+                for sub in entry.submodules]:
+            return False
+        entry.checked = tc
+        return True
+
+    def save_snapshots(self):
+        """save the status of the repositories changed since saved"""
+        self._lock.acquire()
+        try:
+            for root in list(self._dirty):
+                self._save_snapshot(root, self._tick_count())
+        finally:
+            self._lock.release()
+
+    def _maybe_save(self, root, tc):
+        if not self._snapshots or root not in self._dirty:
+            return
+        if tc - self._saved.get(root, tc - SNAPSHOT_INTERVAL) >= SNAPSHOT_INTERVAL:
+            self._save_snapshot(root, tc)
+
+    def _save_snapshot(self, root, tc):
+        self._saved[root] = tc
+        self._repo_sigs.pop(root, None)
+        repo_sig = self._repo_signature(root, tc)
+        dirs = []
+        for pdir in self._dirs.keys():
+            entry = self._dirs.peek(pdir)
+            if entry.root != root or not entry.sig or entry.sig[0] != repo_sig:
+                continue
+            dsig = entry.sig[1]
+            if dsig is None:
+                dsig = dir_signature(pdir)
+            dirs.append((_relpath(root, pdir), dsig))
+        # changes made after the directory signatures were taken will
+        # invalidate them, so the snapshot can't miss any
+        if self._is_watched(root):
+            self._apply_changes(root)
+        self._dirty.discard(root)
+        trie = self._tries.get(root)
+        if trie is None or not dirs:
+            return
+        # states rolled up from submodules are computed again on load
+        rolled = self._rolled.get(root, ())
+        states = [(f, f in rolled and UNCHANGED or st) for f, st in trie.items()]
+        write_snapshot(root, repo_sig, dirs, states)
+
+    def _restore(self, root, tc):
+        """load the status snapshot of root, if still valid"""
+        self._restore_tried.add(root)
+        snapshot = read_snapshot(root)
+        if snapshot is None:
+            return
+        sig, dirs, states = snapshot
+        self._repo_sigs.pop(root, None)
+        repo_sig = self._repo_signature(root, tc)
+        if sig != repo_sig:
+            return
+        trie = self._tries[root] = StatusTrie(DIR_PRIORITY)
+        costs = dict.fromkeys([d for d, dsig in dirs], 0)
+        for f, st in states:
+            trie.set(f, st)
+            d = os.path.dirname(f)
+            while d and d not in costs:
+                d = os.path.dirname(d)
+            if d in costs:
+                costs[d] += 1
+        for reldir, dsig in dirs:
+            pdir = reldir and os.path.join(root, reldir) or root
+            entry = self._store(pdir, root, UNKNOWN, (repo_sig, dsig),
+                    costs[reldir])
+            self._find_submodules(root, pdir, entry, tc)
+        self._saved[root] = tc
+        self.restored += 1
+
+    def _apply_changes(self, root):
+        """patch the trie of root with the watcher's changes"""
+        changes = self._watcher.changes(root)
+        if changes is None:
+            print "%s: changes lost, dropping cached status" % root
+            self.clear(root)
+            return
+        for path in changes:
+            if os.path.basename(path) == '.git':
+                # a repository was created or removed below root
+                tgitutil.root_cache.invalidate(os.path.dirname(path))
+        trie = self._tries.get(root)
+        if not changes or trie is None:
+            return
+
+        paths = [p for p in changes if self._is_loaded(root, os.path.dirname(p))]
+        if not paths:
+            return
+        try:
+            status = self._status_func(root, root, files=paths)
+        except StatusError, inst:
+            print "abort: %s" % inst
+            self.clear(root)
+            return
+        if status is None:
+            self.clear(root)
+            return
+        self._dirty.add(root)
+        rolled = self._rolled.get(root, ())
+        for path in paths:
+            rel = _relpath(root, path)
+            if rel in rolled:
+                rolled.discard(rel)
+            # the status of a directory only lists its tracked files;
+            # the entries added or removed below it are changes of their
+            # own, so its untracked and ignored entries are kept
+            if os.path.isdir(path) and not os.path.islink(path) and \
+                    trie.covering(rel) is None:
+                continue
+            # gone from disk and from the index, unless listed again
+            trie.remove(rel)
+        for f, st in file_states(status):
+            trie.set(f, st)
+        self.patches += 1
+
+    def _get_state(self, path):
+        tc = self._tick_count()
+
+        # check if path is cached
+        pdir = os.path.dirname(path)
+        entry = self._dirs.get(pdir)
+        if entry is not None:
+            if self._is_valid(entry, pdir, tc):
+                self.hits += 1
+                if entry.sig is None:
+                    return entry.default
+                if entry.submodules:
+                    self._roll_up(entry, tc)
+                trie = self._tries.get(entry.root)
+                if trie is None:
+                    return entry.default    # dropped meanwhile
+                return trie.get(_relpath(entry.root, path), entry.default)
+            self._dirs.pop(pdir)
+
+        # inside an ignored directory, known from its parent's status
+        if self._ignored_parent(pdir, tc):
+            self.hits += 1
+            return IGNORED
+        self.misses += 1
+
+        # path is a drive
+        if path.endswith(":\\"):
+            return NOT_IN_REPO
+
+        # find repo root
+        root = tgitutil.find_root(pdir)
+        if root is None:
+            self._store(pdir, None, NOT_IN_REPO)
+            return NOT_IN_REPO
+
+        # start watching before status, so no change can be missed
+        if self._watcher is not None and not self._watcher.is_watching(root):
+            self._watcher.watch(root)
+
+        # a new process starts from the last snapshot of the repository
+        if self._snapshots and root not in self._tries and \
+                root not in self._restore_tried:
+            self._restore(root, tc)
+            entry = self._dirs.peek(pdir)
+            if entry is not None and entry.root == root:
+                if entry.submodules:
+                    self._roll_up(entry, tc)
+                trie = self._tries.get(root)
+                if trie is None:
+                    return UNKNOWN
+                return trie.get(_relpath(root, path), UNKNOWN)
+            if self._ignored_parent(pdir, tc):
+                return IGNORED
+
+        # inside an ignored directory, nothing is worth a status; the
+        # ignore rules are only asked if the parent's status isn't known
+        if pdir != root and not self._is_loaded(root, os.path.dirname(pdir)):
+            try:
+                if self._ignored_func(root, pdir):
+                    self._store(pdir, root, IGNORED)
+                    return IGNORED
+            except StatusError, inst:
+                print "abort: %s" % inst
+
+        # the status of another directory of the repository may be
+        # running: this one may be loaded or ignored once it's done
+        if self._wait_running(root):
+            self.misses -= 1    # counted again
+            return self._get_state(path)
+
+        # get file status; the signature is taken after status(), which
+        # may have refreshed the index.  Changes made during status()
+        # are reported by the watcher, or picked up once timeout ticks
+        # have passed.
+        try:
+            status = self._run_unlocked(root, self._status_func, root, pdir)
+        except StatusError, inst:
+            print "abort: %s" % inst
+            print "treat as unknown : %s" % path
+            return UNKNOWN
+        if status is None:
+            self._store(pdir, root, NOT_IN_REPO)
+            return NOT_IN_REPO
+        self._repo_sigs.pop(root, None)
+        sig = self._signature(root, pdir, tc)
+
+        trie = self._tries.get(root)
+        if trie is None:
+            trie = self._tries[root] = StatusTrie(DIR_PRIORITY)
+        # untracked entries of the subdirectories loaded on their own
+        # are not part of this status
+        states = list(file_states(status))
+        relpdir = _relpath(root, pdir)
+        below = self._loaded_below(root, pdir)
+        trie.prune(relpdir, below)
+        for f, st in states:
+            trie.set(f, st)
+        rolled = self._rolled.get(root)
+        if rolled:
+            prefix = relpdir and relpdir + os.sep or ''
+            for f in list(rolled):
+                if f.startswith(prefix):
+                    rolled.discard(f)
+        entry = self._store(pdir, root, UNKNOWN, sig, len(states))
+        self._find_submodules(root, pdir, entry, tc)
+        # the status also reset the submodules of the directories below
+        for d in [pdir] + [os.path.join(root, d) for d in below]:
+            entry = self._dirs.peek(d)
+            if entry is not None and entry.submodules:
+                self._roll_up(entry, tc)
+        self._dirty.add(root)
+        self._maybe_save(root, tc)
+        return trie.get(_relpath(root, path), UNKNOWN)
@@ -0,0 +1,205 @@
+"""
+statustrie.py - TortoiseGit aggregated directory status
+
+This software may be used and distributed according to the terms
+of the GNU General Public License, incorporated herein by reference.
+
+"""
+
+import os
+
+class _Node(object):
+    """
+    Directory node.  children maps names to nodes (subdirectories) or
+    to state strings (files); counts maps states to the number of
+    files below the directory in that state.
+    """
+    __slots__ = ('children', 'counts')
+
+    def __init__(self):
+        self.children = {}
+        self.counts = {}
+
+def _split(path):
+    if not path or path == os.curdir:
+        return []
+    return path.split(os.sep)
+
+class StatusTrie(object):
+    """
+    Path trie holding the state of every file of a working directory,
+    with per-directory counts of the states of the files below it.
+
+    Setting or removing a file updates the counts of its parents, so
+    the state of a directory is a lookup proportional to its depth:
+    the first state of priority which has a non-zero count.
+    """
+
+    def __init__(self, priority):
+        self._priority = priority
+        self._top = _Node()
+
+    def __len__(self):
+        return sum(self._top.counts.itervalues())
+
+    def _dir_state(self, node):
+        for st in self._priority:
+            if node.counts.get(st):
+                return st
+        return None
+
+    def _walk(self, parts):
+        """return the list of nodes down to parts, or None"""
+        nodes = [self._top]
+        for name in parts:
+            child = nodes[-1].children.get(name)
+            if not isinstance(child, _Node):
+                return None
+            nodes.append(child)
+        return nodes
+
+    def _count(self, nodes, counts, sign):
+        for node in nodes:
+            ncounts = node.counts
+            for st, n in counts.iteritems():
+                ncounts[st] = ncounts.get(st, 0) + sign * n
+                if not ncounts[st]:
+                    del ncounts[st]
+
+    def _unlink(self, nodes, parts, name):
+        """
+        remove child name of nodes[-1], and the parents left empty;
+        parts are the names of nodes[1:]
+        """
+        child = nodes[-1].children.pop(name, None)
+        if child is None:
+            return
+        if isinstance(child, _Node):
+            counts = child.counts
+        else:
+            counts = {child : 1}
+        self._count(nodes, counts, -1)
+        depth = len(nodes) - 1
+        while depth and not nodes[depth].children:
+            del nodes[depth - 1].children[parts[depth - 1]]
+            depth -= 1
+
+    def get(self, path, default=None):
+        """state of a file, or aggregated state of a directory"""
+        parts = _split(path)
+        if not parts:
+            return self._dir_state(self._top) or default
+        nodes = self._walk(parts[:-1])
+        if nodes is None:
+            return default
+        child = nodes[-1].children.get(parts[-1])
+        if child is None:
+            return default
+        if isinstance(child, _Node):
+            return self._dir_state(child) or default
+        return child
+
+    def covering(self, path):
+        """
+        return the (path, state) of the file at or above path, which
+        is how untracked and ignored directories are stored, or None
+        """
+        parts = _split(path)
+        node = self._top
+        for i, name in enumerate(parts):
+            child = node.children.get(name)
+            if child is None:
+                return None
+            if not isinstance(child, _Node):
+                return os.sep.join(parts[:i + 1]), child
+            node = child
+        return None
+
+    def files(self, path):
+        """yield the (name, state) of the files directly in path"""
+        nodes = self._walk(_split(path))
+        if nodes is None:
+            return
+        for name, child in nodes[-1].children.iteritems():
+            if not isinstance(child, _Node):
+                yield name, child
+
+    def set(self, path, state):
+        """set state of the file at path"""
+        parts = _split(path)
+        nodes = [self._top]
+        for name in parts[:-1]:
+            child = nodes[-1].children.get(name)
+            if not isinstance(child, _Node):
+                if child is not None:
+                    # a file became a directory
+                    self._count(nodes, {child : 1}, -1)
+                child = nodes[-1].children[name] = _Node()
+            nodes.append(child)
+        name = parts[-1]
+        old = nodes[-1].children.get(name)
+        if isinstance(old, _Node):
+            # a directory became a file
+            self._count(nodes, old.counts, -1)
+        elif old is not None:
+            self._count(nodes, {old : 1}, -1)
+        nodes[-1].children[name] = state
+        self._count(nodes, {state : 1}, 1)
+
+    def remove(self, path):
+        """remove the file, or the whole directory, at path"""
+        parts = _split(path)
+        if not parts:
+            self._top = _Node()
+            return
+        nodes = self._walk(parts[:-1])
+        if nodes is not None:
+            self._unlink(nodes, parts[:-1], parts[-1])
+
+    def load(self, path, states):
+        """replace everything below path by the (path, state) pairs"""
+        self.remove(path)
+        for fpath, st in states:
+            self.set(fpath, st)
+
+    def prune(self, path, keep=()):
+        """
+        remove everything below the directory at path, except the
+        directories in keep (paths below path)
+        """
+        if not keep:
+            self.remove(path)
+            return
+        parts = _split(path)
+        nodes = self._walk(parts)
+        if nodes is None:
+            return
+        keep = [_split(k)[len(parts):] for k in keep]
+        self._prune(nodes, parts, keep)
+
+    def _prune(self, nodes, parts, keep):
+        node = nodes[-1]
+        for name in node.children.keys():
+            sub = [k[1:] for k in keep if k and k[0] == name]
+            if [] in sub:
+                continue
+            child = node.children.get(name)
+            if sub and isinstance(child, _Node):
+                self._prune(nodes + [child], parts + [name], sub)
+            elif child is not None:
+                self._unlink(nodes, parts, name)
+
+    def items(self, path=''):
+        """yield the (path, state) pairs of the files below path"""
+        nodes = self._walk(_split(path))
+        if nodes is None:
+            return
+        stack = [(path, nodes[-1])]
+        while stack:
+            dpath, node = stack.pop()
+            for name, child in node.children.iteritems():
+                cpath = dpath and os.path.join(dpath, name) or name
+                if isinstance(child, _Node):
+                    stack.append((cpath, child))
+                else:
+                    yield cpath, child
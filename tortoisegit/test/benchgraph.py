@@ -0,0 +1,382 @@
+#
+# revision graph layout benchmark
+#
+# Generates synthetic revision DAGs with many concurrent branches and
+# times gitgtk/vis/revgraph.py revision_grapher() on them, against the
+# list based grapher it replaced (reference_grapher below, run on the
+# first rows only as it is quadratic in the number of open branches).
+# The rows of both are compared on the part they both lay out, but
+# for their colors: the reference colored the first parent line of
+# every head up front, the grapher does it row by row, and gives
+# another color where a lane was colored before the line of a head
+# reached it.  The edges drawn in one color by one and in two by the
+# other are counted.  The time to the first row is reported for both.
+#
+# With --cache, the saved layout of graphcache.CachedGrapher is timed
+# instead: laying out and saving the whole history, reopening it, and
+# reopening it after commits were added on top, each up to the first
+# batch of rows the history window shows and to the last row.
+#
+# Each result is printed as one JSON object per line, with times in
+# seconds:
+#
+#   python benchgraph.py --commits=1000000 --widths=10,500 \
+#           --output=results.json
+#
+
+import os, sys, time, random, imp, shutil, tempfile
+import json
+
+COMMIT_COUNTS = (10000, 100000, 1000000)
+WIDTHS = (10, 100, 500)
+
+# rows laid out by the reference grapher
+REFERENCE_ROWS = 20000
+
+# rows the history window shows first, and commits added on reopen
+BATCH_ROWS = 500
+ADDED_COMMITS = 20
+
+# chances of a commit starting a branch, and of merging two
+FORK_RATIO = 0.05
+MERGE_RATIO = 0.05
+
+SEED = 0
+
+def _mercurial_stubs():
+    """
+    modules standing in for mercurial, enough for revgraph.py to be
+    imported where mercurial isn't installed: the layout only needs
+    nullrev, the rest is for the log filters
+    """
+    mercurial = imp.new_module('mercurial')
+    stubs = {'mercurial' : mercurial}
+    for name in ('node', 'cmdutil', 'util', 'ui'):
+        stubs['mercurial.' + name] = imp.new_module('mercurial.' + name)
+        setattr(mercurial, name, stubs['mercurial.' + name])
+    mercurial.node.nullrev = -1
+    return stubs
+
+def _load_vis(name):
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+    try:
+        import mercurial
+        stubs = {}
+    except ImportError:
+        stubs = _mercurial_stubs()
+    # the stubs are only seen while the module is imported
+    saved = dict([(n, sys.modules.get(n)) for n in stubs])
+    sys.modules.update(stubs)
+    try:
+        return imp.load_source(name,
+                os.path.join(root, 'gitgtk', 'vis', name + '.py'))
+    finally:
+        for n, module in saved.iteritems():
+            if module is None:
+                del sys.modules[n]
+            else:
+                sys.modules[n] = module
+
+def load_revgraph():
+    """import revgraph.py without the gitgtk package (and GTK)"""
+    return _load_vis('revgraph')
+
+def load_graphcache():
+    """import graphcache.py without the gitgtk package (and GTK)"""
+    load_revgraph()
+    return _load_vis('graphcache')
+
+def make_dag(ncommits, width, seed=SEED):
+    """
+    parents (p1, p2) of each rev of a synthetic history, -1 for none;
+    about width branches are open at any time
+    """
+    rnd = random.Random(seed)
+    parents = []
+    tips = []
+    for rev in xrange(ncommits):
+        if not tips:
+            parents.append((-1, -1))
+            tips.append(rev)
+            continue
+        i = rnd.randrange(len(tips))
+        r = rnd.random()
+        if r < MERGE_RATIO and len(tips) > 1:
+            j = rnd.randrange(len(tips) - 1)
+            if j >= i:
+                j += 1
+            parents.append((tips[i], tips[j]))
+            tips[i] = rev
+            tips[j] = tips[-1]
+            tips.pop()
+        elif r < MERGE_RATIO + FORK_RATIO * width / (len(tips) + 1):
+            parents.append((tips[i], -1))
+            tips.append(rev)
+        else:
+            parents.append((tips[i], -1))
+            tips[i] = rev
+    return parents
+
+class Changelog(object):
+    def __init__(self, parents):
+        self.parents = parents
+
+    def count(self):
+        return len(self.parents)
+
+    def parentrevs(self, rev):
+        return self.parents[rev]
+
+    def node(self, rev):
+        return 'n%d' % rev
+
+    def rev(self, node):
+        return int(node[1:])
+
+class Repo(object):
+    """what revision_grapher and CachedGrapher read of a repository"""
+    def __init__(self, parents, path=None):
+        self.changelog = Changelog(parents)
+        self.root = self.path = path
+
+    def heads(self):
+        children = set()
+        for p in self.changelog.parents:
+            children.update(p)
+        return [self.changelog.node(r) for r in xrange(self.changelog.count())
+                if r not in children]
+
+    def join(self, f):
+        return os.path.join(self.path, f)
+
+def _get_parents(repo, rev):
+    return [x for x in repo.changelog.parentrevs(rev) if x != -1]
+
+def reference_grapher(repo, start_rev, stop_rev, heads=None):
+    """
+    revision_grapher as it was, with lanes in a plain list; the head
+    whose first parent line colored each rev is recorded in heads
+    """
+    curr_rev = start_rev
+    revs = []
+    rev_color = {}
+    nextcolor = 0
+    while curr_rev >= stop_rev:
+        if curr_rev not in revs:
+            revs.append(curr_rev)
+            rev_color[curr_rev] = curcolor = nextcolor ; nextcolor += 1
+            r = _get_parents(repo, curr_rev)
+            while r:
+                r0 = r[0]
+                if r0 < stop_rev: break
+                if r0 in rev_color: break
+                rev_color[r0] = curcolor
+                if heads is not None:
+                    heads[r0] = curr_rev
+                r = _get_parents(repo, r0)
+        curcolor = rev_color[curr_rev]
+        rev_index = revs.index(curr_rev)
+        next_revs = revs[:]
+        parents = _get_parents(repo, curr_rev)
+        parents_to_add = []
+        preferred_color = curcolor
+        for parent in parents:
+            if parent not in next_revs:
+                parents_to_add.append(parent)
+                if parent not in rev_color:
+                    if preferred_color:
+                        rev_color[parent] = preferred_color; preferred_color = None
+                    else:
+                        rev_color[parent] = nextcolor ; nextcolor += 1
+        next_revs[rev_index:rev_index + 1] = parents_to_add
+        lines = []
+        for i, rev in enumerate(revs):
+            if rev in next_revs:
+                color = rev_color[rev]
+                lines.append( (i, next_revs.index(rev), color) )
+            elif rev == curr_rev:
+                for parent in parents:
+                    color = rev_color[parent]
+                    lines.append( (i, next_revs.index(parent), color) )
+        yield (curr_rev, (rev_index, curcolor), lines, parents)
+        revs = next_revs
+        curr_rev -= 1
+
+def time_rows(grapher, nrows=None):
+    """
+    lay out nrows rows (all if None), return (rows, seconds, seconds to
+    the first row, max width)
+    """
+    rows = 0
+    width = 0
+    first = None
+    start = time.time()
+    for rev, node, lines, parents in grapher:
+        if first is None:
+            first = time.time() - start
+        width = max(width, len(lines))
+        rows += 1
+        if rows == nrows:
+            break
+    return rows, time.time() - start, first, width
+
+def shape(row):
+    """a row without its colors"""
+    rev, (col, color), lines, parents = row
+    return rev, col, [(c, nc) for c, nc, color in lines], parents
+
+def compare(repo, start_rev, stop_rev, nrows, grapher):
+    """check that grapher lays out the first nrows rows as before"""
+    new = grapher(repo, start_rev, stop_rev)
+    old = reference_grapher(repo, start_rev, stop_rev)
+    for i in xrange(nrows):
+        try:
+            row = new.next()
+        except StopIteration:
+            return True
+        if shape(row) != shape(old.next()):
+            return False
+    return True
+
+def _colors(grapher, repo, start_rev, stop_rev, nrows):
+    colors = {}
+    for rev, (col, color), lines, parents in grapher(repo, start_rev,
+            stop_rev):
+        colors[rev] = color
+        if len(colors) == nrows:
+            break
+    return colors
+
+def color_changes(repo, start_rev, stop_rev, nrows, grapher):
+    """
+    count the edges between the first nrows rows, and those drawn in
+    one color by grapher and in two by the reference, or the reverse
+    """
+    new = _colors(grapher, repo, start_rev, stop_rev, nrows)
+    old = _colors(reference_grapher, repo, start_rev, stop_rev, nrows)
+    edges = changes = 0
+    for rev in new:
+        for p in repo.changelog.parentrevs(rev):
+            if p not in new:
+                continue
+            edges += 1
+            if (new[rev] == new[p]) != (old[rev] == old[p]):
+                changes += 1
+    return edges, changes
+
+def report(out, ncommits, width, rows, seconds, first, maxwidth, ref_rows,
+        ref_seconds, ref_first, same, color_edges):
+    result = {
+        'commits' : ncommits, 'width' : width, 'max_width' : maxwidth,
+        'rows' : rows, 'seconds' : round(seconds, 3),
+        'first_row' : round(first, 6),
+        'reference_rows' : ref_rows,
+        'reference_seconds' : round(ref_seconds, 3),
+        'reference_first_row' : round(ref_first, 6),
+        'speedup' : round((ref_seconds / ref_rows) /
+                          max(seconds / rows, 1e-9), 1),
+        'same_rows' : same,
+        'color_changes' : color_edges[1], 'compared_edges' : color_edges[0],
+        'python' : sys.version.split()[0], 'platform' : sys.platform,
+    }
+    out.write(json.dumps(result, sort_keys=True) + '\n')
+    out.flush()
+    sys.stderr.write('%8d commits width %4d (max %4d): %8.2fs, %6.1fx faster'
+            ' per row than reference, first row %.4fs (was %.4fs)%s\n' %
+            (ncommits, width, maxwidth, seconds, result['speedup'], first,
+            ref_first, not same and ' (ROWS DIFFER)' or ''))
+    return result
+
+def bench(out, counts=COMMIT_COUNTS, widths=WIDTHS,
+        reference_rows=REFERENCE_ROWS):
+    """lay out every synthetic history, return the results"""
+    revgraph = load_revgraph()
+    results = []
+    for width in widths:
+        for ncommits in counts:
+            repo = Repo(make_dag(ncommits, width))
+            start_rev = ncommits - 1
+            rows, seconds, first, maxwidth = time_rows(
+                    revgraph.revision_grapher(repo, start_rev, 0))
+            ref_rows, ref_seconds, ref_first, ref_width = time_rows(
+                    reference_grapher(repo, start_rev, 0), reference_rows)
+            same = compare(repo, start_rev, 0, reference_rows,
+                    revgraph.revision_grapher)
+            edges = color_changes(repo, start_rev, 0, reference_rows,
+                    revgraph.revision_grapher)
+            results.append(report(out, ncommits, width, rows, seconds,
+                    first, maxwidth, ref_rows, ref_seconds, ref_first, same,
+                    edges))
+    return results
+
+def report_cache(out, ncommits, width, scenario, first, seconds, size):
+    result = {
+        'commits' : ncommits, 'width' : width, 'scenario' : scenario,
+        'first_batch' : round(first, 4), 'seconds' : round(seconds, 3),
+        'cache_size' : size,
+        'python' : sys.version.split()[0], 'platform' : sys.platform,
+    }
+    out.write(json.dumps(result, sort_keys=True) + '\n')
+    out.flush()
+    sys.stderr.write('%8d commits width %4d %-8s first %d rows %8.4fs,'
+            ' all %8.2fs\n' % (ncommits, width, scenario, BATCH_ROWS, first,
+            seconds))
+    return result
+
+def bench_cache(out, counts=COMMIT_COUNTS, widths=WIDTHS, workdir=None,
+        **options):
+    """time the saved layout of every synthetic history"""
+    graphcache = load_graphcache()
+    results = []
+    for width in widths:
+        for ncommits in counts:
+            path = tempfile.mkdtemp(prefix='tgitgraph', dir=workdir)
+            try:
+                parents = make_dag(ncommits, width)
+                tip = len(parents) - 1
+                added = [(tip + i, -1) for i in xrange(ADDED_COMMITS)]
+                for scenario, dag in (('layout', parents),
+                                      ('reopen', parents),
+                                      ('added', parents + added)):
+                    start = time.time()
+                    grapher = graphcache.CachedGrapher(Repo(dag, path))
+                    time_rows(grapher, BATCH_ROWS)
+                    first = time.time() - start
+                    time_rows(grapher)
+                    seconds = time.time() - start
+                    size = os.path.getsize(graphcache.graph_cache_path(
+                            grapher.repo))
+                    results.append(report_cache(out, ncommits, width,
+                            scenario, first, seconds, size))
+            finally:
+                shutil.rmtree(path)
+    return results
+
+def get_option(args):
+    import getopt
+    long_opt_list = ('commits=', 'widths=', 'reference-rows=', 'output=',
+            'workdir=', 'cache')
+    opts, args = getopt.getopt(args, "", long_opt_list)
+    options = {}
+    for o, a in opts:
+        if o == '--commits':
+            options['counts'] = [int(n) for n in a.split(',')]
+        elif o == '--widths':
+            options['widths'] = [int(n) for n in a.split(',')]
+        elif o == '--reference-rows':
+            options['reference_rows'] = int(a)
+        elif o == '--cache':
+            options['cache'] = True
+        else:
+            options[o[2:]] = a
+    return options
+
+if __name__=='__main__':
+    options = get_option(sys.argv[1:])
+    output = options.pop('output', None)
+    out = output and open(output, 'a') or sys.stdout
+    if options.pop('cache', False):
+        bench_cache(out, **options)
+    else:
+        bench(out, **options)
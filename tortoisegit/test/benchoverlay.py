@@ -0,0 +1,271 @@
+#
+# overlay handler latency benchmark
+#
+# Generates synthetic git repositories and times
+# IconOverlayExtension._get_state() on them, cold (new cache), warm
+# (cached directories) and after edits (changed directories), with
+# the win32stub modules standing in for pywin32 when needed.
+#
+# Each result is printed as one JSON object per line, with the p50,
+# p95 and p99 latencies in milliseconds:
+#
+#   python benchoverlay.py --files=1000,50000 --layouts=wide \
+#           --output=results.json
+#
+
+import os, sys, math, time, random, shutil, tempfile, subprocess
+import json
+
+from testiconoverlay import IconOverlayExtension, lsprof, profile
+import win32api
+import iconoverlay
+import statuscache
+import overlaysched
+import cachesrv
+
+FILE_COUNTS = (1000, 50000, 250000)
+LAYOUTS = ('deep', 'wide')
+
+# files per directory of the wide and deep layouts
+WIDE_FILES = 1000
+DEEP_FILES = 8
+
+# share of files modified, and of untracked files, in the repositories
+DIRTY_RATIO = 0.01
+
+SAMPLES = 200
+COLD_SAMPLES = 10
+WARM_DIRS = 10
+SEED = 0
+
+def _wide_dirs(nfiles):
+    for i in xrange((nfiles + WIDE_FILES - 1) // WIDE_FILES):
+        yield 'd%03d' % i
+
+def _deep_dirs(nfiles):
+    # binary tree of directories, breadth first
+    names = {0 : ''}
+    for i in xrange((nfiles + DEEP_FILES - 1) // DEEP_FILES):
+        if i:
+            parent = names[(i - 1) // 2]
+            name = 'ab'[(i - 1) % 2]
+            names[i] = parent and os.path.join(parent, name) or name
+        yield names[i]
+
+def layout_files(nfiles, layout):
+    """relative paths of the files of a synthetic repository"""
+    if layout == 'wide':
+        dirs, perdir = _wide_dirs(nfiles), WIDE_FILES
+    else:
+        dirs, perdir = _deep_dirs(nfiles), DEEP_FILES
+    files = []
+    for d in dirs:
+        for i in xrange(min(perdir, nfiles - len(files))):
+            files.append(os.path.join(d, 'f%d.c' % i))
+    return files
+
+def _git(root, *args):
+    subprocess.check_call(('git', '-c', 'user.name=bench',
+            '-c', 'user.email=bench@localhost') + args, cwd=root)
+
+def _write(path, data):
+    fd = open(path, 'w')
+    fd.write(data)
+    fd.close()
+
+def make_repo(root, nfiles, layout):
+    """
+    Create (or reset) a committed repository at root, with a few
+    modified and untracked files; return its tracked files.
+    """
+    files = layout_files(nfiles, layout)
+    if os.path.isdir(os.path.join(root, '.git')):
+        _git(root, 'reset', '-q', '--hard')
+        _git(root, 'clean', '-fdq')
+    else:
+        for f in files:
+            path = os.path.join(root, f)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            _write(path, f)
+        _git(root, 'init', '-q')
+        _git(root, 'add', '-A')
+        _git(root, 'commit', '-q', '-m', 'synthetic %s %d' % (layout, nfiles))
+    rnd = random.Random(SEED)
+    for f in rnd.sample(files, int(nfiles * DIRTY_RATIO)):
+        _write(os.path.join(root, f), 'modified')
+    for f in rnd.sample(files, int(nfiles * DIRTY_RATIO)):
+        _write(os.path.join(root, f + '.new'), 'untracked')
+    return files
+
+def percentile(values, p):
+    """nearest-rank percentile of values"""
+    values = sorted(values)
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(k, 0)]
+
+class _Null(object):
+    def write(self, data):
+        pass
+
+class Bench(object):
+    """run the scenarios against the overlay handler module"""
+
+    def __init__(self, server=False, budget=None, snapshots=False):
+        self.server = server
+        self.budget = budget
+        self.snapshots = snapshots
+        self.ovh = IconOverlayExtension()
+        self.rundir = tempfile.mkdtemp(prefix='tgitbench_')
+        if not server:
+            # nothing listens in a new run directory
+            iconoverlay.cache_client = cachesrv.StatusClient(self.rundir)
+            iconoverlay.start_cache_server = lambda: None
+
+    def close(self):
+        shutil.rmtree(self.rundir, True)
+
+    def reset(self):
+        """start over with the caches of a new shell process"""
+        iconoverlay.overlay_cache = statuscache.StatusCache(
+                tick_count=win32api.GetTickCount, snapshots=self.snapshots)
+        if self.server:
+            iconoverlay.cache_client.request('invalidate')
+        iconoverlay.overlay_sched = overlaysched.StatusScheduler(
+                iconoverlay.compute_state,
+                overlaysched.NotifyCoalescer(overlaysched.ShellNotifier()),
+                budget=self.budget or overlaysched.TIME_BUDGET,
+                tick_count=win32api.GetTickCount)
+
+    def _advance(self, ticks):
+        clock = win32api.GetTickCount
+        if self.server or not hasattr(clock, 'advance'):
+            # not the win32stub clock
+            time.sleep(ticks / 1000.0)
+        else:
+            clock.advance(ticks)
+
+    def _time(self, path, times):
+        tc = time.time()
+        state = self.ovh._get_state(path)
+        times.append((time.time() - tc) * 1000.0)
+        # let a late status complete, so it isn't timed with the next one
+        iconoverlay.compute_state(path)
+        return state == overlaysched.PENDING
+
+    def run(self, root, files, samples=SAMPLES, cold=COLD_SAMPLES):
+        rnd = random.Random(SEED)
+        paths = [os.path.join(root, f) for f in files]
+        results = {}
+
+        times, pending = [], 0
+        for path in rnd.sample(paths, min(cold, len(paths))):
+            self.reset()
+            pending += self._time(path, times)
+        results['cold'] = (times, pending)
+
+        self.reset()
+        dirs = {}
+        for path in paths:
+            dirs.setdefault(os.path.dirname(path), []).append(path)
+        warm = rnd.sample(sorted(dirs), min(WARM_DIRS, len(dirs)))
+        for d in warm:
+            iconoverlay.compute_state(dirs[d][0])
+        times, pending = [], 0
+        for i in xrange(samples):
+            pending += self._time(rnd.choice(dirs[rnd.choice(warm)]), times)
+        results['warm'] = (times, pending)
+
+        times, pending = [], 0
+        for i in xrange(samples):
+            path = rnd.choice(dirs[rnd.choice(warm)])
+            _write(path, 'edited %d' % i)
+            self._advance(statuscache.CHECK_INTERVAL)
+            pending += self._time(path, times)
+        results['after-edit'] = (times, pending)
+        return results
+
+def _git_version():
+    try:
+        p = subprocess.Popen(['git', '--version'], stdout=subprocess.PIPE)
+        return p.communicate()[0].strip()
+    except OSError:
+        return None
+
+def report(out, nfiles, layout, scenario, times, pending):
+    result = {
+        'files' : nfiles, 'layout' : layout, 'scenario' : scenario,
+        'samples' : len(times), 'pending' : pending,
+        'p50' : round(percentile(times, 50), 3),
+        'p95' : round(percentile(times, 95), 3),
+        'p99' : round(percentile(times, 99), 3),
+        'max' : round(max(times), 3),
+        'python' : sys.version.split()[0], 'platform' : sys.platform,
+        'git' : _git_version(),
+    }
+    out.write(json.dumps(result, sort_keys=True) + '\n')
+    out.flush()
+    sys.stderr.write('%-5s %7d %-10s p50 %8.2f  p95 %8.2f  p99 %8.2f ms'
+            '  (%d pending)\n' % (layout, nfiles, scenario, result['p50'],
+            result['p95'], result['p99'], pending))
+    return result
+
+def bench(out, counts=FILE_COUNTS, layouts=LAYOUTS, workdir=None,
+        samples=SAMPLES, cold=COLD_SAMPLES, **options):
+    """run all scenarios on every repository, return the results"""
+    workdir = workdir or os.path.join(tempfile.gettempdir(), 'tgitbench')
+    b = Bench(**options)
+    results = []
+    try:
+        for layout in layouts:
+            for nfiles in counts:
+                root = os.path.join(workdir, '%s-%d' % (layout, nfiles))
+                if not os.path.isdir(root):
+                    os.makedirs(root)
+                files = make_repo(root, nfiles, layout)
+                stdout = sys.stdout
+                sys.stdout = _Null()    # the handlers trace every call
+                try:
+                    timed = b.run(root, files, samples, cold)
+                finally:
+                    sys.stdout = stdout
+                for scenario in ('cold', 'warm', 'after-edit'):
+                    times, pending = timed[scenario]
+                    results.append(report(out, nfiles, layout, scenario,
+                            times, pending))
+    finally:
+        b.close()
+    return results
+
+def get_option(args):
+    import getopt
+    long_opt_list = ('files=', 'layouts=', 'samples=', 'cold=', 'budget=',
+            'workdir=', 'output=', 'server', 'snapshots', 'lsprof', 'profile')
+    opts, args = getopt.getopt(args, "", long_opt_list)
+    options = {}
+    for o, a in opts:
+        if o == '--files':
+            options['counts'] = [int(n) for n in a.split(',')]
+        elif o == '--layouts':
+            options['layouts'] = a.split(',')
+        elif o in ('--samples', '--cold', '--budget'):
+            options[o[2:]] = int(a)
+        elif o in ('--workdir', '--output'):
+            options[o[2:]] = a
+        else:
+            options[o[2:]] = True
+    return options
+
+if __name__=='__main__':
+    options = get_option(sys.argv[1:])
+    output = options.pop('output', None)
+    out = output and open(output, 'a') or sys.stdout
+    use_lsprof = options.pop('lsprof', False)
+    use_profile = options.pop('profile', False)
+    run = lambda: bench(out, **options)
+    if use_lsprof:
+        lsprof(run)
+    elif use_profile:
+        profile(run)
+    else:
+        run()
@@ -0,0 +1,197 @@
+import os
+import marshal
+import shutil
+import tempfile
+import unittest
+from tortoisegit.test import benchgraph
+
+class TestDag(unittest.TestCase):
+    def test_make_dag(self):
+        parents = benchgraph.make_dag(2000, 20)
+        self.assertEqual(2000, len(parents))
+        self.assertEqual((-1, -1), parents[0])
+        for rev, (p1, p2) in enumerate(parents[1:]):
+            self.failUnless(-1 < p1 <= rev and p2 <= rev)
+        self.failUnless([p for p in parents if p[1] != -1])
+
+class TestRevisionGrapher(unittest.TestCase):
+    def setUp(self):
+        self.revgraph = benchgraph.load_revgraph()
+
+    def test_same_rows(self):
+        for width in (1, 5, 50):
+            repo = benchgraph.Repo(benchgraph.make_dag(1500, width, seed=width))
+            for start, stop in ((1499, 0), (1200, 300)):
+                self.failUnless(benchgraph.compare(repo, start, stop, 2000,
+                        self.revgraph.revision_grapher))
+
+    def _colors(self, parents):
+        repo = benchgraph.Repo(parents)
+        return dict([(rev, color) for rev, (col, color), lines, p in
+                self.revgraph.revision_grapher(repo, len(parents) - 1, 0)])
+
+    def test_first_parent_colors(self):
+        # 0 - 1 - 2 - 4 - 5
+        #  \         /
+        #   ---- 3 --
+        parents = [(-1, -1), (0, -1), (1, -1), (0, -1), (2, 3), (4, -1)]
+        colors = self._colors(parents)
+        self.assertEqual(1, len(set([colors[r] for r in (0, 1, 2, 4, 5)])))
+        self.assertNotEqual(colors[3], colors[0])
+
+    def test_head_colors(self):
+        #       2 - 4   the line of the first head met keeps its color
+        #      /
+        # 0 - 1 - 3
+        parents = [(-1, -1), (0, -1), (1, -1), (1, -1), (2, -1)]
+        colors = self._colors(parents)
+        self.assertEqual(colors[4], colors[2])
+        self.assertEqual(colors[4], colors[1])
+        self.assertEqual(colors[4], colors[0])
+        self.assertNotEqual(colors[4], colors[3])
+
+    def test_walk_difference(self):
+        # the one case the colors differ from the walk's, accepted as
+        # knowing it would take the walk the rows avoid: head 6 merges
+        # 5, which merges 4 into 1, on the first parent line of 6.  The
+        # walk had colored 1 when 5 was laid out, and left 5's color
+        # to 4; here the line of 6 only takes 1 over after 5 gave it its
+        # color, and 4 gets a new one.
+        parents = [(-1, -1), (0, -1), (1, -1), (0, -1), (3, -1), (1, 4),
+                   (2, 5)]
+        colors = self._colors(parents)
+        repo = benchgraph.Repo(parents)
+        ref = dict([(rev, color) for rev, (col, color), lines, p in
+                benchgraph.reference_grapher(repo, 6, 0)])
+        for c in (colors, ref):
+            self.assertEqual(1, len(set([c[r] for r in (0, 1, 2, 6)])))
+            self.assertEqual(c[3], c[4])
+            self.assertNotEqual(c[5], c[6])
+        self.assertEqual(ref[4], ref[5])
+        self.assertNotEqual(colors[4], colors[5])
+        self.assertEqual((8, 1), benchgraph.color_changes(repo, 6, 0, 7,
+                self.revgraph.revision_grapher))
+
+    def test_reference_colors(self):
+        for width in (1, 5, 50):
+            repo = benchgraph.Repo(benchgraph.make_dag(1500, width, seed=width))
+            heads = {}
+            list(benchgraph.reference_grapher(repo, 1499, 0, heads))
+            colors = self._colors(repo.changelog.parents)
+            # the first parent lines the reference colored up front
+            for rev, head in heads.iteritems():
+                self.assertEqual(colors[head], colors[rev])
+            # and a lane colored before such a line reached it may have
+            # left another parent a new color
+            edges, changes = benchgraph.color_changes(repo, 1499, 0, 1500,
+                    self.revgraph.revision_grapher)
+            self.failUnless(edges > 1500 and changes * 100 < edges)
+
+class TestGraphCache(unittest.TestCase):
+    def setUp(self):
+        self.revgraph = benchgraph.load_revgraph()
+        self.graphcache = benchgraph.load_graphcache()
+        self.graphcache.BLOCK_ROWS = 64
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_graph_")
+        self.parents = benchgraph.make_dag(1000, 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _repo(self):
+        return benchgraph.Repo(self.parents, self.tmpdir)
+
+    def _expected(self):
+        repo = self._repo()
+        return list(self.revgraph.revision_grapher(repo,
+                repo.changelog.count() - 1, 0))
+
+    def _grapher(self):
+        return self.graphcache.CachedGrapher(self._repo())
+
+    def test_reopen(self):
+        self.assertEqual(self._expected(), list(self._grapher()))
+        grapher = self._grapher()
+        self.assertFalse(grapher.dirty)
+        self.assertEqual(None, grapher.state)
+        self.assertEqual(self._expected(), list(grapher))
+
+    def _write_cache(self, data):
+        fd = open(self.graphcache.graph_cache_path(self._repo()), 'wb')
+        fd.write(data)
+        fd.close()
+
+    def test_tampered(self):
+        list(self._grapher())
+        path = self.graphcache.graph_cache_path(self._repo())
+        data = open(path, 'rb').read()
+        magic = self.graphcache.GRAPH_CACHE_MAGIC
+        version, heads, tip, segments, state = marshal.loads(
+                data[len(magic):])
+        # a pickle running code when loaded, as the cache once was
+        marker = os.path.join(self.tmpdir, 'pwned')
+        payload = "cos\nsystem\n(S'touch %s'\ntR." % marker
+        for bad in (payload, magic + payload,
+                magic + marshal.dumps((version, heads, str(tip),
+                        segments, state)),
+                magic + marshal.dumps((version, heads, tip,
+                        [(0, 0, [(-1, 'x')])], state)),
+                magic + marshal.dumps((version, heads, tip, segments,
+                        (0, [], [], 0, [], [], 0)))):
+            self._write_cache(bad)
+            self.assertEqual(None,
+                    self.graphcache.read_graph_cache(self._repo()))
+            grapher = self._grapher()
+            self.assertTrue(grapher.dirty)
+            self.assertEqual(self._expected(), list(grapher))
+            self.assertFalse(os.path.exists(marker))
+
+    def test_partial(self):
+        grapher = self._grapher()
+        for i in range(300):
+            grapher.next()
+        grapher.save()
+        grapher = self._grapher()
+        self.assertEqual(699, grapher.state.rev)
+        self.assertEqual(self._expected(), list(grapher))
+        self.assertEqual(None, self._grapher().state)
+
+    def _add(self, parents):
+        list(self._grapher())
+        self.parents = self.parents + parents
+        grapher = self._grapher()
+        self.assertEqual(self._expected(), list(grapher))
+        self.assertEqual(self._expected(), list(self._grapher()))
+        return grapher
+
+    def test_linear(self):
+        self.assertTrue(self._add([(999, -1), (1000, -1)]).spliced)
+
+    def test_merge(self):
+        # merging the tip with another head, whose lane crosses the tip
+        heads = [self._repo().changelog.rev(n) for n in self._repo().heads()]
+        self.assertFalse(self._add([(999, heads[0])]).spliced)
+
+    def test_new_root(self):
+        # the saved tip becomes a head of its own, past the first one,
+        # whose merges are colored differently
+        self.assertFalse(self._add([(-1, -1), (1000, -1)]).spliced)
+
+    def test_crossing(self):
+        # a new head forking from an old revision
+        self.assertFalse(self._add([(500, -1)]).spliced)
+
+    def test_spliced_twice(self):
+        self.assertTrue(self._add([(999, -1)]).spliced)
+        self.assertTrue(self._add([(1000, -1), (1001, -1)]).spliced)
+        self._add([(1002, 1000)])
+
+    def test_stripped(self):
+        list(self._grapher())
+        self.parents = self.parents[:900] + [(899, -1)]
+        grapher = self._grapher()
+        self.assertFalse(grapher.spliced)
+        self.assertEqual(self._expected(), list(grapher))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from tortoisegit import tgitutil
+from tortoisegit.test import benchoverlay
+
+class _Out(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data):
+        self.lines.append(data)
+
+    def flush(self):
+        pass
+
+class TestBenchOverlay(unittest.TestCase):
+    def test_layouts(self):
+        wide = benchoverlay.layout_files(2500, 'wide')
+        self.assertEqual(2500, len(wide))
+        self.assertEqual(3, len(set([os.path.dirname(f) for f in wide])))
+        deep = benchoverlay.layout_files(2500, 'deep')
+        self.assertEqual(2500, len(deep))
+        depth = max([f.count(os.sep) for f in deep])
+        self.assertEqual(8, depth)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(50, benchoverlay.percentile(values, 50))
+        self.assertEqual(99, benchoverlay.percentile(values, 99))
+        self.assertEqual(7, benchoverlay.percentile([7], 95))
+
+class TestBenchRun(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="tgit_bench_")
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_run(self):
+        out = _Out()
+        results = benchoverlay.bench(out, counts=[40], layouts=['wide'],
+                workdir=self.workdir, samples=5, cold=2, budget=5000)
+        self.assertEqual(['cold', 'warm', 'after-edit'],
+                [r['scenario'] for r in results])
+        self.assertEqual(3, len(out.lines))
+        for r in results:
+            self.assertEqual(0, r['pending'])
+            self.failUnless(r['p50'] <= r['p95'] <= r['p99'])
+
+if tgitutil.find_path('git') is None:
+    del TestBenchRun
+
+if __name__ == '__main__':
+    unittest.main()
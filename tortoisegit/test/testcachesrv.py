@@ -0,0 +1,137 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from tortoisegit import cachesrv, statuscache
+
+class TestStatusServer(unittest.TestCase):
+    """
+    Test the status cache server and its client over a real socket.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_cachesrv_")
+        self.root = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.root, ".git"))
+        os.makedirs(os.path.join(self.root, "src"))
+        self.calls = []
+        self.release = None
+        cache = statuscache.StatusCache(status_func=self._status)
+        self.server = cachesrv.StatusServer(cache=cache, rundir=self.tmpdir)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = cachesrv.StatusClient(rundir=self.tmpdir)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _status(self, root, pdir):
+        self.calls.append(pdir)
+        if self.release is not None:
+            self.release.wait(5)
+        return (["src/b.c"], ["src/c.c"], [], [], ["src/d.c"], [], ["src/a.c"])
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def test_ping(self):
+        self.assertTrue(self.client.ping())
+
+    def test_status(self):
+        self.assertEqual(statuscache.UNCHANGED,
+                self.client.status(self._path("src", "a.c")))
+        self.assertEqual(statuscache.MODIFIED,
+                self.client.status(self._path("src", "b.c")))
+        self.assertEqual(statuscache.ADDED,
+                self.client.status(self._path("src", "c.c")))
+        self.assertEqual(statuscache.UNKNOWN,
+                self.client.status(self._path("src", "d.c")))
+        self.assertEqual(1, len(self.calls))
+
+    def test_dir_status(self):
+        for f in ("a.c", "b.c"):
+            open(self._path("src", f), "w").close()
+        self.assertEqual({"a.c" : statuscache.UNCHANGED,
+                          "b.c" : statuscache.MODIFIED},
+                         self.client.dir_status(self._path("src")))
+        self.assertEqual(1, len(self.calls))
+
+    def test_not_in_repo(self):
+        self.assertEqual(statuscache.NOT_IN_REPO,
+                self.client.status(os.path.join(self.tmpdir, "elsewhere")))
+        self.assertEqual([], self.calls)
+
+    def test_invalidate(self):
+        self.client.status(self._path("src", "a.c"))
+        self.assertEqual('ok', self.client.request('invalidate'))
+        self.client.status(self._path("src", "a.c"))
+        self.assertEqual(2, len(self.calls))
+
+    def test_busy(self):
+        self.release = threading.Event()
+        client = cachesrv.StatusClient(rundir=self.tmpdir, timeout=0.2)
+        try:
+            self.assertEqual(cachesrv.BUSY,
+                    client.status(self._path("src", "a.c")))
+            self.release.set()
+            # the late answer isn't taken for the next one
+            self.assertEqual(statuscache.MODIFIED,
+                    client.status(self._path("src", "b.c")))
+        finally:
+            client.close()
+
+    def test_unknown_command(self):
+        self.assertTrue(self.client.request('bogus').startswith('error'))
+
+    def test_token(self):
+        self.server.token = "secret"
+        self.client.close()
+        self.assertFalse(self.client.ping())
+        self.client._token = lambda: "guess"
+        self.assertFalse(self.client.ping())
+        self.client._token = lambda: "secret"
+        self.assertTrue(self.client.ping())
+
+    def test_no_server(self):
+        rundir = os.path.join(self.tmpdir, "empty")
+        os.makedirs(rundir)
+        client = cachesrv.StatusClient(rundir=rundir)
+        self.assertFalse(client.ping())
+        self.assertEqual(None, client.status(self._path("src", "a.c")))
+
+class TestRundir(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_rundir_")
+        self.rundir = os.path.join(self.tmpdir, "run")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_created_private(self):
+        cachesrv.make_rundir(self.rundir)
+        self.assertEqual(0700, os.stat(self.rundir).st_mode & 0777)
+        cachesrv.make_rundir(self.rundir)
+
+    def test_writable_by_others(self):
+        os.mkdir(self.rundir)
+        os.chmod(self.rundir, 0777)
+        self.assertRaises(cachesrv.RundirError, cachesrv.StatusServer,
+                cache=statuscache.StatusCache(), rundir=self.rundir)
+        self.assertFalse(cachesrv.StatusClient(rundir=self.rundir).ping())
+
+    def test_symlink(self):
+        os.mkdir(os.path.join(self.tmpdir, "elsewhere"))
+        os.symlink(os.path.join(self.tmpdir, "elsewhere"), self.rundir)
+        self.assertRaises(cachesrv.RundirError, cachesrv.make_rundir,
+                self.rundir)
+
+if os.name == 'nt':
+    del TestRundir
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from tortoisegit import cachesrv, dialoghost
+
+class TestDialogServer(unittest.TestCase):
+    """
+    Test the dialog host protocol over a real socket.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_dialoghost_")
+        self.opened = []
+        self.quit = threading.Event()
+        self.server = dialoghost.DialogServer(self._open, self.quit.set,
+                rundir=self.tmpdir)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = dialoghost.DialogClient(rundir=self.tmpdir)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def _open(self, args):
+        if '--bogus' in args:
+            raise ValueError('option --bogus not recognized')
+        self.opened.append(args)
+
+    def test_open(self):
+        args = ['--command', 'status', '--root', '/r/my repo', '--',
+                '--verbose']
+        self.assertTrue(self.client.open(args))
+        self.assertEqual([args], self.opened)
+
+    def test_error(self):
+        self.assertFalse(self.client.open(['--bogus']))
+        self.assertEqual([], self.opened)
+
+    def test_quit(self):
+        self.assertEqual('ok', self.client.request('quit'))
+        self.assertTrue(self.quit.isSet())
+
+    def test_own_socket(self):
+        # the status cache server of the same session isn't disturbed
+        self.assertFalse(cachesrv.StatusClient(rundir=self.tmpdir).ping())
+
+    def test_list_file(self):
+        listfile = os.path.join(self.tmpdir, "files")
+        open(listfile, "w").close()
+        args = ['--command', 'commit', '--listfile', listfile,
+                '--deletelistfile']
+        client = dialoghost._client
+        dialoghost._client = self.client
+        try:
+            self.assertTrue(dialoghost.open_dialog(args))
+        finally:
+            dialoghost._client = client
+        self.assertEqual([args], self.opened)
+        self.assertFalse(os.path.exists(listfile))
+
+    def test_no_host(self):
+        rundir = os.path.join(self.tmpdir, "empty")
+        os.makedirs(rundir)
+        client = dialoghost.DialogClient(rundir=rundir)
+        self.assertFalse(client.ping())
+        self.assertFalse(client.open(['--command', 'about']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,220 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from tortoisegit import dircache, menumodel, tgitutil
+
+class FakeClock(object):
+    def __init__(self):
+        self.tc = 0
+
+    def __call__(self):
+        return self.tc
+
+class FakeFetch(object):
+    def __init__(self, dirs):
+        self.dirs = dirs
+        self.calls = []
+
+    def __call__(self, pdir):
+        self.calls.append(pdir)
+        return self.dirs.get(pdir)
+
+class TestDirStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.src = os.path.join(os.sep + "r", "src")
+        self.fetch = FakeFetch({self.src : {"a.c" : "unchanged",
+                                            "b.c" : "modified"}})
+        self.clock = FakeClock()
+        self.cache = dircache.DirStatusCache(self.fetch, timeout=100,
+                tick_count=self.clock)
+
+    def _path(self, name):
+        return os.path.join(self.src, name)
+
+    def test_one_fetch_per_dir(self):
+        self.assertEqual("unchanged", self.cache.get_state(self._path("a.c")))
+        self.assertEqual("modified", self.cache.get_state(self._path("b.c")))
+        self.assertEqual(None, self.cache.get_state(self._path("new.c")))
+        self.assertEqual([self.src], self.fetch.calls)
+        self.assertEqual(2, self.cache.hits)
+
+    def test_timeout(self):
+        self.cache.get_state(self._path("a.c"))
+        self.clock.tc = 99
+        self.cache.get_state(self._path("a.c"))
+        self.clock.tc = 100
+        self.cache.get_state(self._path("a.c"))
+        self.assertEqual(2, len(self.fetch.calls))
+
+    def test_invalidate(self):
+        self.cache.get_state(self._path("a.c"))
+        self.cache.invalidate(self.src)
+        self.cache.get_state(self._path("a.c"))
+        self.cache.invalidate()
+        self.cache.get_state(self._path("a.c"))
+        self.assertEqual(3, len(self.fetch.calls))
+
+    def test_invalidate_tree(self):
+        lib = os.path.join(self.src, "lib")
+        self.fetch.dirs[lib] = {"x.c" : "added"}
+        self.cache.load(self.src)
+        self.cache.load(lib)
+        self.cache.invalidate_tree(self.src + "2")
+        self.assertTrue(self.cache.is_loaded(lib))
+        self.cache.invalidate_tree(self.src)
+        self.assertFalse(self.cache.is_loaded(self.src))
+        self.assertFalse(self.cache.is_loaded(lib))
+
+    def test_fetch_failed(self):
+        path = os.path.join(os.sep + "elsewhere", "x")
+        self.assertEqual(None, self.cache.get_state(path))
+        self.assertEqual(None, self.cache.get_state(path))
+        # failures aren't cached
+        self.assertEqual(2, len(self.fetch.calls))
+
+class TestStatusRequests(unittest.TestCase):
+    def setUp(self):
+        self.src = os.path.join(os.sep + "r", "src")
+        self.lib = os.path.join(os.sep + "r", "lib")
+        self.fetch = FakeFetch({self.src : {"a.c" : "unchanged",
+                                            "b.c" : "modified"},
+                                self.lib : {"x.c" : "added"}})
+        self.clock = FakeClock()
+        self.cache = dircache.DirStatusCache(self.fetch, timeout=100000,
+                tick_count=self.clock)
+        self.done = []
+        self.requests = dircache.StatusRequests(self.cache,
+                lambda h, s: self.done.append((h, s)), tick_count=self.clock)
+
+    def test_answered(self):
+        self.requests.request(1, os.path.join(self.src, "a.c"))
+        self.requests.request(2, os.path.join(self.src, "b.c"))
+        self.requests.request(3, os.path.join(self.src, "b.c"))
+        self.assertEqual([], self.done)
+        self.requests.run_pending()
+        self.assertEqual([(1, "unchanged"), (2, "modified"), (3, "modified")],
+                         self.done)
+        self.assertEqual([self.src], self.fetch.calls)
+
+    def test_cancel(self):
+        self.requests.request(1, os.path.join(self.src, "a.c"))
+        self.requests.request(2, os.path.join(self.lib, "x.c"))
+        self.requests.cancel(1)
+        self.requests.cancel(4)
+        self.requests.run_pending()
+        self.assertEqual([(2, "added")], self.done)
+        # nothing left to do for a cancelled directory
+        self.assertEqual([self.lib], self.fetch.calls)
+
+    def test_navigated_away(self):
+        self.requests.request(1, os.path.join(self.src, "a.c"))
+        self.clock.tc = 5000
+        self.requests.request(2, os.path.join(self.lib, "x.c"))
+        self.requests.run_pending()
+        self.assertEqual([(1, dircache.PENDING), (2, "added")], self.done)
+        self.assertEqual([self.lib], self.fetch.calls)
+
+    def test_worker(self):
+        answered = threading.Event()
+        requests = dircache.StatusRequests(self.cache,
+                lambda h, s: answered.set())
+        requests.start()
+        requests.request(1, os.path.join(self.src, "a.c"))
+        answered.wait(5)
+        self.assertTrue(answered.isSet())
+        self.assertTrue(self.cache.is_loaded(self.src))
+
+class TestRepoCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.opened = []
+        self.closed = []
+        self.repos = dircache.RepoCache(self._open, self._close,
+                maxrepos=2, idle=1000, tick_count=self.clock)
+
+    def _open(self, root):
+        if root == "/bad":
+            return None
+        self.opened.append(root)
+        return "repo:" + root
+
+    def _close(self, root, handle):
+        self.closed.append(handle)
+
+    def test_switching(self):
+        for i in range(3):
+            self.assertEqual("repo:/a", self.repos.get("/a"))
+            self.assertEqual("repo:/b", self.repos.get("/b"))
+        self.assertEqual(["/a", "/b"], self.opened)
+        self.assertEqual(4, self.repos.hits)
+
+    def test_lru(self):
+        self.repos.get("/a")
+        self.repos.get("/b")
+        self.repos.get("/a")
+        self.repos.get("/c")
+        self.assertEqual(["repo:/b"], self.closed)
+        self.assertEqual(2, len(self.repos))
+        self.assertEqual(None, self.repos.get("/bad"))
+        self.assertEqual(2, len(self.repos))
+
+    def test_reap(self):
+        self.repos.get("/a")
+        self.clock.tc = 600
+        self.repos.get("/b")
+        self.clock.tc = 1000
+        self.assertEqual(1, self.repos.reap())
+        self.assertEqual(["repo:/a"], self.closed)
+        self.clock.tc = 1599
+        self.assertEqual(0, self.repos.reap())
+        self.repos.get("/b")
+        self.clock.tc = 2598
+        self.assertEqual(0, self.repos.reap())
+        self.assertEqual(["/a", "/b"], self.opened)
+
+    def test_invalidate(self):
+        self.repos.get("/a")
+        self.repos.get("/b")
+        self.repos.invalidate("/a")
+        self.repos.invalidate("/x")
+        self.assertEqual(["repo:/a"], self.closed)
+        self.repos.invalidate()
+        self.assertEqual(["repo:/a", "repo:/b"], self.closed)
+        self.repos.get("/a")
+        self.assertEqual(["/a", "/b", "/a"], self.opened)
+
+class TestRepoFind(unittest.TestCase):
+    """
+    Repositories found for paths of a real git tree, opened as the
+    Nautilus extension opens them.
+    """
+
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix="tgit_find_"))
+        self.root = os.path.join(self.tmpdir, "repo")
+        subprocess.check_call(['git', 'init', '-q', self.root])
+        os.makedirs(os.path.join(self.root, "src", "lib"))
+        open(os.path.join(self.root, "src", "lib", "a.c"), "w").close()
+        self.repos = dircache.RepoCache(menumodel.RepoHandle)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_find(self):
+        repo = self.repos.find(os.path.join(self.root, "src", "lib", "a.c"))
+        self.assertEqual(self.root, repo.root)
+        self.assertFalse(repo.merging())
+        self.assertTrue(repo is self.repos.find(self.root))
+        self.assertEqual(1, self.repos.opens)
+
+    def test_not_in_repo(self):
+        self.assertEqual(None, self.repos.find(self.tmpdir))
+
+if tgitutil.find_path('git') is None:
+    del TestRepoFind
+
+if __name__ == '__main__':
+    unittest.main()
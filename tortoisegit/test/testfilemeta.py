@@ -0,0 +1,139 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+from tortoisegit import filemeta, tgitutil
+
+class TestLastCommits(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix="tgit_meta_"))
+        subprocess.call(['git', 'init', '-q', self.root])
+        os.makedirs(os.path.join(self.root, "src", "lib"))
+        self._commit("Ann", ["src/a.c", "src/lib/x.c", "top"], "first")
+        self._commit("Bob", ["src/b.c"], "second")
+        self._commit("Cid", ["src/a.c", "top"], "third")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _commit(self, author, files, msg):
+        for f in files:
+            fd = open(os.path.join(self.root, f), "a")
+            fd.write(msg + "\n")
+            fd.close()
+        env = dict(os.environ, GIT_AUTHOR_NAME=author,
+                GIT_AUTHOR_EMAIL="a@b", GIT_COMMITTER_NAME=author,
+                GIT_COMMITTER_EMAIL="a@b")
+        subprocess.check_call(['git', 'add'] + files, cwd=self.root)
+        subprocess.check_call(['git', 'commit', '-q', '-m', msg],
+                cwd=self.root, env=env)
+
+    def test_dir(self):
+        commits = filemeta.dir_last_commits(self.root, "src",
+                ["a.c", "b.c", "lib", "new.c"])
+        self.assertEqual(["a.c", "b.c", "lib"], sorted(commits))
+        node, author, date, summary = commits["a.c"]
+        self.assertEqual(("Cid", "third"), (author, summary))
+        self.assertEqual(40, len(node))
+        self.assertEqual(("Bob", "second"), commits["b.c"][1::2])
+        # a directory gets the last commit of anything below it
+        self.assertEqual(("Ann", "first"), commits["lib"][1::2])
+
+    def test_root(self):
+        commits = filemeta.dir_last_commits(self.root, "", ["top", "src"])
+        self.assertEqual("third", commits["top"][3])
+        self.assertEqual("third", commits["src"][3])
+
+    def test_tags(self):
+        subprocess.check_call(['git', 'tag', 'v1', 'HEAD~2'], cwd=self.root)
+        subprocess.check_call(['git', '-c', 'user.name=Ann',
+                '-c', 'user.email=a@b', 'tag', '-a', '-m', 'release',
+                'v2', 'HEAD~2'], cwd=self.root)
+        tags = filemeta.repo_tags(self.root)
+        node = filemeta.dir_last_commits(self.root, "src", ["lib"])["lib"][0]
+        self.assertEqual({node : ["v1", "v2"]}, tags)
+
+class FakeSignature(object):
+    def __init__(self):
+        self.sig = 1
+
+    def __call__(self, root):
+        return self.sig
+
+class TestMetaCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix="tgit_meta_"))
+        self.src = os.path.join(self.tmpdir, "src")
+        os.makedirs(self.src)
+        for f in ("a.c", "b.c", "new.c"):
+            open(os.path.join(self.src, f), "w").close()
+        self.calls = []
+        self.done = []
+        self.sig = FakeSignature()
+        self.meta = filemeta.MetaCache(self._states, self.done.append,
+                commits_func=self._commits, tags_func=self._tags,
+                signature=self.sig)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _states(self, pdir):
+        return {"a.c" : "unchanged", "b.c" : "modified", "new.c" : "unknown"}
+
+    def _commits(self, root, reldir, names):
+        self.calls.append((root, reldir, sorted(names)))
+        return {"a.c" : ("1" * 40, "Ann", 0, "first"),
+                "b.c" : ("2" * 40, "Bob", 60, "second")}
+
+    def _tags(self, root):
+        return {"2" * 40 : ["v1", "v2"]}
+
+    def _path(self, name):
+        return os.path.join(self.src, name)
+
+    def test_load(self):
+        self.assertEqual(None, self.meta.get(self.tmpdir, self._path("a.c")))
+        self.meta.load_now(self.tmpdir, self.src)
+        self.assertEqual([(self.tmpdir, "src", ["a.c", "b.c", "new.c"])],
+                         self.calls)
+        self.assertEqual([self.src], self.done)
+        meta = self.meta.get(self.tmpdir, self._path("b.c"))
+        self.assertEqual(("modified", "Bob", 60, "second"),
+                (meta.state, meta.author, meta.date, meta.summary))
+        self.assertEqual(["v1", "v2"], meta.tags)
+        self.assertEqual((), self.meta.get(self.tmpdir,
+                self._path("a.c")).tags)
+        meta = self.meta.get(self.tmpdir, self._path("new.c"))
+        self.assertEqual(("unknown", None), (meta.state, meta.node))
+
+    def test_signature(self):
+        self.meta.load_now(self.tmpdir, self.src)
+        self.assertTrue(self.meta.is_loaded(self.tmpdir, self.src))
+        self.sig.sig = 2
+        self.assertFalse(self.meta.is_loaded(self.tmpdir, self.src))
+
+    def test_invalidate(self):
+        self.meta.load_now(self.tmpdir, self.src)
+        self.meta.invalidate(self.src)
+        self.assertTrue(self.meta.is_loaded(self.tmpdir, self.src))
+        self.meta.invalidate(self.tmpdir)
+        self.assertFalse(self.meta.is_loaded(self.tmpdir, self.src))
+
+    def test_worker(self):
+        loaded = threading.Event()
+        meta = filemeta.MetaCache(self._states, lambda pdir: loaded.set(),
+                commits_func=self._commits, signature=self.sig)
+        meta.load(self.tmpdir, self.src)
+        loaded.wait(5)
+        self.assertTrue(loaded.isSet())
+        self.assertEqual("first",
+                meta.get(self.tmpdir, self._path("a.c")).summary)
+        self.assertEqual(1, len(self.calls))
+
+if tgitutil.find_path('git') is None:
+    del TestLastCommits
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from tortoisegit import fswatch
+
+class WatcherTests(object):
+    """
+    Tests shared by all watcher implementations.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tgit_fswatch_")
+        os.makedirs(os.path.join(self.root, ".git"))
+        os.makedirs(os.path.join(self.root, "src"))
+        self._write("src", "a.c")
+        self.watcher = self.make_watcher()
+        self.watch()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.root)
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def watch(self):
+        self.assertTrue(self.watcher.watch(self.root))
+        self.started()
+        self.assertTrue(self.watcher.is_watching(self.root))
+
+    def started(self):
+        pass
+
+    def _write(self, *args):
+        fd = open(self._path(*args), "a")
+        fd.write("x")
+        fd.close()
+
+    def test_no_changes(self):
+        self.assertEqual(set(), self.changes())
+
+    def test_modified(self):
+        self._write("src", "a.c")
+        self.assertTrue(self._path("src", "a.c") in self.changes())
+        self.assertEqual(set(), self.changes())
+
+    def test_created_and_removed(self):
+        self._write("src", "b.c")
+        os.unlink(self._path("src", "a.c"))
+        changes = self.changes()
+        self.assertTrue(self._path("src", "a.c") in changes)
+        self.assertTrue(self._path("src", "b.c") in changes)
+
+    def test_new_directory(self):
+        os.makedirs(self._path("src", "lib"))
+        self._write("src", "lib", "c.c")
+        changes = self.changes()
+        self.assertTrue(self._path("src", "lib") in changes)
+        self.assertTrue(self._path("src", "lib", "c.c") in changes)
+        self._write("src", "lib", "c.c")
+        self.assertTrue(self._path("src", "lib", "c.c") in self.changes())
+
+    def test_git_dir_ignored(self):
+        self._write(".git", "index")
+        self.assertEqual(set(), self.changes())
+
+    def test_submodule_ignored(self):
+        os.makedirs(self._path("src", "sub"))
+        self._write("src", "sub", ".git")
+        self.watcher.unwatch(self.root)
+        self.watch()
+        self._write("src", "sub", "c.c")
+        self.assertFalse(self._path("src", "sub", "c.c") in self.changes())
+
+    def test_unwatch(self):
+        self.watcher.unwatch(self.root)
+        self.assertFalse(self.watcher.is_watching(self.root))
+        self.assertEqual(None, self.watcher.changes(self.root))
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self):
+        self.ticks = 0
+        return fswatch.PollingWatcher(tick_count=lambda: self.ticks,
+                background=False)
+
+    def started(self):
+        # the first scan is the watcher thread's
+        self.assertFalse(self.watcher.is_watching(self.root))
+        self.assertEqual(None, self.watcher.changes(self.root))
+        self.watcher.scan_pending()
+
+    def changes(self):
+        self.ticks += fswatch.POLL_INTERVAL
+        # changes found by the scan asked for are reported next time
+        self.assertEqual(set(), self.watcher.changes(self.root))
+        self.watcher.scan_pending()
+        return self.watcher.changes(self.root)
+
+    def test_interval(self):
+        self._write("src", "a.c")
+        self.watcher.changes(self.root)
+        self.assertEqual(fswatch.POLL_INTERVAL, self.watcher.scan_pending())
+        self.assertEqual(set(), self.watcher.changes(self.root))
+
+    def test_only_scanned_when_asked(self):
+        self._write("src", "a.c")
+        self.ticks += fswatch.POLL_INTERVAL
+        self.assertEqual(None, self.watcher.scan_pending())
+        self.assertEqual(set(), self.watcher.changes(self.root))
+
+class TestPollingWatcherThread(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tgit_fswatch_")
+        self.watcher = fswatch.PollingWatcher(interval=10)
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.root)
+
+    def _wait(self, cond):
+        for i in range(500):
+            if cond():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_scanned_in_background(self):
+        self.assertTrue(self.watcher.watch(self.root))
+        self.assertTrue(self._wait(lambda: self.watcher.is_watching(self.root)))
+        path = os.path.join(self.root, "a.c")
+        open(path, "w").close()
+        changes = set()
+        def found():
+            changes.update(self.watcher.changes(self.root))
+            return path in changes
+        self.assertTrue(self._wait(found))
+
+if hasattr(fswatch, 'InotifyWatcher'):
+    class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+        def make_watcher(self):
+            return fswatch.InotifyWatcher()
+
+        def changes(self):
+            return self.watcher.changes(self.root)
+
+    class TestInotifyFallback(unittest.TestCase):
+        def setUp(self):
+            self.root = tempfile.mkdtemp(prefix="tgit_fswatch_")
+            os.makedirs(os.path.join(self.root, "src"))
+            self.polling = fswatch.PollingWatcher(0, lambda: 0,
+                    background=False)
+            self.watcher = fswatch.InotifyWatcher(fallback=self.polling)
+            self.added = []
+            def add_watch(root, path):
+                self.added.append(path)
+                return path == self.root
+            self.watcher._add_watch = add_watch
+
+        def tearDown(self):
+            self.watcher.close()
+            shutil.rmtree(self.root)
+
+        def test_polled(self):
+            self.assertTrue(self.watcher.watch(self.root))
+            self.assertEqual(2, len(self.added))
+            self.assertFalse(self.watcher.is_watching(self.root))
+            self.polling.scan_pending()
+            self.assertTrue(self.watcher.is_watching(self.root))
+            # the tree isn't walked again
+            self.assertTrue(self.watcher.watch(self.root))
+            self.assertEqual(2, len(self.added))
+            path = os.path.join(self.root, "src", "a.c")
+            open(path, "w").close()
+            self.assertEqual(set(), self.watcher.changes(self.root))
+            self.polling.scan_pending()
+            self.assertTrue(path in self.watcher.changes(self.root))
+
+        def test_new_directory(self):
+            del self.watcher._add_watch
+            self.assertTrue(self.watcher.watch(self.root))
+            self.watcher._add_watch = lambda root, path: False
+            os.makedirs(os.path.join(self.root, "new"))
+            self.assertEqual(None, self.watcher.changes(self.root))
+            self.polling.scan_pending()
+            self.assertTrue(self.watcher.is_watching(self.root))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,32 +3,30 @@
 #
 
 import os, sys, time, atexit
-from mercurial import ui
-from mercurial.i18n import _
 
 # FIXMEL: quick & dirty hack to add tortoise to module search path
 import __init__
 moddir = os.path.dirname(__init__.__file__)
 sys.path.insert(0, os.path.join(moddir, os.pardir))
 
+# without pywin32, load the handlers with the win32stub modules
+import win32stub
+win32stub.install()
+
 from iconoverlay import IconOverlayExtension
 
 def lsprof(checkargs):
-    try:
-        from mercurial import lsprof
-    except ImportError:
-        raise util.Abort(_(
-            'lsprof not available - install from '
-            'http://codespeak.net/svn/user/arigo/hack/misc/lsprof/'))
-    p = lsprof.Profiler()
-    p.enable(subcalls=True)
+    import cProfile, pstats
+    p = cProfile.Profile()
+    p.enable()
     try:
         return checkargs()
     finally:
         p.disable()
-        stats = lsprof.Stats(p.getstats())
-        stats.sort()
-        stats.pprint(top=10, file=sys.stderr, climit=5)
+        stats = pstats.Stats(p, stream=sys.stderr)
+        stats.sort_stats('inlinetime')
+        stats.print_stats(10)
+        stats.print_callees(5)
         
 def profile(checkargs):        
     import hotshot, hotshot.stats
@@ -38,8 +36,8 @@ def profile(checkargs):
             return prof.runcall(checkargs)            
         except:
             try:
-                ui.warn(_('exception raised - generating '
-                         'profile anyway\n'))
+                sys.stderr.write('exception raised - generating '
+                                 'profile anyway\n')
             except:
                 pass
             raise
@@ -51,7 +49,6 @@ def profile(checkargs):
         stats.print_stats(40)
         
 def timeit():
-    u = ui.ui()
     def get_times():
         t = os.times()
         if t[4] == 0.0: # Windows leaves this as zero, so use time.clock()
@@ -60,7 +57,7 @@ def timeit():
     s = get_times()
     def print_time():
         t = get_times()
-        u.warn(_("Time: real %.3f secs (user %.3f+%.3f sys %.3f+%.3f)\n") %
+        sys.stderr.write("Time: real %.3f secs (user %.3f+%.3f sys %.3f+%.3f)\n" %
             (t[4]-s[4], t[0]-s[0], t[2]-s[2], t[1]-s[1], t[3]-s[3]))
             
     atexit.register(print_time)
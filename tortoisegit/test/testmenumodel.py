@@ -0,0 +1,171 @@
+import os
+import shutil
+import tempfile
+import unittest
+from tortoisegit import menumodel, tgitutil
+
+class FakeClock(object):
+    def __init__(self):
+        self.tc = 0
+
+    def __call__(self):
+        self.tc += 2
+        return self.tc
+
+class FakeState(object):
+    def __init__(self, state=None):
+        self.state = state
+
+    def __call__(self, path):
+        return self.state
+
+def _handlers(menus):
+    names = []
+    for m in menus:
+        if isinstance(m, menumodel.TortoiseSubmenu):
+            names.extend(_handlers(m.get_menus()))
+        elif isinstance(m, menumodel.TortoiseMenu):
+            names.append(m.handler)
+    return names
+
+def _item(menus, handler):
+    for m in menus:
+        if isinstance(m, menumodel.TortoiseMenu) and m.handler == handler:
+            return m
+    return None
+
+class TestMenuModel(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix="tgit_menu_"))
+        self.root = os.path.join(self.tmpdir, "repo")
+        self.git_dir = os.path.join(self.root, ".git")
+        os.makedirs(os.path.join(self.git_dir, "refs", "heads"))
+        os.mkdir(os.path.join(self.root, "src"))
+        self.state = FakeState()
+        self.model = menumodel.MenuModel(self.state, tick_count=FakeClock())
+        self.configs = []
+        handle = self.model.open_repo(self.root)
+        handle._config_func = self._config
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        tgitutil.root_cache.invalidate()
+
+    def _config(self, root):
+        self.configs.append(root)
+        return {'tortoisegit.vdiff' : 'meld'}
+
+    def _menus(self, path):
+        return self.model.get_menus(path, [path])
+
+    def test_kinds(self):
+        top, commands = self._menus(self.root)
+        self.assertEqual(['_commit'], _handlers(top))
+        self.failIf('_init' in _handlers(commands))
+        self.failUnless('_config_repo' in _handlers(commands))
+        self.failUnless(_item(commands, '_vdiff').state)
+        top, commands = self._menus(os.path.join(self.root, "src"))
+        self.failUnless('_init' in _handlers(commands))
+
+    def test_no_repo(self):
+        if tgitutil.find_root(self.tmpdir) is not None:
+            return      # temp dir inside a repository
+        top, commands = self._menus(self.tmpdir)
+        self.assertEqual([], top)
+        self.assertEqual(['_clone', '_init', '_config_user', '_about'],
+                _handlers(commands))
+
+    def test_cached(self):
+        menus = self._menus(self.root)
+        self.failUnless(menus is self._menus(self.root))
+        self.assertEqual(1, len(self.configs))
+        stats = self.model.stats()
+        self.assertEqual(2, stats['queries'])
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(2, stats['time_last'])
+        self.assertEqual(2, stats['time_avg'])
+
+    def test_summary(self):
+        top, commands = self._menus(self.root)
+        self.failUnless(top[0].state)
+        self.state.state = 'unchanged'
+        top, commands = self._menus(self.root)
+        self.failIf(top[0].state)
+        self.failIf(_item(commands, '_revert').state)
+        self.state.state = 'modified'
+        top, commands = self._menus(self.root)
+        self.failUnless(top[0].state)
+
+    def test_merge(self):
+        for name in ('master', 'topic'):
+            open(os.path.join(self.git_dir, "refs", "heads", name), "w").close()
+        top, commands = self._menus(self.root)
+        self.failUnless(_item(commands, '_merge').state)
+        open(os.path.join(self.git_dir, "MERGE_HEAD"), "w").close()
+        top, commands = self._menus(self.root)
+        self.assertEqual(['menumerge.ico', 'menuunmerge.ico'],
+                [m.icon for m in commands if getattr(m, 'handler', None) == '_merge'])
+        self.failIf(_item(commands, '_merge').state)
+
+    def test_config_changed(self):
+        self._menus(self.root)
+        fd = open(os.path.join(self.git_dir, "config"), "w")
+        fd.write("[tortoisegit]\n\tview = gitk\n")
+        fd.close()
+        self._menus(self.root)
+        self.assertEqual(2, len(self.configs))
+
+class TestRepoHandle(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_handle_")
+        self.git_dir = os.path.join(self.tmpdir, ".git")
+        os.makedirs(os.path.join(self.git_dir, "refs", "heads", "feature"))
+        open(os.path.join(self.git_dir, "refs", "heads", "master"), "w").close()
+        open(os.path.join(self.git_dir, "refs", "heads", "feature", "x"),
+                "w").close()
+        fd = open(os.path.join(self.git_dir, "packed-refs"), "w")
+        fd.write("# pack-refs with: peeled\n"
+                 "0123 refs/heads/master\n"
+                 "4567 refs/heads/old\n"
+                 "89ab refs/tags/v1\n")
+        fd.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_branches(self):
+        handle = menumodel.RepoHandle(self.tmpdir)
+        self.assertEqual(3, handle.branches())
+        self.failIf(handle.merging())
+
+    def test_branches_cached(self):
+        handle = menumodel.RepoHandle(self.tmpdir)
+        counts = []
+        count = handle._count_branches
+        def count_branches():
+            counts.append(1)
+            return count()
+        handle._count_branches = count_branches
+        handle.branches()
+        self.assertEqual(3, handle.branches())
+        self.assertEqual(1, len(counts))
+        open(os.path.join(self.git_dir, "refs", "heads", "topic"),
+                "w").close()
+        self.assertEqual(4, handle.branches())
+        self.assertEqual(2, len(counts))
+
+    def _head(self, head):
+        fd = open(os.path.join(self.git_dir, "HEAD"), "w")
+        fd.write(head + "\n")
+        fd.close()
+
+    def test_branch(self):
+        handle = menumodel.RepoHandle(self.tmpdir)
+        self.assertEqual(None, handle.branch())
+        self._head("ref: refs/heads/feature/x")
+        self.assertEqual("feature/x", handle.branch())
+        self._head("0123" * 10)
+        self.assertEqual(None, handle.branch())
+
+if __name__ == '__main__':
+    unittest.main()
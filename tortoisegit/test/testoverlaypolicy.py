@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+from tortoisegit import overlaypolicy
+
+class FakeVolumes(overlaypolicy.Volumes):
+    """
+    Volumes given by the test, as {volume: kind}; a path's volume is
+    its first component.
+    """
+    def __init__(self, kinds):
+        self.kinds = kinds
+        self.lookups = 0
+
+    def volume(self, path):
+        return path.strip(os.sep).split(os.sep)[0]
+
+    def kind(self, volume):
+        self.lookups += 1
+        return self.kinds.get(volume, overlaypolicy.LOCAL)
+
+class FakeConfig(object):
+    def __init__(self, global_opts=(), repo_opts=()):
+        self.global_opts = list(global_opts)
+        self.repo_opts = list(repo_opts)
+        self.calls = 0
+
+    def __call__(self, root):
+        self.calls += 1
+        return self.global_opts, self.repo_opts
+
+class TestOverlayPolicy(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_policy_")
+        self.root = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.root, ".git"))
+        self.volume = self.tmpdir.strip(os.sep).split(os.sep)[0]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _policy(self, config, kind=overlaypolicy.LOCAL):
+        self.volumes = FakeVolumes({self.volume : kind})
+        return overlaypolicy.OverlayPolicy(config, self.volumes)
+
+    def test_cached(self):
+        config = FakeConfig()
+        policy = self._policy(config)
+        for i in range(3):
+            self.assertTrue(policy.enabled(self.root))
+        self.assertEqual(1, config.calls)
+        self.assertEqual(1, self.volumes.lookups)
+
+    def test_localdisks(self):
+        config = FakeConfig(global_opts=['localdisks'])
+        self.assertTrue(self._policy(config).enabled(self.root))
+        policy = self._policy(config, overlaypolicy.NETWORK)
+        self.assertFalse(policy.enabled(self.root))
+
+    def test_repo_disabled(self):
+        policy = self._policy(FakeConfig(repo_opts=['False']))
+        self.assertFalse(policy.enabled(self.root))
+
+    def test_config_changed(self):
+        config = FakeConfig()
+        policy = self._policy(config)
+        self.assertTrue(policy.enabled(self.root))
+        config.repo_opts.append('False')
+        fd = open(os.path.join(self.root, ".git", "config"), "w")
+        fd.write("[tortoisegit]\n\toverlayicons = False\n")
+        fd.close()
+        self.assertFalse(policy.enabled(self.root))
+        self.assertEqual(2, config.calls)
+
+    def test_invalidate(self):
+        config = FakeConfig()
+        policy = self._policy(config)
+        policy.enabled(self.root)
+        policy.invalidate(self.root)
+        policy.enabled(self.root)
+        self.assertEqual(2, config.calls)
+        self.assertEqual(1, self.volumes.lookups)
+        policy.invalidate()
+        policy.enabled(self.root)
+        self.assertEqual(2, self.volumes.lookups)
+
+class TestPosixVolumes(unittest.TestCase):
+    def setUp(self):
+        fd, self.mounts = tempfile.mkstemp(prefix="tgit_mounts_")
+        os.write(fd, "/dev/sda1 / ext4 rw 0 0\n"
+                     "srv:/export /home/net\\040share nfs4 rw 0 0\n"
+                     "/dev/sdb1 /media/usb vfat rw 0 0\n")
+        os.close(fd)
+        self.volumes = overlaypolicy._PosixVolumes(self.mounts)
+
+    def tearDown(self):
+        os.unlink(self.mounts)
+
+    def _kind(self, path):
+        return self.volumes.kind(self.volumes.volume(path))
+
+    def test_kinds(self):
+        self.assertEqual(overlaypolicy.NETWORK,
+                self._kind('/home/net share/repo/src'))
+        self.assertEqual(overlaypolicy.REMOVABLE, self._kind('/media/usb/r'))
+        self.assertEqual(overlaypolicy.LOCAL, self._kind('/home/user/repo'))
+
+if os.name != 'posix':
+    del TestPosixVolumes
+
+if __name__ == '__main__':
+    unittest.main()
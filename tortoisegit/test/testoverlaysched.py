@@ -0,0 +1,215 @@
+import threading
+import time
+import unittest
+from tortoisegit import overlaysched
+
+class FakeNotifier(object):
+    """
+    Notifier recording what the shell would be told to refresh.
+    """
+    def __init__(self):
+        self.items = []
+        self.dirs = []
+        self.notified = threading.Event()
+
+    def update_item(self, path):
+        self.items.append(path)
+        self.notified.set()
+
+    def update_dir(self, path):
+        self.dirs.append(path)
+        self.notified.set()
+
+class FakeClock(object):
+    def __init__(self):
+        self.tc = 0
+
+    def __call__(self):
+        return self.tc
+
+class SlowStatus(object):
+    """
+    Status function blocking until the test releases it.
+    """
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, path):
+        self.calls.append(path)
+        self.release.wait(5)
+        return 'modified'
+
+class TestNotifyCoalescer(unittest.TestCase):
+    def setUp(self):
+        self.notifier = FakeNotifier()
+        self.clock = FakeClock()
+        self.coalescer = overlaysched.NotifyCoalescer(self.notifier,
+                delay=100, dir_threshold=2, tick_count=self.clock)
+
+    def test_delay(self):
+        self.coalescer.add('/r/a')
+        self.clock.tc = 50
+        self.assertEqual(50, self.coalescer.flush_due())
+        self.assertEqual([], self.notifier.items)
+        self.coalescer.add('/r/b')
+        self.coalescer.add('/r/a')
+        self.clock.tc = 100
+        self.assertEqual(None, self.coalescer.flush_due())
+        self.assertEqual(['/r/a', '/r/b'], self.notifier.items)
+        self.assertEqual(None, self.coalescer.flush_due())
+
+    def test_whole_dir(self):
+        for name in 'abc':
+            self.coalescer.add('/r/d/' + name)
+        self.coalescer.add('/r/e')
+        self.coalescer.flush()
+        self.assertEqual(['/r/d'], self.notifier.dirs)
+        self.assertEqual(['/r/e'], self.notifier.items)
+
+    def test_thread(self):
+        coalescer = overlaysched.NotifyCoalescer(self.notifier, delay=1)
+        coalescer.start()
+        coalescer.add('/r/a')
+        self.failUnless(self.notifier.notified.wait(5))
+        self.assertEqual(['/r/a'], self.notifier.items)
+
+class TestDirQueue(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.dropped = []
+        self.queue = overlaysched.DirQueue(self.dropped.append,
+                tick_count=self.clock)
+
+    def _put(self, *paths):
+        for path in paths:
+            self.queue.put(overlaysched._Job(path))
+
+    def _drain(self):
+        paths = []
+        while True:
+            job = self.queue.get(block=False)
+            if job is None:
+                return paths
+            paths.append(job.path)
+
+    def test_most_queried_first(self):
+        self._put('/r/a/1', '/r/b/1', '/r/b/2')
+        self.assertEqual(['/r/b/1', '/r/b/2', '/r/a/1'], self._drain())
+
+    def test_touch(self):
+        self._put('/r/a/1', '/r/a/2', '/r/b/1')
+        self.clock.tc = 1000
+        self.queue.touch('/r/b/1')
+        self.assertEqual(['/r/b/1', '/r/a/1', '/r/a/2'], self._drain())
+
+    def test_stale(self):
+        self._put('/r/a/1', '/r/a/2')
+        self.clock.tc = overlaysched.STALE_TIMEOUT
+        self._put('/r/b/1')
+        self.assertEqual(['/r/b/1'], self._drain())
+        self.assertEqual(['/r/a/1', '/r/a/2'], [j.path for j in self.dropped])
+        stats = self.queue.stats()
+        self.assertEqual(2, stats['dropped'])
+        self.assertEqual(0, stats['queued'])
+
+    def test_not_stale_alone(self):
+        self._put('/r/a/1')
+        self.clock.tc = 10 * overlaysched.STALE_TIMEOUT
+        self.assertEqual(['/r/a/1'], self._drain())
+        self.assertEqual([], self.dropped)
+
+    def test_metrics(self):
+        self._put('/r/a/1', '/r/a/2', '/r/a/3')
+        self.clock.tc = 40
+        self.queue.get()
+        self.clock.tc = 100
+        self.queue.get()
+        stats = self.queue.stats()
+        self.assertEqual(3, stats['max_queued'])
+        self.assertEqual(1, stats['queued'])
+        self.assertEqual(2, stats['served'])
+        self.assertEqual(70, stats['wait_avg'])
+        self.assertEqual(100, stats['wait_max'])
+
+class TestStatusScheduler(unittest.TestCase):
+    def setUp(self):
+        self.notifier = FakeNotifier()
+        self.coalescer = overlaysched.NotifyCoalescer(self.notifier, delay=0)
+
+    def test_within_budget(self):
+        sched = overlaysched.StatusScheduler(lambda path: 'added',
+                self.coalescer, budget=5000)
+        self.assertEqual('added', sched.get_state('/r/a'))
+        self.assertEqual(0, sched.late)
+        self.coalescer.flush()
+        self.assertEqual([], self.notifier.items)
+
+    def test_late(self):
+        status = SlowStatus()
+        sched = overlaysched.StatusScheduler(status, self.coalescer, budget=1)
+        self.assertEqual(overlaysched.PENDING, sched.get_state('/r/a'))
+        # the other overlay handlers don't wait for the same item again
+        self.assertEqual(overlaysched.PENDING, sched.get_state('/r/a'))
+        self.assertEqual(1, sched.late)
+        status.release.set()
+        self.failUnless(self.notifier.notified.wait(5))
+        self.assertEqual(['/r/a'], self.notifier.items)
+        # the refresh is answered from the late result
+        self.assertEqual('modified', sched.get_state('/r/a'))
+        self.assertEqual(['/r/a'], status.calls)
+        self.assertEqual(1, sched.stats()['late'])
+
+    def test_recent(self):
+        clock = FakeClock()
+        calls = []
+        def status(path):
+            calls.append(path)
+            return 'added'
+        sched = overlaysched.StatusScheduler(status, self.coalescer,
+                budget=5000, tick_count=clock)
+        for i in range(3):
+            self.assertEqual('added', sched.get_state('/r/a'))
+        self.assertEqual(['/r/a'], calls)
+        clock.tc = overlaysched.RECENT_TIMEOUT
+        self.assertEqual('added', sched.get_state('/r/a'))
+        self.assertEqual(['/r/a', '/r/a'], calls)
+
+    def test_lookup(self):
+        status = SlowStatus()
+        known = {'/r/a' : 'added'}
+        sched = overlaysched.StatusScheduler(status, self.coalescer,
+                budget=1, lookup=known.get)
+        # answered on the calling thread, without waiting for the worker
+        self.assertEqual('added', sched.get_state('/r/a'))
+        self.assertEqual([], status.calls)
+        self.assertEqual(overlaysched.PENDING, sched.get_state('/r/b'))
+        status.release.set()
+
+    def test_late_pending(self):
+        status = SlowStatus()
+        def pending(path):
+            status(path)
+            return overlaysched.PENDING
+        sched = overlaysched.StatusScheduler(pending, self.coalescer,
+                budget=1, tick_count=FakeClock())
+        self.assertEqual(overlaysched.PENDING, sched.get_state('/r/a'))
+        status.release.set()
+        # not kept as a result: the item is computed again when asked
+        for i in range(500):
+            self.assertEqual(overlaysched.PENDING, sched.get_state('/r/a'))
+            if len(status.calls) > 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(['/r/a', '/r/a'], status.calls[:2])
+        self.assertEqual([], self.notifier.items)
+
+    def test_error(self):
+        def status(path):
+            raise IOError('gone')
+        sched = overlaysched.StatusScheduler(status, self.coalescer,
+                budget=5000)
+        self.assertEqual(None, sched.get_state('/r/a'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,668 @@
+import os
+import marshal
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from tortoisegit import fswatch, statuscache, tgitutil
+
+class FakeStatus(object):
+    """
+    Status function returning canned results, counting its calls.
+    """
+    def __init__(self, status):
+        self.status = status
+        self.calls = []
+
+    def __call__(self, root, pdir, files=None):
+        self.calls.append(files or pdir)
+        if files is None:
+            return self.status
+        files = [f[len(root)+1:] for f in files]
+        return [[f for f in grp if f in files] for grp in self.status]
+
+class FakeWatcher(object):
+    """
+    Watcher reporting the changes set by the test.
+    """
+    def __init__(self):
+        self.roots = set()
+        self.pending = set()
+
+    def watch(self, root):
+        self.roots.add(root)
+        return True
+
+    def is_watching(self, root):
+        return root in self.roots
+
+    def changes(self, root):
+        changes, self.pending = self.pending, set()
+        return changes
+
+class TestLRUCache(unittest.TestCase):
+    def test_evict_by_entries(self):
+        lru = statuscache.LRUCache(2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.get('a')
+        lru.put('c', 3)
+        self.assertEqual(['a', 'c'], lru.keys())
+        self.assertEqual(1, lru.evictions)
+
+    def test_evict_by_cost(self):
+        lru = statuscache.LRUCache(10, maxcost=10)
+        lru.put('a', 1, cost=6)
+        lru.put('b', 2, cost=3)
+        lru.put('c', 3, cost=4)
+        self.assertEqual(['b', 'c'], lru.keys())
+        self.assertEqual(7, lru.cost)
+
+    def test_pop(self):
+        lru = statuscache.LRUCache(10)
+        lru.put('a', 1, cost=5)
+        self.assertEqual(1, lru.pop('a'))
+        self.assertEqual(None, lru.pop('a'))
+        self.assertEqual(0, lru.cost)
+
+class StartingWatcher(FakeWatcher):
+    """
+    FakeWatcher taking a while to start watching, until start().
+    """
+    def __init__(self):
+        FakeWatcher.__init__(self)
+        self.starting = set()
+
+    def watch(self, root):
+        self.starting.add(root)
+        return True
+
+    def start(self):
+        self.roots.update(self.starting)
+
+class TestStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_statuscache_")
+        self.root = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.root, ".git"))
+        os.makedirs(os.path.join(self.root, "src", "lib"))
+        self.ticks = 0
+        self.status = FakeStatus((
+                [os.path.join("src", "b.c")],
+                [os.path.join("src", "lib", "c.c")],
+                [], [], [os.path.join("src", "d.c")], [],
+                [os.path.join("src", "a.c"), "README"]))
+        self.cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def test_states(self):
+        get_state = self.cache.get_state
+        self.assertEqual(statuscache.UNCHANGED, get_state(self._path("src", "a.c")))
+        self.assertEqual(statuscache.MODIFIED, get_state(self._path("src", "b.c")))
+        self.assertEqual(statuscache.UNKNOWN, get_state(self._path("src", "d.c")))
+        self.assertEqual(statuscache.ADDED, get_state(self._path("src", "lib")))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_dir_states_batch(self):
+        for f in ("a.c", "b.c", "d.c"):
+            open(self._path("src", f), "w").close()
+        self.assertEqual({"a.c" : statuscache.UNCHANGED,
+                          "b.c" : statuscache.MODIFIED,
+                          "d.c" : statuscache.UNKNOWN,
+                          "lib" : statuscache.ADDED},
+                         self.cache.get_dir_states(self._path("src")))
+        self.assertEqual(1, len(self.status.calls))
+        self.assertEqual({}, self.cache.get_dir_states(self._path("gone")))
+
+    def test_peek(self):
+        a = self._path("src", "a.c")
+        self.assertEqual(None, self.cache.peek_state(a))
+        self.cache.get_state(a)
+        self.assertEqual(statuscache.MODIFIED,
+                self.cache.peek_state(self._path("src", "b.c")))
+        self.ticks += statuscache.CHECK_INTERVAL
+        # checking the signatures is left to get_state()
+        self.assertEqual(None, self.cache.peek_state(a))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_status_unlocked(self):
+        started, release = threading.Event(), threading.Event()
+        def status(root, pdir, files=None):
+            started.set()
+            release.wait()
+            return self.status(root, pdir, files)
+        cache = statuscache.StatusCache(status_func=status,
+                tick_count=lambda: self.ticks)
+        states = []
+        def query(f):
+            states.append(cache.get_state(self._path("src", f)))
+        threads = [threading.Thread(target=query, args=(f,))
+                   for f in ("a.c", "b.c")]
+        threads[0].start()
+        started.wait()
+        # other queries are answered meanwhile, those of the repository
+        # wait for its status
+        self.assertEqual(statuscache.NOT_IN_REPO, cache.get_state(
+                os.path.join(self.tmpdir, "elsewhere")))
+        threads[1].start()
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual([statuscache.MODIFIED, statuscache.UNCHANGED],
+                sorted(states))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_not_in_repo(self):
+        path = os.path.join(self.tmpdir, "elsewhere")
+        self.assertEqual(statuscache.NOT_IN_REPO, self.cache.get_state(path))
+        self.assertEqual(statuscache.NOT_IN_REPO, self.cache.get_state(path))
+        self.assertEqual([], self.status.calls)
+
+    def test_alternating_dirs(self):
+        for i in range(5):
+            self.cache.get_state(self._path("src", "a.c"))
+            self.cache.get_state(self._path("src", "lib", "c.c"))
+        self.assertEqual(2, len(self.status.calls))
+        stats = self.cache.stats()
+        self.assertEqual(8, stats['hits'])
+        self.assertEqual(2, stats['misses'])
+        self.assertEqual(2, stats['dirs'])
+
+    def _touch(self, *args):
+        fd = open(self._path(*args), 'a')
+        fd.write('x')
+        fd.close()
+
+    def test_idle_repo_not_rescanned(self):
+        self.cache.get_state(self._path("src", "a.c"))
+        for i in range(3):
+            self.ticks += statuscache.CHECK_INTERVAL
+            self.cache.get_state(self._path("src", "a.c"))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_git_dir_ignored(self):
+        sig = statuscache.dir_signature(self.root)
+        self._touch(".git", "index.lock")
+        os.rename(self._path(".git", "index.lock"), self._path(".git", "index"))
+        self.assertEqual(sig, statuscache.dir_signature(self.root))
+
+    def test_deep_change_expires(self):
+        self.cache.get_state(self._path("src"))
+        self._touch("src", "lib", "c.c")
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.cache.get_state(self._path("src"))
+        self.assertEqual(1, len(self.status.calls))
+        self.ticks += statuscache.CACHE_TIMEOUT
+        self.cache.get_state(self._path("src"))
+        self.assertEqual(2, len(self.status.calls))
+
+    def test_dir_change(self):
+        self.cache.get_state(self._path("src", "a.c"))
+        self._touch("src", "a.c")
+        self.cache.get_state(self._path("src", "a.c"))
+        self.assertEqual(1, len(self.status.calls))
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.cache.get_state(self._path("src", "a.c"))
+        self.assertEqual(2, len(self.status.calls))
+
+    def test_index_change(self):
+        self.cache.get_state(self._path("src", "a.c"))
+        self._touch(".git", "index")
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.cache.get_state(self._path("src", "a.c"))
+        self.assertEqual(2, len(self.status.calls))
+
+    def test_parents_updated(self):
+        self._touch("src", "lib", "c.c")
+        self.cache.get_state(self._path("src", "a.c"))
+        self.cache.get_state(self._path("src", "lib", "c.c"))
+        self.status.status[1].remove(os.path.join("src", "lib", "c.c"))
+        self.status.status[0].append(os.path.join("src", "lib", "c.c"))
+        self._touch("src", "lib", "c.c")
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.assertEqual(statuscache.MODIFIED,
+                self.cache.get_state(self._path("src", "lib", "c.c")))
+        self.assertEqual(statuscache.MODIFIED,
+                self.cache.get_state(self._path("src", "lib")))
+        self.assertEqual(3, len(self.status.calls))
+
+    def test_evict_keeps_parent_status(self):
+        cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, maxdirs=2)
+        cache.get_state(self._path("src", "a.c"))
+        cache.get_state(self._path("src", "lib", "c.c"))
+        cache.get_state(self._path("README"))
+        self.assertEqual(statuscache.ADDED,
+                cache.get_state(self._path("src", "lib")))
+        self.assertEqual(4, len(self.status.calls))
+
+    def test_not_in_repo_timeout(self):
+        path = os.path.join(self.tmpdir, "elsewhere")
+        self.cache.get_state(path)
+        self.ticks += statuscache.CACHE_TIMEOUT
+        self.cache.get_state(path)
+        self.assertEqual(2, self.cache.stats()['misses'])
+
+    def test_dir_states(self):
+        get_state = self.cache.get_state
+        self.assertEqual(statuscache.MODIFIED, get_state(self._path("src")))
+        self.assertEqual(statuscache.UNCHANGED, get_state(self._path("README")))
+
+    def test_dir_limit(self):
+        cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, maxdirs=1)
+        cache.get_state(self._path("src", "a.c"))
+        cache.get_state(self._path("src", "lib", "c.c"))
+        cache.get_state(self._path("src", "a.c"))
+        self.assertEqual(3, len(self.status.calls))
+        self.assertEqual(1, cache.stats()['dirs'])
+
+    def test_clear_repo(self):
+        self.cache.get_state(self._path("src", "a.c"))
+        self.cache.get_state(os.path.join(self.tmpdir, "elsewhere"))
+        self.cache.clear(self.root)
+        self.assertEqual(1, self.cache.stats()['dirs'])
+
+    def test_ignored_dir(self):
+        self.status.status[5].append("build")
+        self.assertEqual(statuscache.IGNORED,
+                self.cache.get_state(self._path("build")))
+        os.makedirs(self._path("build", "obj"))
+        self.assertEqual(statuscache.IGNORED,
+                self.cache.get_state(self._path("build", "obj", "a.o")))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_ignored_dir_matcher(self):
+        asked = []
+        def ignored(root, pdir):
+            asked.append(pdir)
+            return os.path.basename(pdir) == "build"
+        cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, ignored_func=ignored)
+        self.assertEqual(statuscache.IGNORED,
+                cache.get_state(self._path("build", "a.o")))
+        self.assertEqual(statuscache.IGNORED,
+                cache.get_state(self._path("build", "b.o")))
+        self.assertEqual([self._path("build")], asked)
+        self.assertEqual([], self.status.calls)
+        # not asked for directories whose parent's status is known
+        cache.get_state(self._path("src", "a.c"))
+        cache.get_state(self._path("src", "lib", "c.c"))
+        self.assertEqual(2, len(asked))
+
+class TestWatchedStatusCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_statuscache_")
+        self.root = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.root, ".git"))
+        os.makedirs(os.path.join(self.root, "src", "lib"))
+        self.ticks = 0
+        self.status = FakeStatus((
+                [], [], [], [], [],  [],
+                [os.path.join("src", "a.c"), os.path.join("src", "b.c"),
+                 os.path.join("src", "lib", "c.c")]))
+        self.watcher = FakeWatcher()
+        self.cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, watcher=self.watcher)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def test_patch(self):
+        a, b = self._path("src", "a.c"), self._path("src", "b.c")
+        self.assertEqual(statuscache.UNCHANGED, self.cache.get_state(a))
+        self.assertTrue(self.watcher.is_watching(self.root))
+        self.status.status[0].append(os.path.join("src", "b.c"))
+        self.watcher.pending.add(b)
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.assertEqual(statuscache.MODIFIED, self.cache.get_state(b))
+        self.assertEqual(statuscache.UNCHANGED, self.cache.get_state(a))
+        self.assertEqual([self._path("src"), [b]], self.status.calls)
+        self.assertEqual(1, self.cache.stats()['patches'])
+
+    def test_removed_file(self):
+        c = self._path("src", "lib", "c.c")
+        self.cache.get_state(c)
+        del self.status.status[6][2]
+        self.watcher.pending.add(c)
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.assertEqual(statuscache.UNKNOWN, self.cache.get_state(c))
+
+    def test_no_dir_signature(self):
+        a = self._path("src", "a.c")
+        self.cache.get_state(a)
+        open(self._path("src", "new.c"), "w").close()
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.cache.get_state(a)
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_idle_repo_not_rescanned(self):
+        a = self._path("src", "a.c")
+        self.cache.get_state(a)
+        for i in range(3):
+            self.ticks += statuscache.CACHE_TIMEOUT
+            self.cache.get_state(a)
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_watcher_starting(self):
+        watcher = StartingWatcher()
+        cache = statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, watcher=watcher)
+        a = self._path("src", "a.c")
+        cache.get_state(a)
+        self.ticks += statuscache.CACHE_TIMEOUT
+        cache.get_state(a)
+        self.assertEqual(2, len(self.status.calls))
+        # loaded before the watcher started, the status still expires
+        watcher.start()
+        self.ticks += statuscache.CACHE_TIMEOUT
+        cache.get_state(a)
+        self.assertEqual(3, len(self.status.calls))
+        self.ticks += statuscache.CACHE_TIMEOUT
+        cache.get_state(a)
+        self.assertEqual(3, len(self.status.calls))
+
+    def test_lost_changes(self):
+        a = self._path("src", "a.c")
+        self.cache.get_state(a)
+        self.watcher.changes = lambda root: None
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.cache.get_state(a)
+        self.assertEqual(2, len(self.status.calls))
+
+class TestStatusSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_statuscache_")
+        self.root = os.path.join(self.tmpdir, "repo")
+        os.makedirs(os.path.join(self.root, ".git"))
+        os.makedirs(os.path.join(self.root, "src", "lib"))
+        self.ticks = 0
+        self.status = FakeStatus((
+                [os.path.join("src", "b.c")], [], [], [], [], [],
+                [os.path.join("src", "a.c"), os.path.join("src", "lib", "c.c")]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, *args):
+        return os.path.join(self.root, *args)
+
+    def _cache(self, **opts):
+        return statuscache.StatusCache(status_func=self.status,
+                tick_count=lambda: self.ticks, snapshots=True, **opts)
+
+    def _snapshot(self):
+        cache = self._cache()
+        cache.get_state(self._path("src", "a.c"))
+        cache.close()
+        self.assertTrue(os.path.exists(statuscache.snapshot_path(self.root)))
+        del self.status.calls[:]
+
+    def test_restore(self):
+        self._snapshot()
+        cache = self._cache()
+        self.assertEqual(statuscache.MODIFIED,
+                cache.get_state(self._path("src", "b.c")))
+        self.assertEqual(statuscache.UNCHANGED,
+                cache.get_state(self._path("src", "lib")))
+        self.assertEqual([], self.status.calls)
+        self.assertEqual(1, cache.stats()['restored'])
+
+    def test_repo_changed(self):
+        self._snapshot()
+        open(self._path(".git", "index"), "w").close()
+        cache = self._cache()
+        cache.get_state(self._path("src", "b.c"))
+        self.assertEqual(1, len(self.status.calls))
+        self.assertEqual(0, cache.stats()['restored'])
+
+    def test_dir_changed(self):
+        self._snapshot()
+        open(self._path("src", "new.c"), "w").close()
+        cache = self._cache()
+        cache.get_state(self._path("src", "b.c"))
+        self.assertEqual([], self.status.calls)
+        self.ticks += statuscache.CHECK_INTERVAL
+        cache.get_state(self._path("src", "b.c"))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_watched_dir_changed(self):
+        self._snapshot()
+        cache = self._cache(watcher=FakeWatcher())
+        cache.get_state(self._path("src", "b.c"))
+        open(self._path("src", "new.c"), "w").close()
+        self.ticks += statuscache.CHECK_INTERVAL
+        cache.get_state(self._path("src", "b.c"))
+        self.assertEqual(1, len(self.status.calls))
+
+    def test_corrupt(self):
+        fd = open(statuscache.snapshot_path(self.root), "wb")
+        fd.write("garbage")
+        fd.close()
+        self.assertEqual(None, statuscache.read_snapshot(self.root))
+        self.assertEqual(statuscache.MODIFIED,
+                self._cache().get_state(self._path("src", "b.c")))
+
+    def test_malicious(self):
+        # a pickle running code when loaded, as an old snapshot was
+        marker = self._path("pwned")
+        payload = "cos\nsystem\n(S'touch %s'\ntR." % marker
+        for data in (payload, zlib.compress(payload, 1),
+                statuscache.SNAPSHOT_MAGIC + zlib.compress(payload, 1)):
+            fd = open(statuscache.snapshot_path(self.root), "wb")
+            fd.write(data)
+            fd.close()
+            self.assertEqual(None, statuscache.read_snapshot(self.root))
+            self._cache().get_state(self._path("src", "b.c"))
+            self.assertFalse(os.path.exists(marker))
+
+    def _write(self, snapshot):
+        fd = open(statuscache.snapshot_path(self.root), "wb")
+        fd.write(statuscache.SNAPSHOT_MAGIC +
+                zlib.compress(marshal.dumps(snapshot)))
+        fd.close()
+
+    def test_unexpected(self):
+        self._snapshot()
+        version, sig, dirs, groups = marshal.loads(zlib.decompress(open(
+                statuscache.snapshot_path(self.root), "rb").read()[
+                len(statuscache.SNAPSHOT_MAGIC):]))
+        self.assertTrue(statuscache.read_snapshot(self.root))
+        for snapshot in (
+                (version, sig, dirs, {"bogus" : ["a"]}),
+                (version, sig, dirs, {statuscache.MODIFIED : [u"/etc/x"]}),
+                (version, sig, [(os.path.join("..", "x"), 1)], groups),
+                (version, [sig], dirs, groups),
+                (version, sig, dirs)):
+            self._write(snapshot)
+            self.assertEqual(None, statuscache.read_snapshot(self.root))
+
+class TestRepoStatus(unittest.TestCase):
+    """
+    Test the scoped status against a real git repository.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="tgit_repostatus_")
+        self._git('init', '-q')
+        for f in ('top.c', 'src/a.c', 'src/b.c', 'src/lib/c.c'):
+            self._write(f)
+        self._write('.gitignore', 'build/\n*.o\n')
+        self._git('add', '.')
+        self._git('-c', 'user.name=test', '-c', 'user.email=test@test',
+                'commit', '-q', '-m', 'initial')
+        self._write('src/b.c', 'changed')
+        self._write('src/new.c')
+        self._write('src/a.o')
+        self._write('src/lib/new.c')
+        self._write('src/build/out')
+        self._write('src/tmp/x.c')
+        self._write('src/added.c')
+        self._git('add', 'src/added.c')
+        os.unlink(self._path('src/lib/c.c'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _path(self, f):
+        return os.path.join(self.root, os.path.normpath(f))
+
+    def _write(self, f, data='x'):
+        path = self._path(f)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        fd = open(path, 'w')
+        fd.write(data)
+        fd.close()
+
+    def _git(self, *args):
+        subprocess.check_call(('git',) + args, cwd=self.root)
+
+    def test_scoped(self):
+        status = statuscache.repo_status(self.root, self._path('src'))
+        modified, added, removed, deleted, unknown, ignored, clean = status
+        self.assertEqual(['src/b.c'], modified)
+        self.assertEqual(['src/added.c'], added)
+        self.assertEqual(['src/lib/c.c'], deleted)
+        self.assertEqual(['src/a.c'], clean)
+        self.assertEqual(['src/new.c', 'src/tmp'], sorted(unknown))
+        self.assertEqual(['src/a.o', 'src/build'], sorted(ignored))
+
+    def test_files(self):
+        files = [self._path('src/lib/new.c'), self._path('src/b.c'),
+                 self._path('top.c')]
+        status = statuscache.repo_status(self.root, self.root, files=files)
+        modified, added, removed, deleted, unknown, ignored, clean = status
+        self.assertEqual(['src/b.c'], modified)
+        self.assertEqual(['src/lib/new.c'], unknown)
+        self.assertEqual(['top.c'], clean)
+
+    def test_overlay_config(self):
+        self._git('config', 'tortoisehg.overlayicons', 'False')
+        self.assertEqual(['False'], statuscache.overlay_config(self.root)[1])
+        self._git('config', 'tortoisegit.overlayicons', 'True')
+        self.assertEqual(['True'], statuscache.overlay_config(self.root)[1])
+
+    def test_new_file_next_to_ignored(self):
+        ticks = [0]
+        watcher = fswatch.PollingWatcher(0, lambda: ticks[0],
+                background=False)
+        calls = []
+        def status(root, pdir, files=None):
+            calls.append(files or pdir)
+            return statuscache.repo_status(root, pdir, files)
+        cache = statuscache.StatusCache(status_func=status,
+                tick_count=lambda: ticks[0], watcher=watcher)
+        # an index newer than the files, so no status rewrites it
+        later = time.time() + 10
+        os.utime(self._path('.git/index'), (later, later))
+        watcher.watch(self.root)
+        watcher.scan_pending()
+        out = self._path('src/build/out')
+        self.assertEqual(statuscache.UNCHANGED,
+                cache.get_state(self._path('top.c')))
+        self.assertEqual(statuscache.UNCHANGED,
+                cache.get_state(self._path('src/a.c')))
+        self.assertEqual(statuscache.IGNORED, cache.get_state(out))
+        self._write('src/other.c')
+        ticks[0] += statuscache.CHECK_INTERVAL
+        cache.get_state(self._path('src/a.c'))
+        watcher.scan_pending()
+        ticks[0] += statuscache.CHECK_INTERVAL
+        self.assertEqual(statuscache.UNKNOWN,
+                cache.get_state(self._path('src/other.c')))
+        # the ignored directory next to the new file is still known
+        self.assertEqual(statuscache.IGNORED, cache.get_state(out))
+        self.assertEqual(statuscache.UNKNOWN,
+                cache.get_state(self._path('src/tmp')))
+        self.assertEqual(3, len(calls))
+
+    def test_dir_ignored(self):
+        os.makedirs(self._path('src/build/sub'))
+        self.assertTrue(statuscache.dir_ignored(self.root,
+                self._path('src/build/sub')))
+        self.assertFalse(statuscache.dir_ignored(self.root,
+                self._path('src/tmp')))
+
+class TestSubmodules(unittest.TestCase):
+    """
+    Test submodule boundaries and roll-up against real repositories.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_submodules_")
+        lib = os.path.join(self.tmpdir, 'lib')
+        self.root = os.path.join(self.tmpdir, 'super')
+        for repo, f in ((lib, 'lib.c'), (self.root, 'main.c')):
+            os.makedirs(repo)
+            self._git(repo, 'init', '-q')
+            self._write(os.path.join(repo, f))
+            self._git(repo, 'add', f)
+            self._git(repo, 'commit', '-q', '-m', 'initial')
+        self._git(self.root, '-c', 'protocol.file.allow=always',
+                'submodule', '-q', 'add', lib, 'ext/lib')
+        self._git(self.root, 'commit', '-q', '-m', 'add submodule')
+        self.sub = os.path.join(self.root, 'ext', 'lib')
+        self.ticks = 0
+        self.cache = statuscache.StatusCache(tick_count=lambda: self.ticks)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, path, data='x'):
+        fd = open(path, 'w')
+        fd.write(data)
+        fd.close()
+
+    def _git(self, cwd, *args):
+        subprocess.check_call(('git', '-c', 'user.name=test',
+                '-c', 'user.email=test@test') + args, cwd=cwd)
+
+    def test_find_root(self):
+        self.assertEqual(self.sub,
+                tgitutil.find_root(os.path.join(self.sub, 'lib.c')))
+        self.assertEqual(os.path.join(self.root, '.git', 'modules', 'ext',
+                'lib'), tgitutil.git_dir(self.sub))
+
+    def test_roll_up(self):
+        get_state = self.cache.get_state
+        self.assertEqual(statuscache.UNCHANGED, get_state(self.sub))
+        self.assertEqual(statuscache.UNCHANGED,
+                get_state(os.path.join(self.sub, 'lib.c')))
+        self._write(os.path.join(self.sub, 'lib.c'), 'changed')
+        self.ticks += statuscache.CACHE_TIMEOUT
+        self.assertEqual(statuscache.MODIFIED, get_state(self.sub))
+        self.assertEqual(statuscache.MODIFIED,
+                get_state(os.path.join(self.root, 'ext')))
+        self.assertEqual(statuscache.MODIFIED,
+                get_state(os.path.join(self.sub, 'lib.c')))
+        self._git(self.sub, 'checkout', '-q', 'lib.c')
+        self.ticks += statuscache.CACHE_TIMEOUT
+        self.assertEqual(statuscache.UNCHANGED, get_state(self.sub))
+
+    def test_new_commit(self):
+        self.cache.get_state(self.sub)
+        self._write(os.path.join(self.sub, 'new.c'))
+        self._git(self.sub, 'add', 'new.c')
+        self._git(self.sub, 'commit', '-q', '-m', 'new')
+        self.ticks += statuscache.CHECK_INTERVAL
+        self.assertEqual(statuscache.MODIFIED, self.cache.get_state(self.sub))
+
+if tgitutil.find_path('git') is None:
+    del TestRepoStatus
+    del TestSubmodules
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import unittest
+from tortoisegit.statustrie import StatusTrie
+
+PRIORITY = ('modified', 'added', 'unchanged', 'unknown')
+
+def _p(*args):
+    return os.path.join(*args)
+
+class TestStatusTrie(unittest.TestCase):
+    def setUp(self):
+        self.trie = StatusTrie(PRIORITY)
+        self.trie.load('', [(_p('a', 'b', 'c.txt'), 'unchanged'),
+                            (_p('a', 'b', 'd.txt'), 'unknown'),
+                            (_p('a', 'e.txt'), 'unchanged'),
+                            ('f.txt', 'added')])
+
+    def test_file_state(self):
+        self.assertEqual('unknown', self.trie.get(_p('a', 'b', 'd.txt')))
+        self.assertEqual(None, self.trie.get(_p('a', 'x.txt')))
+        self.assertEqual(4, len(self.trie))
+
+    def test_dir_state(self):
+        self.assertEqual('unchanged', self.trie.get('a'))
+        self.assertEqual('added', self.trie.get(''))
+        self.trie.set(_p('a', 'b', 'c.txt'), 'modified')
+        self.assertEqual('modified', self.trie.get(_p('a', 'b')))
+        self.assertEqual('modified', self.trie.get('a'))
+        self.trie.set(_p('a', 'b', 'c.txt'), 'unchanged')
+        self.assertEqual('unchanged', self.trie.get('a'))
+
+    def test_remove(self):
+        self.trie.remove(_p('a', 'b', 'c.txt'))
+        self.assertEqual('unknown', self.trie.get(_p('a', 'b')))
+        self.trie.remove(_p('a', 'b', 'd.txt'))
+        self.assertEqual(None, self.trie.get(_p('a', 'b')))
+        self.assertEqual('unchanged', self.trie.get('a'))
+        self.assertEqual(2, len(self.trie))
+
+    def test_remove_dir(self):
+        self.trie.remove('a')
+        self.assertEqual(None, self.trie.get(_p('a', 'e.txt')))
+        self.assertEqual(1, len(self.trie))
+
+    def test_load(self):
+        self.trie.load('a', [(_p('a', 'g.txt'), 'modified')])
+        self.assertEqual(None, self.trie.get(_p('a', 'b', 'c.txt')))
+        self.assertEqual('modified', self.trie.get(''))
+        self.assertEqual(2, len(self.trie))
+
+    def test_file_becomes_dir(self):
+        self.trie.set(_p('f.txt', 'g.txt'), 'unknown')
+        self.assertEqual('unknown', self.trie.get('f.txt'))
+        self.assertEqual('unchanged', self.trie.get(''))
+        self.trie.set('a', 'modified')
+        self.assertEqual(2, len(self.trie))
+
+    def test_prune_keep(self):
+        self.trie.prune('a', keep=[_p('a', 'b')])
+        self.assertEqual('unchanged', self.trie.get(_p('a', 'b', 'c.txt')))
+        self.assertEqual(None, self.trie.get(_p('a', 'e.txt')))
+        self.assertEqual(3, len(self.trie))
+
+    def test_items(self):
+        self.assertEqual([(_p('a', 'b', 'c.txt'), 'unchanged'),
+                          (_p('a', 'b', 'd.txt'), 'unknown'),
+                          (_p('a', 'e.txt'), 'unchanged'),
+                          ('f.txt', 'added')], sorted(self.trie.items()))
+        self.assertEqual([_p('a', 'e.txt')],
+                [p for p, st in self.trie.items('a') if st == 'unchanged'
+                 and not p.startswith(_p('a', 'b'))])
+        self.assertEqual([], list(self.trie.items('nothere')))
+
+    def test_covering(self):
+        self.trie.set('build', 'ignored')
+        self.assertEqual(('build', 'ignored'),
+                self.trie.covering(_p('build', 'x', 'y')))
+        self.assertEqual(('build', 'ignored'), self.trie.covering('build'))
+        self.assertEqual(None, self.trie.covering(_p('a', 'b')))
+        self.assertEqual(None, self.trie.covering(_p('a', 'x', 'y')))
+
+if __name__ == '__main__':
+    unittest.main()
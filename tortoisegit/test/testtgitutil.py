@@ -0,0 +1,139 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from tortoisegit import tgitutil
+
+class FakeClock(object):
+    def __init__(self):
+        self.tc = 0
+
+    def __call__(self):
+        return self.tc
+
+class TestRootCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = os.path.realpath(tempfile.mkdtemp(prefix="tgit_root_"))
+        self.root = os.path.join(self.tmpdir, "repo")
+        self.sub = os.path.join(self.root, "a", "b")
+        os.makedirs(self.sub)
+        os.mkdir(os.path.join(self.root, ".git"))
+        self.clock = FakeClock()
+        self.cache = tgitutil.RootCache(timeout=1000, tick_count=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_positive(self):
+        self.assertEqual(self.root, self.cache.find_root(self.sub))
+        self.assertEqual(1, self.cache.misses)
+        # every directory walked through is cached
+        self.assertEqual(self.root,
+                self.cache.find_root(os.path.join(self.root, "a", "f")))
+        self.assertEqual(self.root, self.cache.find_root(self.root))
+        self.assertEqual(2, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+
+    def test_negative(self):
+        outside = os.path.join(self.tmpdir, "other", "x")
+        os.makedirs(outside)
+        if tgitutil.find_root(self.tmpdir) is not None:
+            return      # temp dir inside a repository
+        self.assertEqual(None, self.cache.find_root(outside))
+        self.assertEqual(None, self.cache.find_root(outside))
+        self.assertEqual(1, self.cache.hits)
+
+    def test_git_removed(self):
+        self.cache.find_root(self.sub)
+        os.rename(os.path.join(self.root, ".git"),
+                  os.path.join(self.sub, ".git"))
+        self.assertEqual(self.sub, self.cache.find_root(self.sub))
+
+    def test_git_created(self):
+        nested = os.path.join(self.root, "a")
+        self.cache.find_root(self.sub)
+        open(os.path.join(nested, ".git"), "w").close()
+        # not noticed until reported or expired
+        self.assertEqual(self.root, self.cache.find_root(self.sub))
+        self.cache.invalidate(nested)
+        self.assertEqual(nested, self.cache.find_root(self.sub))
+        self.assertEqual(self.root, self.cache.find_root(self.root))
+
+    def test_timeout(self):
+        self.cache.find_root(self.sub)
+        os.mkdir(os.path.join(self.sub, ".git"))
+        self.clock.tc = 500
+        self.assertEqual(self.root, self.cache.find_root(self.sub))
+        self.clock.tc = 1000
+        self.assertEqual(self.sub, self.cache.find_root(self.sub))
+
+    def test_file(self):
+        path = os.path.join(self.sub, "f")
+        open(path, "w").close()
+        self.assertEqual(self.root, self.cache.find_root(path))
+
+class TestListFile(unittest.TestCase):
+    def setUp(self):
+        self.paths = ["a", os.path.join("dir", "with space"), "new\nline"]
+        self.name = tgitutil.write_list_file(self.paths)
+
+    def tearDown(self):
+        os.unlink(self.name)
+
+    def test_roundtrip(self):
+        self.assertEqual(self.paths, list(tgitutil.read_list_file(self.name)))
+        # paths split across reads
+        self.assertEqual(self.paths,
+                list(tgitutil.read_list_file(self.name, bufsize=3)))
+
+    def test_newline_list(self):
+        fd = open(self.name, "w")
+        fd.write("a\nb c\nd")
+        fd.close()
+        self.assertEqual(["a", "b c", "d"],
+                list(tgitutil.read_list_file(self.name)))
+
+class TestIconCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="tgit_icons_")
+        for name in ("a.ico", "b.ico", "readme.txt"):
+            open(os.path.join(self.tmpdir, name), "w").close()
+        self.size = (16, 16)
+        self.rendered = []
+        self.cache = tgitutil.IconCache(lambda: self.tmpdir, self._render,
+                lambda: self.size)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _render(self, path, cx, cy):
+        self.rendered.append((os.path.basename(path), cx, cy))
+        return (os.path.basename(path), cx, cy)
+
+    def test_first_get(self):
+        bitmap = self.cache.get("a.ico")
+        self.assertEqual(("a.ico", 16, 16), bitmap)
+        self.assertEqual(1, self.cache.misses)
+        self.cache.prerender(wait=True)
+        self.assertTrue(self.cache.get("a.ico") is bitmap)
+        self.assertEqual(("b.ico", 16, 16), self.cache.get("b.ico"))
+        self.assertEqual(1, self.cache.misses)
+
+    def test_prerendered(self):
+        self.cache.prerender(wait=True)
+        self.assertEqual(2, len(self.rendered))
+        self.assertEqual(("b.ico", 16, 16), self.cache.get("b.ico"))
+        self.assertEqual(None, self.cache.get("c.ico"))
+        self.assertEqual(None, self.cache.get("readme.txt"))
+        self.assertEqual(0, self.cache.misses)
+        self.assertEqual(2, len(self.rendered))
+
+    def test_metrics_changed(self):
+        self.cache.prerender(wait=True)
+        self.size = (20, 20)
+        self.assertEqual(("a.ico", 20, 20), self.cache.get("a.ico"))
+        self.assertEqual(1, self.cache.misses)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+#
+# pure-Python stand-ins for the pywin32 modules used by the overlay
+# handlers, so that they can be loaded and timed without Windows
+#
+
+import sys
+import time
+import types
+
+class _Clock(object):
+    """
+    GetTickCount() replacement; advance() moves it forward, so that
+    benchmarks don't have to sleep through cache check intervals.
+    """
+    def __init__(self):
+        self.offset = 0
+
+    def __call__(self):
+        return int(time.time() * 1000) + self.offset
+
+    def advance(self, ticks):
+        self.offset += ticks
+
+clock = _Clock()
+
+def _module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    sys.modules[name] = mod
+    return mod
+
+def _noop(*args, **kwargs):
+    return None
+
+def install():
+    """
+    Register the stubs in sys.modules; return False (and do nothing)
+    if the real pywin32 is available.
+    """
+    try:
+        import win32api
+        if not getattr(win32api, '_stub', False):
+            return False
+    except ImportError:
+        pass
+
+    _module('win32api', _stub=True, GetTickCount=clock,
+            GetSystemMetrics=lambda index: 16)
+    _module('win32con', CREATE_NO_WINDOW=0x08000000, SM_CXMENUCHECK=71,
+            SM_CYMENUCHECK=72, IMAGE_ICON=1, LR_LOADFROMFILE=0x10,
+            COLOR_MENU=4, DI_NORMAL=3)
+    shell = _module('win32com.shell.shell',
+            IID_IShellIconOverlayIdentifier='{0C6C4200-C589-11D0-999A-00C04FD655E1}',
+            SHChangeNotify=_noop,
+            SHILCreateFromPath=lambda path, attrs: (path, 0),
+            SHGetPathFromIDList=lambda pidl: pidl)
+    shellcon = _module('win32com.shell.shellcon', SHCNE_UPDATEITEM=0x2000,
+            SHCNE_UPDATEDIR=0x1000, SHCNF_IDLIST=0, SHCNF_FLUSHNOWAIT=0x2000)
+    _module('win32com.shell', shell=shell, shellcon=shellcon)
+    _module('win32com', shell=sys.modules['win32com.shell'])
+    _module('_winreg', HKEY_LOCAL_MACHINE=0x80000002,
+            HKEY_CURRENT_USER=0x80000001)
+    return True
@@ -8,6 +8,9 @@ of the GNU General Public License, incorporated herein by reference.
 """
 
 import os.path, re
+import time
+import tempfile
+import threading
 
 _quotere = None
 def shellquote(s):
@@ -17,14 +20,270 @@ def shellquote(s):
     return '"%s"' % _quotere.sub(r'\1\1\\\2', s)
     return "'%s'" % s.replace("'", "'\\''")
 
+# ticks a cached repository root is trusted for without a .git
+# appearing or disappearing being reported, and number of directories
+# cached
+ROOT_TIMEOUT = 30000
+MAX_ROOT_DIRS = 8192
+
+def _get_tick_count():
+    return int(time.time() * 1000)
+
+class RootCache(object):
+    """
+    Memoized repository root discovery.
+
+    Every directory walked through by a lookup remembers the root it
+    is in, or that it is in none, so that the next lookup below it
+    stops there instead of probing each parent for .git.  Answers are
+    trusted for ROOT_TIMEOUT ticks; the .git of a cached root is
+    checked on each hit, and invalidate() drops the directories below
+    a .git known to have appeared or disappeared.
+    """
+
+    def __init__(self, timeout=ROOT_TIMEOUT, maxdirs=MAX_ROOT_DIRS,
+            tick_count=_get_tick_count):
+        self._timeout = timeout
+        self._maxdirs = maxdirs
+        self._tick_count = tick_count
+        self._lock = threading.Lock()
+        self._dirs = {}     # dir -> (root or None, tick)
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, p, tc):
+        try:
+            root, tick = self._dirs[p]
+        except KeyError:
+            return None
+        if tc - tick >= self._timeout:
+            del self._dirs[p]
+            return None
+        # .git files of submodules count as well
+        if root is not None and \
+                not os.path.exists(os.path.join(root, ".git")):
+            self._invalidate(root)
+            return None
+        return root, tick
+
+    def find_root(self, path):
+        """return the root of the repository containing path, or None"""
+        p = os.path.isdir(path) and path or os.path.dirname(path)
+        tc = self._tick_count()
+        walked = []
+        self._lock.acquire()
+        try:
+            while True:
+                cached = self._cached(p, tc)
+                if cached is not None:
+                    # directories below expire with the one cached
+                    root, tick = cached
+                    self.hits += 1
+                    break
+                walked.append(p)
+                if os.path.exists(os.path.join(p, ".git")):
+                    root, tick = p, tc
+                    self.misses += 1
+                    break
+                oldp = p
+                p = os.path.dirname(p)
+                if p == oldp:
+                    root, tick = None, tc
+                    self.misses += 1
+                    break
+            if len(self._dirs) + len(walked) > self._maxdirs:
+                self._dirs.clear()
+            for d in walked:
+                self._dirs[d] = (root, tick)
+            return root
+        finally:
+            self._lock.release()
+
+    def _invalidate(self, path):
+        prefix = path.rstrip(os.sep) + os.sep
+        for d in self._dirs.keys():
+            if d == path or d.startswith(prefix):
+                del self._dirs[d]
+
+    def invalidate(self, path=None):
+        """
+        forget the roots of all directories, or of path and the
+        directories below it (after a .git at path came or went)
+        """
+        self._lock.acquire()
+        try:
+            if path is None:
+                self._dirs.clear()
+            else:
+                self._invalidate(path)
+        finally:
+            self._lock.release()
+
+root_cache = RootCache()
+
 def find_root(path):
-    p = os.path.isdir(path) and path or os.path.dirname(path)
-    while not os.path.isdir(os.path.join(p, ".git")):
-        oldp = p
-        p = os.path.dirname(p)
-        if p == oldp:
+    return root_cache.find_root(path)
+
+def write_list_file(paths, prefix="tortoisegit_filelist_"):
+    """write paths NUL separated to a new temporary file, return its name"""
+    fd, name = tempfile.mkstemp(prefix=prefix)
+    f = os.fdopen(fd, 'wb')
+    try:
+        for path in paths:
+            f.write(path + '\0')
+    finally:
+        f.close()
+    return name
+
+def read_list_file(name, bufsize=65536):
+    """
+    iterate over the paths of a list file, without reading it whole;
+    lists written before they were NUL separated have a path per line
+    """
+    fd = open(name, 'rb')
+    try:
+        sep = None
+        rest = ''
+        while True:
+            data = fd.read(bufsize)
+            if not data:
+                break
+            if sep is None:
+                sep = '\0' in data and '\0' or '\n'
+            paths = (rest + data).split(sep)
+            rest = paths.pop()
+            for path in paths:
+                if path:
+                    yield path
+        if rest:
+            yield rest
+    finally:
+        fd.close()
+
+def git_dir(root):
+    """return the git directory of the working directory at root"""
+    dotgit = os.path.join(root, ".git")
+    if os.path.isfile(dotgit):
+        try:
+            fd = open(dotgit)
+            try:
+                line = fd.readline().strip()
+            finally:
+                fd.close()
+            if line.startswith("gitdir: "):
+                return os.path.normpath(os.path.join(root, line[8:]))
+        except IOError:
+            pass
+    return dotgit
+
+class IconCache(object):
+    """
+    Menu icon bitmaps, rendered ahead of time.
+
+    Bitmaps depend on the menu check mark size, which changes with the
+    display DPI: metrics() returns the current (cx, cy), and for each
+    size every icon of icon_dir() is drawn by render(path, cx, cy) in
+    a background thread.  An icon asked for by get() before that thread
+    drew it is drawn there and then, once, so that the first menu has
+    its icons.
+    """
+
+    def __init__(self, icon_dir, render, metrics):
+        self._icon_dir = icon_dir
+        self._render = render
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._bitmaps = {}      # "cx:cy" -> {icon name: bitmap or None}
+        self._pending = {}      # "cx:cy" -> rendering thread
+        self._done = set()      # "cx:cy" of the sizes fully rendered
+        self.misses = 0
+
+    def _key(self):
+        cx, cy = self._metrics()
+        return "%d:%d" % (cx, cy), cx, cy
+
+    def get(self, name):
+        """return the bitmap of icon name for the current menu metrics"""
+        key, cx, cy = self._key()
+        self._lock.acquire()
+        try:
+            bitmaps = self._bitmaps.setdefault(key, {})
+            if name in bitmaps or key in self._done:
+                return bitmaps.get(name)
+            self.misses += 1
+        finally:
+            self._lock.release()
+        self._start(key, cx, cy)
+        bitmap = self._render_icon(self._icon_dir(), name, cx, cy)
+        return self._add(key, name, bitmap)
+
+    def prerender(self, wait=False):
+        """
+        render the icons for the current menu metrics, if not done or
+        under way yet; wait for them if wait
+        """
+        key, cx, cy = self._key()
+        thread = self._start(key, cx, cy)
+        if wait and thread is not None:
+            thread.join()
+
+    def _start(self, key, cx, cy):
+        self._lock.acquire()
+        try:
+            if key in self._done:
+                return None
+            if key in self._pending:
+                return self._pending[key]
+            thread = threading.Thread(target=self._render_all,
+                    args=(key, cx, cy))
+            thread.setDaemon(True)
+            self._pending[key] = thread
+            thread.start()
+            return thread
+        finally:
+            self._lock.release()
+
+    def _add(self, key, name, bitmap):
+        """keep bitmap, unless the other thread drew the icon first"""
+        self._lock.acquire()
+        try:
+            return self._bitmaps.setdefault(key, {}).setdefault(name, bitmap)
+        finally:
+            self._lock.release()
+
+    def _render_icon(self, icon_dir, name, cx, cy):
+        if not icon_dir or not name.lower().endswith('.ico'):
             return None
-    return p
+        path = os.path.join(icon_dir, name)
+        if not os.path.isfile(path):
+            return None
+        try:
+            return self._render(path, cx, cy)
+        except Exception, inst:
+            print "icon %s: %s" % (name, inst)
+            return None
+
+    def _render_all(self, key, cx, cy):
+        try:
+            icon_dir = self._icon_dir()
+            names = icon_dir and os.listdir(icon_dir) or []
+            for name in names:
+                self._lock.acquire()
+                try:
+                    drawn = name in self._bitmaps.setdefault(key, {})
+                finally:
+                    self._lock.release()
+                if not drawn:
+                    self._add(key, name,
+                            self._render_icon(icon_dir, name, cx, cy))
+        except Exception, inst:
+            print "menu icons: %s" % inst
+        self._lock.acquire()
+        try:
+            self._done.add(key)
+            del self._pending[key]
+        finally:
+            self._lock.release()
 
 if os.name == 'nt':
     from win32com.shell import shell, shellcon
@@ -59,6 +318,14 @@ if os.name == 'nt':
                              pidl,
                              None)
 
+    def shell_notify_dir(path):
+        pidl, ignore = shell.SHILCreateFromPath(path, 0)
+        print "notify dir: ", shell.SHGetPathFromIDList(pidl)
+        shell.SHChangeNotify(shellcon.SHCNE_UPDATEDIR,
+                             shellcon.SHCNF_IDLIST | shellcon.SHCNF_FLUSHNOWAIT,
+                             pidl,
+                             None)
+
     def get_icon_path(*args):
         dir = get_prog_root()
         icon = os.path.join(dir, "icons", *args)
@@ -87,30 +354,22 @@ if os.name == 'nt':
                 return info['status'] == USE_OK
         return None
     
-    bitmap_cache = {}
-    def icon_to_bitmap(iconPathName):
+    def menu_metrics():
+        """size of the menu check mark, which menu bitmaps must fit"""
+        return (GetSystemMetrics(win32con.SM_CXMENUCHECK),
+                GetSystemMetrics(win32con.SM_CYMENUCHECK))
+
+    def render_bitmap(iconPathName, cx, cy):
         """
         create a bitmap based converted from an icon.
 
         adapted from pywin32's demo program win32gui_menu.py
         """
-        global bitmap_cache
-            
-        cx = GetSystemMetrics(win32con.SM_CXMENUCHECK)
-        cy = GetSystemMetrics(win32con.SM_CYMENUCHECK)
-        
         # use icon image with size smaller but closer to menu size
         if cx >= 16:
             ico_x = ico_y = 16
         else:
             ico_x = ico_y = 12
-        ico_idx = "%d:%d", (cx, cy)
-        
-        # see if icon has been cached
-        try:
-            return bitmap_cache[iconPathName][ico_idx]
-        except:
-            pass
 
         hicon = LoadImage(0, iconPathName, win32con.IMAGE_ICON, ico_x, ico_y, 
                 win32con.LR_LOADFROMFILE)
@@ -128,22 +387,28 @@ if os.name == 'nt':
         # the icon, so that the icon will be display as closely level to the
         # menu text as possible.
         startx = int((cx-ico_x)/2)
-        starty = int((cx-ico_y)/2)    
+        starty = int((cy-ico_y)/2)    
         DrawIconEx(hdcBitmap, startx, starty, hicon, ico_x, ico_y, 0, 0,
                 win32con.DI_NORMAL)
                 
-        # store bitmap to cache
-        if iconPathName not in bitmap_cache:
-            bitmap_cache[iconPathName] = {}
-        bitmap_cache[iconPathName][ico_idx] = hbm
-        
         # restore settings
         SelectObject(hdcBitmap, hbmOld)
         DeleteDC(hdcBitmap)
+        ReleaseDC(0, hdcScreen)
         DestroyIcon(hicon)
         
         return hbm
 
+    def _icon_dir():
+        return os.path.join(get_prog_root(), "icons", "tortoise")
+
+    # bitmaps of the context menu icons, shared by all menu handlers
+    icon_cache = IconCache(_icon_dir, render_bitmap, menu_metrics)
+
+    def icon_to_bitmap(iconPathName):
+        """bitmap of a menu icon, or None if it can't be drawn"""
+        return icon_cache.get(os.path.basename(iconPathName))
+
 else: # Not Windows
 
     def find_path(pgmname, path=None, ext=None):
@@ -159,8 +424,14 @@ else: # Not Windows
     def shell_notify(path):
         pass
 
+    def shell_notify_dir(path):
+        pass
+
     def get_icon_path(*args):
         return None
+
+    def netdrive_status(drive):
+        return None
         
     def get_prog_root():
         defpath = os.path.dirname(os.path.dirname(__file__))
@@ -169,3 +440,6 @@ else: # Not Windows
 
     def icon_to_bitmap(iconPathName):
         pass
+
+    icon_cache = IconCache(lambda: None, lambda path, cx, cy: None,
+            lambda: (0, 0))